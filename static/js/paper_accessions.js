@@ -0,0 +1,49 @@
+// Fills the accession choices of the papers page modals when they are first opened,
+// from /papers/<doi>/accessions/ (one request per publication).
+const accessionRequests = {};
+
+function fetchAccessions(url) {
+  if (!(url in accessionRequests)) {
+    accessionRequests[url] = fetch(url).then(function (response) {
+      if (!response.ok) {
+        delete accessionRequests[url];
+        throw new Error(response.status + ' ' + response.statusText);
+      }
+      return response.json();
+    });
+  }
+  return accessionRequests[url];
+}
+
+function renderAccessions(container, choices) {
+  const field = container.dataset.field;
+  const group = document.createElement('div');
+  group.className = 'form-group';
+  const label = document.createElement('label');
+  label.htmlFor = 'id_' + field;
+  label.innerText = 'Select files to import:';
+  const select = document.createElement('select');
+  select.name = field;
+  select.id = 'id_' + field;
+  select.className = 'selectmultiple form-control';
+  select.multiple = true;
+  select.size = Math.min(10, choices.length);
+  choices.forEach(function (choice) {
+    select.add(new Option(choice[1], choice[0]));
+  });
+  group.appendChild(label);
+  group.appendChild(select);
+  container.replaceChildren(group);
+}
+
+$(document).on('show.bs.modal', '.modal', function () {
+  this.querySelectorAll('.accession-choices:not([data-loaded])').forEach(function (container) {
+    container.dataset.loaded = 'true';
+    fetchAccessions(container.dataset.url).then(function (accessions) {
+      renderAccessions(container, accessions[container.dataset.field] || []);
+    }).catch(function (error) {
+      delete container.dataset.loaded;
+      container.innerText = 'Could not load the files of this publication (' + error.message + ').';
+    });
+  });
+});
@@ -0,0 +1,308 @@
+"""
+Process-wide caches for the portal's Globus credentials and collection metadata.
+
+Client-credential grants are slow (one round trip to auth.globus.org each) and the tokens they
+return stay valid for hours, so they are cached here and shared by every request a worker serves.
+The same goes for a collection's HTTPS server, which practically never changes, and for the
+admin TransferClients (and their HTTP sessions) used for ACL and directory management, and for
+the per-user client bundles built from each user's social auth tokens.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import globus_sdk
+from django.core.cache import cache as django_cache
+
+from .. import settings
+from ..caching import RefreshingCache
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_SCOPE = 'urn:globus:auth:scope:transfer.api.globus.org:all'
+
+
+def _cache_settings():
+    return getattr(settings, 'GLOBUS_CACHE', {})
+
+
+class CachedTokenResponse:
+    """
+    Read-only stand-in for globus_sdk.OAuthTokenResponse. Only exposes by_resource_server, which is
+    all the portal reads from a token response.
+    """
+
+    def __init__(self, by_resource_server):
+        self.by_resource_server = by_resource_server
+
+
+class TokenCache:
+    """
+    Caches client-credential tokens keyed by the set of requested scopes.
+
+    Tokens are held until `leeway` seconds before the earliest expires_at_seconds in the grant.
+    Refreshes are done under a per-key lock so that concurrent requests wait for a single grant
+    instead of each running their own. If `shared` is True, grants are also written to the
+    configured Django cache so that other workers can pick them up.
+
+    :param fetch: callable taking a list of scopes and returning an OAuthTokenResponse
+    :param leeway: int, seconds before expiry at which a token is considered stale
+    :param shared: bool, whether to read/write tokens through django.core.cache
+    """
+
+    def __init__(self, fetch, leeway=300, shared=False, key_prefix='globus-tokens'):
+        self._fetch = fetch
+        self._leeway = leeway
+        self._shared = shared
+        self._key_prefix = key_prefix
+        self._entries = {}  # scope key -> (expires_at, by_resource_server)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    @staticmethod
+    def scope_key(scopes):
+        return ' '.join(sorted(set(scopes)))
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _is_fresh(self, entry):
+        return entry is not None and entry[0] - self._leeway > time.time()
+
+    def _shared_key(self, key):
+        return f'{self._key_prefix}:{hashlib.sha1(key.encode("utf-8")).hexdigest()}'
+
+    def _shared_get(self, key):
+        if not self._shared:
+            return None
+        try:
+            return django_cache.get(self._shared_key(key))
+        except Exception as e:
+            logger.error(f"Could not read shared globus token cache: {e}")
+            return None
+
+    def _shared_set(self, key, entry):
+        if not self._shared:
+            return
+        timeout = int(entry[0] - self._leeway - time.time())
+        if timeout <= 0:
+            return
+        try:
+            django_cache.set(self._shared_key(key), entry, timeout)
+        except Exception as e:
+            logger.error(f"Could not write shared globus token cache: {e}")
+
+    def get(self, scopes):
+        """
+        Returns a CachedTokenResponse for scopes, running a client-credentials grant only if there
+        is no unexpired token for this exact set of scopes.
+        """
+        key = self.scope_key(scopes)
+        entry = self._entries.get(key)
+        if self._is_fresh(entry):
+            self._count('hits')
+            return CachedTokenResponse(entry[1])
+
+        with self._lock_for(key):
+            # another thread may have refreshed while we were waiting on the lock
+            entry = self._entries.get(key)
+            if self._is_fresh(entry):
+                self._count('hits')
+                return CachedTokenResponse(entry[1])
+
+            entry = self._shared_get(key)
+            if self._is_fresh(entry):
+                self._count('shared_hits')
+                self._entries[key] = entry
+                return CachedTokenResponse(entry[1])
+
+            self._count('misses')
+            tokens = self._fetch(list(scopes))
+            by_resource_server = dict(tokens.by_resource_server)
+            expires_at = min(t['expires_at_seconds'] for t in by_resource_server.values())
+            entry = (expires_at, by_resource_server)
+            self._entries[key] = entry
+            self._shared_set(key, entry)
+            return CachedTokenResponse(by_resource_server)
+
+    def invalidate(self, scopes=None):
+        """
+        Drops cached tokens for scopes, or every cached token if scopes is None.
+        """
+        keys = list(self._entries.keys()) if scopes is None else [self.scope_key(scopes)]
+        for key in keys:
+            self._entries.pop(key, None)
+            if self._shared:
+                try:
+                    django_cache.delete(self._shared_key(key))
+                except Exception as e:
+                    logger.error(f"Could not invalidate shared globus token cache: {e}")
+
+    def stats(self):
+        """
+        Returns hit/miss counters. Every hit (local or shared) is an auth round trip saved.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['saved_grants'] = stats['hits'] + stats['shared_hits']
+        stats['cached_scope_sets'] = len(self._entries)
+        return stats
+
+
+_portal_client = None
+_portal_client_lock = threading.Lock()
+
+
+def get_portal_client():
+    """
+    Returns the process-wide ConfidentialAppAuthClient for the portal.
+    """
+    global _portal_client
+    if _portal_client is None:
+        with _portal_client_lock:
+            if _portal_client is None:
+                _portal_client = globus_sdk.ConfidentialAppAuthClient(
+                    settings.SOCIAL_AUTH_GLOBUS_KEY, settings.SOCIAL_AUTH_GLOBUS_SECRET)
+    return _portal_client
+
+
+def _request_tokens(scopes):
+    return get_portal_client().oauth2_client_credentials_tokens(requested_scopes=scopes)
+
+
+token_cache = TokenCache(
+    fetch=_request_tokens,
+    leeway=_cache_settings().get('token_leeway', 300),
+    shared=_cache_settings().get('share_tokens', False),
+)
+
+
+class AdminClientRegistry:
+    """
+    Hands out one admin TransferClient per collection endpoint for the lifetime of the process.
+
+    Each client is authorized with a ClientCredentialsAuthorizer, seeded from token_cache, which
+    renews its own token shortly before it expires. Clients keep their requests session, so
+    repeated admin operations reuse both the token and the open HTTPS connections.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _build(self, endpoint_id):
+        token = token_cache.get([TRANSFER_SCOPE]).by_resource_server["transfer.api.globus.org"]
+        authorizer = globus_sdk.ClientCredentialsAuthorizer(
+            get_portal_client(),
+            TRANSFER_SCOPE,
+            access_token=token["access_token"],
+            expires_at=token["expires_at_seconds"],
+        )
+        logger.debug(f"Built admin transfer client for {endpoint_id}")
+        return globus_sdk.TransferClient(authorizer=authorizer)
+
+    def get(self, endpoint_id):
+        client = self._clients.get(endpoint_id)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(endpoint_id)
+                if client is None:
+                    client = self._build(endpoint_id)
+                    self._clients[endpoint_id] = client
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+admin_clients = AdminClientRegistry()
+
+
+class UserClientCache:
+    """
+    Bounded LRU cache of per-user client bundles ({'auth': AuthClient, 'transfer': ..., ...}).
+
+    A bundle is reused as long as the user's stored access tokens are unchanged and unexpired. If
+    the stored tokens give no expiry, bundles are rebuilt after max_age seconds.
+
+    :param max_size: int, number of users whose bundles are kept
+    :param max_age: int, fallback lifetime of a bundle in seconds
+    """
+
+    def __init__(self, max_size=256, max_age=60 * 60):
+        self._max_size = max_size
+        self._max_age = max_age
+        self._bundles = OrderedDict()  # user key -> (fingerprint, expires_at, clients)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def fingerprint(tokens):
+        access_tokens = sorted(f"{rs}={t['access_token']}" for rs, t in tokens.items())
+        return hashlib.sha1('\n'.join(access_tokens).encode('utf-8')).hexdigest()
+
+    def _expires_at(self, tokens):
+        expiries = [t['expires_at'] for t in tokens.values() if t.get('expires_at')]
+        return min(expiries) if expiries else time.time() + self._max_age
+
+    def get(self, user_key, tokens, build):
+        """
+        Returns the cached bundle for user_key, or build(tokens) if tokens changed or expired.
+        """
+        fingerprint = self.fingerprint(tokens)
+        with self._lock:
+            cached = self._bundles.get(user_key)
+            if cached is not None and cached[0] == fingerprint and cached[1] > time.time():
+                self._bundles.move_to_end(user_key)
+                self._stats['hits'] += 1
+                return cached[2]
+            self._bundles.pop(user_key, None)
+            self._stats['misses'] += 1
+
+        clients = build(tokens)
+        with self._lock:
+            self._bundles[user_key] = (fingerprint, self._expires_at(tokens), clients)
+            while len(self._bundles) > self._max_size:
+                self._bundles.popitem(last=False)
+        return clients
+
+    def invalidate(self, user_key=None):
+        with self._lock:
+            if user_key is None:
+                self._bundles.clear()
+            else:
+                self._bundles.pop(user_key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_users'] = len(self._bundles)
+        return stats
+
+
+user_clients = UserClientCache(
+    max_size=_cache_settings().get('user_clients_max_size', 256),
+    max_age=_cache_settings().get('user_clients_max_age', 60 * 60),
+)
+
+
+def _lookup_https_server(endpoint_id):
+    return admin_clients.get(endpoint_id).get_endpoint(endpoint_id)['https_server']
+
+
+https_server_cache = RefreshingCache(
+    loader=_lookup_https_server,
+    ttl=_cache_settings().get('https_server_ttl', 6 * 60 * 60),
+    timeout=_cache_settings().get('https_server_timeout', 3),
+    generation_key='globus-https-server-generation',
+)
@@ -12,6 +12,7 @@ urlpatterns = [
     re_path(r'^logout/$', views.logout, name='logout'),
     re_path(r'^profile/edit/$', views.edit_profile, name='edit_profile'),
     re_path(r'^change-password/$', views.change_password, name='change_password'),
+    re_path(r'^globus-cache/$', views.globus_cache_view, name='globus_cache'),
     re_path(r'^reset-password/$', auth_views.PasswordResetView.as_view(), {
         'template_name': 'accounts:reset_password.html',
         'post_reset_redirect': 'accounts:password_reset_done',
@@ -1,10 +1,10 @@
 import logging
 
-import globus_sdk
 import jsonpickle
 # import omero.clients
 
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth import logout as django_logout
 from django.contrib.auth.decorators import login_required
@@ -16,6 +16,7 @@ from django.urls import reverse
 from globus_sdk import AuthClient, TransferClient, AccessTokenAuthorizer, GroupsClient
 
 from .forms import EditProfileForm, ProfileForm
+from .globus import admin_clients, get_portal_client, token_cache, https_server_cache, user_clients
 from .. import settings
 
 logger = logging.getLogger(__name__)
@@ -117,9 +118,8 @@ def logout(request):
 
 
 def load_portal_client():
-    """Create an AuthClient for the portal"""
-    return globus_sdk.ConfidentialAppAuthClient(
-        settings.SOCIAL_AUTH_GLOBUS_KEY, settings.SOCIAL_AUTH_GLOBUS_SECRET)
+    """Return the (process-wide) AuthClient for the portal"""
+    return get_portal_client()
 
 
 @login_required
@@ -144,11 +144,23 @@ def edit_profile(request):
         return render(request, 'accounts/edit_profile.html', args)
 
 
-def setup_uss_env(user):
+def already_exists(error):
+    """
+    :return: whether a Globus error only says that the directory or ACL rule being created is already there
+    """
+    return 'Exists' in str(getattr(error, 'code', ''))
+
+
+def setup_uss_env(user, raise_errors=False):
     """
     if a user is new to CReD set up the directory structure for them n the USS and
     add them to the acl list for that endpoint with rw permissions
+
+    json_files/ is created last, so a user without it is set up again; directories and ACL rules left by an earlier
+    attempt are skipped.
     :param user: New user object
+    :param raise_errors: raise a RuntimeError if any step failed instead of only logging it, @see
+        background_tasks.setup_uss_env
     :return: Nothing
     """
 
@@ -162,6 +174,8 @@ def setup_uss_env(user):
     try:
         user_info = ac.oauth2_userinfo()
     except AttributeError as ae:
+        if raise_errors:
+            raise
         return HttpResponseRedirect('/accounts/logout/')
     cred_admin = None
     cred_jupyter_admin = None
@@ -173,17 +187,15 @@ def setup_uss_env(user):
     except Exception as e:
         logger.debug(f"Couldn't authorize using tokens {cred_admin}\n\n")
 
-    path = f'/'
     dir_list = []
     try:
-        dir_list = cred_admin.operation_ls(endpoint_id, path=path)
+        dir_list = cred_admin.operation_ls(endpoint_id, path=f'/{user.username}/')
     except Exception as e:
-        logger.error('\n\n The dir list error is ', e)
+        # a new user, or the mkdirs below report what is wrong
+        logger.debug(f'The dir list error is {e}')
 
-    dir_flag = False
-    for uss_dir in dir_list:
-        if user.username == uss_dir["name"]:
-            dir_flag = True
+    if any(uss_dir["name"] == 'json_files' for uss_dir in dir_list):
+        return
 
     # TODO: re-factor once CReD starts managing the Jupyterhub collection.
     # try:
@@ -202,60 +214,43 @@ def setup_uss_env(user):
     #     logger.error(f'Root dir exception (Jupyterhub collection) {e}')
     #     pass
 
-    if not dir_flag:
-        try:
-            path = f'/{user.username}/'
-            cred_admin.operation_mkdir(endpoint_id, path=path)
-        except Exception as e:
-            logger.debug(f'Root dir exception {e}')
+    errors = []
 
+    def create(path, permissions=None):
         try:
-            path = f'/{user.username}/raw_files/'
             cred_admin.operation_mkdir(endpoint_id, path=path)
-            rw_data = {
-                "DATA_TYPE": "access",
-                "principal_type": "identity",
-                "principal": user_info["sub"],
-                "path": path,
-                "permissions": "rw",
-            }
-            cred_admin.add_endpoint_acl_rule(endpoint_id, rw_data)
         except Exception as e:
-            logger.debug(f'Raw data dir exception {e}')
-            pass
+            if not already_exists(e):
+                logger.debug(f'{path} dir exception {e}')
+                errors.append(f'{path}: {e}')
+                return
+        if permissions is None:
+            return
         try:
-            cred_admin.operation_mkdir(endpoint_id, path=f'/{user.username}/json_files/')
-        except Exception as e:
-            logger.debug(f'JSON Files dir exception {e}')
-            pass
-        try:
-            path = f'/{user.username}/results/'
-            cred_admin.operation_mkdir(endpoint_id, path=path)
-            r_data = {
+            cred_admin.add_endpoint_acl_rule(endpoint_id, {
                 "DATA_TYPE": "access",
                 "principal_type": "identity",
                 "principal": user_info["sub"],
                 "path": path,
-                "permissions": "r",
-            }
-            cred_admin.add_endpoint_acl_rule(endpoint_id, r_data)
+                "permissions": permissions,
+            })
         except Exception as e:
-            logger.debug(f'Results dir exception {e}')
-            pass
-        try:
-            path = f'/{user.username}/notes/'
-            cred_admin.operation_mkdir(endpoint_id, path=path)
-            rw_data = {
-                "DATA_TYPE": "access",
-                "principal_type": "identity",
-                "principal": user_info["sub"],
-                "path": path,
-                "permissions": "rw",
-            }
-            cred_admin.add_endpoint_acl_rule(endpoint_id, rw_data)
-        except Exception as e:
-            logger.debug(f'Notes dir exception {e}')
-            pass
+            if not already_exists(e):
+                logger.debug(f'{path} ACL exception {e}')
+                errors.append(f'{path} ACL: {e}')
+
+    create(f'/{user.username}/')
+    if not errors:
+        create(f'/{user.username}/raw_files/', 'rw')
+        create(f'/{user.username}/results/', 'r')
+        create(f'/{user.username}/notes/', 'rw')
+    if not errors:
+        # marks the setup as complete
+        create(f'/{user.username}/json_files/')
+    if errors:
+        logger.error(f"Could not set up the USS directories of {user.username}: {errors}")
+        if raise_errors:
+            raise RuntimeError(f"USS setup of {user.username} failed: {'; '.join(errors)}")
 
 
 def get_globus_tokens(scopes):
@@ -269,61 +264,32 @@ def get_globus_tokens(scopes):
                 f'https://auth.globus.org/scopes/{endpoint_id}/https',
             ]
         )
+
+    Tokens are served from the process-wide token cache (@see globus.TokenCache), so a grant is
+    only requested when no unexpired token exists for this set of scopes.
     """
-    portal_client = load_portal_client()
-    # get OAuth tokens for scopes
-    tokens = portal_client.oauth2_client_credentials_tokens(
-        requested_scopes=scopes
-    )
-    return tokens
+    return token_cache.get(scopes)
 
 
 def get_admin_client(endpoint_id=settings.GLOBUS_USS_EP_ID):
-    """This function is to produce admin credentials for use in file and endpoint related operations
+    """This function is to produce admin credentials for use in file and endpoint related operations.
+    Clients are pooled per endpoint and renew their own tokens (@see globus.AdminClientRegistry),
+    so it is cheap to call this repeatedly.
     :return: an site transfer client object
     """
-    portal_client = load_portal_client()
-    scopes = [f'https://auth.globus.org/scopes/{endpoint_id}/https',
-              'urn:globus:auth:scope:transfer.api.globus.org:all']
-    tokens = portal_client.oauth2_client_credentials_tokens(
-        requested_scopes=scopes)
-
-    # transfer token
-    transfer_token_info = (
-        tokens.by_resource_server["transfer.api.globus.org"])
-    transfer_token = transfer_token_info["access_token"]
-
-    # get a TransferClient to find the base URL
-    transfer_client = globus_sdk.TransferClient(
-        authorizer=globus_sdk.AccessTokenAuthorizer(transfer_token))
-
-    return transfer_client
+    return admin_clients.get(endpoint_id)
 
 
 def get_globus_https_server(endpoint_id):
     """
     Returns https server url for a given collection endpoint id
-    """
-    tokens = get_globus_tokens(
-        scopes=['urn:globus:auth:scope:transfer.api.globus.org:all']
-    )
-    transfer_token_info = (
-        tokens.by_resource_server["transfer.api.globus.org"]
-    )
-    transfer_token = transfer_token_info["access_token"]
-
-    # get a TransferClient to find the base URL
-    transfer_client = globus_sdk.TransferClient(
-        authorizer=globus_sdk.AccessTokenAuthorizer(transfer_token)
-    )
+    (eg. https://g-96b3c4.0ed28.75bc.data.globus.org, no trailing slash).
 
-    # get the endpoint (collection info)
-    endpoint = transfer_client.get_endpoint(endpoint_id)
-
-    # HTTPS server base URL, no trailing slash
-    # example: https://g-96b3c4.0ed28.75bc.data.globus.org
-    https_server = endpoint['https_server']
-    return https_server
+    The url is looked up once per endpoint and then served from https_server_cache, which
+    revalidates it in the background after GLOBUS_HTTPS_SERVER_TTL seconds.
+    @see globus_cache_view to invalidate it.
+    """
+    return https_server_cache.get(endpoint_id)
 
 
 def get_https_token(endpoint_id):
@@ -350,34 +316,42 @@ def get_https_token(endpoint_id):
 
 
 def get_globus_tokens_by_state(user_social_state):
-    extra_data = user_social_state.get().extra_data
+    return get_globus_tokens_by_extra_data(user_social_state.get().extra_data)
+
+
+def get_globus_tokens_by_extra_data(extra_data):
+    """
+    Reads the tokens stored by social auth into {resource_server: {'access_token', 'refresh_token',
+    'expires_at'}}. expires_at is None if the stored data does not say when the token was issued.
+    """
+    auth_time = extra_data.get('auth_time')
+
+    def expires_at(token_data):
+        expires_in = token_data.get('expires_in', token_data.get('expires'))
+        if auth_time is None or expires_in is None:
+            return None
+        return int(auth_time) + int(expires_in)
+
     tokens = {}
     tokens['auth.globus.org'] = {'access_token': extra_data['access_token'],
-                                 'refresh_token': extra_data['refresh_token']}
+                                 'refresh_token': extra_data['refresh_token'],
+                                 'expires_at': expires_at(extra_data)}
     if 'other_tokens' in extra_data:
         for t in extra_data['other_tokens']:
             tokens[t['resource_server']] = {'access_token': t['access_token'],
-                                            'refresh_token': t['refresh_token']}
+                                            'refresh_token': t['refresh_token'],
+                                            'expires_at': expires_at(t)}
 
     logger.debug('\n\n The tokens are', tokens)
     return tokens
 
 
-def get_globus_client(request=None, user_social_state=None):
-    """Get a client based on the requesting user's social_auth
-    :param:request HTTP Request Object
-    :return: a dictionary of clients based on tokens
+def build_globus_clients(tokens):
+    """
+    Builds auth, transfer and groups clients from a user's tokens.
+    @see get_globus_tokens_by_extra_data
     """
     clients = {}
-    tokens = {}
-    if request:
-        user_social_state = request.user.social_auth
-
-    try:
-        tokens = get_globus_tokens_by_state(user_social_state)
-    except Exception as e:
-        logger.debug('\n\n the globus client error is ', e)
-
     resource_servers = ['auth.globus.org', 'transfer.api.globus.org', 'groups.api.globus.org']
 
     for resource in resource_servers:
@@ -393,6 +367,29 @@ def get_globus_client(request=None, user_social_state=None):
     return clients
 
 
+def get_globus_client(request=None, user_social_state=None):
+    """Get a client based on the requesting user's social_auth.
+    Client bundles are cached per user until the user's stored tokens change or expire
+    (@see globus.UserClientCache).
+    :param:request HTTP Request Object
+    :return: a dictionary of clients based on tokens
+    """
+    social = None
+    tokens = {}
+    if request:
+        user_social_state = request.user.social_auth
+
+    try:
+        social = user_social_state.get()
+        tokens = get_globus_tokens_by_extra_data(social.extra_data)
+    except Exception as e:
+        logger.debug('\n\n the globus client error is ', e)
+
+    if social is None:
+        return build_globus_clients(tokens)
+    return user_clients.get(social.pk, tokens, build_globus_clients)
+
+
 def access_omero_server(**kwargs):
     OMERO_USER = kwargs.get('user')
     OMERO_PASSWORD = settings.OMERO_PASSWORD
@@ -403,3 +400,22 @@ def access_omero_server(**kwargs):
     return conn_list
 
 
+@staff_member_required
+def globus_cache_view(request):
+    """
+    Admin page reporting Globus token cache counters and cached collection https servers for the
+    worker serving this request. POSTing it drops the cached https servers (on every worker).
+    """
+    if request.method == 'POST':
+        endpoint_id = request.POST.get('endpoint_id') or None
+        https_server_cache.invalidate(endpoint_id)
+        messages.success(request, f"Invalidated https server for {endpoint_id or 'all collections'}.")
+        return redirect(reverse('accounts:globus_cache'))
+
+    context = {
+        'title': 'Globus cache',
+        'token_stats': token_cache.stats(),
+        'https_servers': https_server_cache.stats(),
+        'user_client_stats': user_clients.stats(),
+    }
+    return render(request, 'admin/globus_cache.html', context)
@@ -0,0 +1,105 @@
+"""
+Process-wide AWS clients.
+
+Building a boto3 client loads the service's endpoint and model JSON, so every module that talks to SQS
+goes through get_sqs_client() instead of creating its own session, resource or client. Clients are
+created once per process from AWS_CLIENTS (connection pool size, retry mode and timeouts), are safe to
+share between threads, and are re-created in a child process after a fork, like the MongoDB client
+(@see mongo.get_client).
+
+Queue URLs never change for the life of a queue, so they are cached here too (@see get_queue_url).
+"""
+import logging
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+_queue_urls = {}
+
+
+def _client_settings():
+    return getattr(settings, 'AWS_CLIENTS', {})
+
+
+def _config():
+    options = _client_settings()
+    return Config(
+        region_name=options.get('region_name', 'us-west-1'),
+        max_pool_connections=options.get('max_pool_connections', 50),
+        retries={
+            'mode': options.get('retry_mode', 'standard'),
+            'max_attempts': options.get('max_attempts', 5),
+        },
+        connect_timeout=options.get('connect_timeout', 5),
+        # above the longest SQS long poll (20 seconds)
+        read_timeout=options.get('read_timeout', 30),
+    )
+
+
+def get_client(service, aws_access_key_id=None, aws_secret_access_key=None):
+    """
+    Returns this process' client for service and credentials, creating it on first use and after a fork.
+    """
+    global _clients_pid
+    key = (service, aws_access_key_id)
+    pid = os.getpid()
+    if _clients_pid != pid or key not in _clients:
+        with _clients_lock:
+            if _clients_pid != pid:
+                if _clients_pid is not None:
+                    # inherited from the parent process; their connection pools belong to the parent
+                    logger.debug(f"Re-creating AWS clients after fork (pid {pid})")
+                _clients.clear()
+                _queue_urls.clear()
+                _clients_pid = pid
+            if key not in _clients:
+                # sessions are not thread safe, so each client gets its own, used only here
+                session = boto3.session.Session(aws_access_key_id=aws_access_key_id,
+                                                aws_secret_access_key=aws_secret_access_key)
+                _clients[key] = session.client(service, config=_config())
+    return _clients[key]
+
+
+def get_sqs_client():
+    """
+    Returns the process-wide SQS client, with the portal's SQS credentials.
+    """
+    return get_client('sqs', settings.SQS_ACCESS_KEY_ID, settings.SQS_SECRET_ACCESS_KEY)
+
+
+def get_queue_url(name):
+    """
+    Returns the URL of the SQS queue name. Raises if the queue does not exist; only found queues are cached,
+    so a queue created after a failed lookup is still picked up.
+    """
+    url = _queue_urls.get(name)
+    if url is None:
+        url = get_sqs_client().get_queue_url(QueueName=name)['QueueUrl']
+        _queue_urls[name] = url
+    return url
+
+
+def create_queue(name, attributes):
+    """
+    Creates the SQS queue name, or returns the URL of the existing one if its attributes match.
+    """
+    url = _queue_urls.get(name)
+    if url is None:
+        url = get_sqs_client().create_queue(QueueName=name, Attributes=attributes)['QueueUrl']
+        _queue_urls[name] = url
+    return url
+
+
+def forget_queue(name):
+    """
+    Drops the cached URL of name, e.g. once the queue has been deleted.
+    """
+    _queue_urls.pop(name, None)
@@ -0,0 +1,87 @@
+"""
+Tasks run by `manage.py run_workers`, @see tasks
+"""
+import datetime
+import logging
+
+import requests
+from django.conf import settings
+from django.core.mail import send_mail
+
+from . import status_service
+from .accounts.views import get_globus_https_server, get_https_token
+from .statuses import get_message
+from .status_store import store
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+
+def _record_failed_submission(document, error):
+    job_metadata, username = document['args'][:2]
+    store.record(job_metadata['aggr_nickname'], get_message('FAILEDSUBMISSION'), datetime.datetime.utcnow(),
+                 user=username)
+
+
+@task('submit_job', on_failure=_record_failed_submission)
+def submit_job(job_metadata, username):
+    """
+    Second half of a job submission, after util.enqueue_jobs registered the job: uploads the job document onto TSCC
+    and posts its first status, which also replaces 'Submitting…' in the status store. Both steps can safely be
+    repeated.
+    """
+    from .util import upload_job_document
+    upload_job_document(job_metadata, username)
+    status_service.create_queue(job_metadata['aggr_nickname'], username, status=get_message('QUEUED'),
+                                status_queue=job_metadata.get('status_queue'))
+
+
+@task('setup_uss_env')
+def setup_uss_env(username):
+    """
+    @see accounts.views.setup_uss_env. Raises if any step failed, so the task is retried.
+    """
+    from .accounts.views import setup_uss_env
+    setup_uss_env(username, raise_errors=True)
+
+
+def _notify_failed_share(document, error):
+    share = document['args'][0]
+    if not share.get('email'):
+        logger.error(f"Could not tell {share.get('username')} that sharing {share.get('path')} failed: no email")
+        return
+    paths = '\n'.join(share.get('path', []))
+    send_mail(
+        'Sharing failed',
+        f"Hello, the following could not be shared with the group {share.get('group_name') or share.get('uuid')}:"
+        f"\n\n{paths}\n\nPlease try sharing them again.",
+        getattr(settings, 'NOTIFIER', {}).get('from_email', 'ncrcrg.u19@gmail.com'),
+        [share['email']]
+    )
+
+
+@task('confirm_share', on_failure=_notify_failed_share)
+def confirm_share(share):
+    """
+    Adds the ACL rules of a share. Paths shared by an earlier attempt are skipped, so the task can be retried; once it
+    has failed for good the user is emailed.
+    :param share: dictionary with the endpoint_id, path (list) and group uuid of a validated share, and the username,
+        email and group_name of whoever shared it, @see dash_elems.sharing.confirm_share
+    """
+    from .dash_elems.sharing import confirm_share
+    confirmed, message = confirm_share(share)
+    if not confirmed:
+        raise RuntimeError(f"Could not share {share.get('path')} with group {share.get('uuid')}: {message}")
+
+
+@task('save_note')
+def save_note(user_name, path, text):
+    """
+    Saves text to path (relative to the user's directory) on the USS, @see dash_elems.job_status.save_scratchpad
+    """
+    endpoint_id = settings.GLOBUS_USS_EP_ID
+    https_server = get_globus_https_server(endpoint_id)
+    https_token = get_https_token(endpoint_id)
+    response = requests.put(f'{https_server}/{user_name}/{path}', data=text.encode('utf-8'),
+                            headers={"Authorization": f"Bearer {https_token}"}, allow_redirects=False)
+    response.raise_for_status()
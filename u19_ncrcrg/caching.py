@@ -0,0 +1,193 @@
+"""
+In-process caches for slow, rarely-changing lookups (Globus collection metadata, Mongo summary
+statistics, ...), and HTTP conditional GET support for Dash layouts.
+"""
+import hashlib
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, value, loaded_at):
+        self.value = value
+        self.loaded_at = loaded_at
+        self.invalid = False
+        self.failed_at = None
+
+
+class RefreshingCache:
+    """
+    Per-key cache with stale-while-revalidate semantics.
+
+    - The first lookup of a key runs `loader(key)` in the calling thread (errors propagate).
+    - Once an entry is older than `ttl` seconds, it is still returned immediately while a single
+      background thread reloads it.
+    - An invalidated entry is reloaded synchronously, but if the loader fails or takes longer than
+      `timeout` seconds, the last known value is returned instead. Until the reload finishes, later
+      lookups get that value without waiting.
+    - After a failed reload the last known value is served, and no reload is tried, for
+      `failure_backoff` seconds.
+
+    Invalidation is per process. To invalidate across workers, pass a `generation_key`: invalidate()
+    then bumps a counter in the Django cache, and every worker that sees a new value (checked at
+    most once every `generation_check_interval` seconds) invalidates all of its entries.
+
+    :param loader: callable taking a key and returning the value to cache
+    :param ttl: int, seconds an entry is served before it is revalidated in the background
+    :param timeout: float, seconds to wait on a synchronous reload before falling back
+    :param generation_key: string, Django cache key used to share invalidations between workers
+    :param failure_backoff: int, seconds after a failed reload before the next one is tried
+    """
+
+    def __init__(self, loader, ttl, timeout=5, generation_key=None, generation_check_interval=30,
+                 failure_backoff=30):
+        self._loader = loader
+        self._ttl = ttl
+        self._timeout = timeout
+        self._failure_backoff = failure_backoff
+        self._generation_key = generation_key
+        self._generation_check_interval = generation_check_interval
+        self._generation = 0
+        self._generation_checked_at = 0
+        self._entries = {}
+        self._refreshing = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _shared_generation(self):
+        from django.core.cache import cache
+        try:
+            return cache.get(self._generation_key, 0)
+        except Exception as e:
+            logger.error(f"Could not read cache generation {self._generation_key}: {e}")
+            return self._generation
+
+    def _check_generation(self):
+        if self._generation_key is None:
+            return
+        now = time.time()
+        if now - self._generation_checked_at < self._generation_check_interval:
+            return
+        self._generation_checked_at = now
+        generation = self._shared_generation()
+        if generation != self._generation:
+            self._generation = generation
+            with self._lock:
+                for entry in self._entries.values():
+                    entry.invalid = True
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load(self, key):
+        value = self._loader(key)
+        with self._lock:
+            self._entries[key] = _Entry(value, time.time())
+        return value
+
+    def _background_load(self, key):
+        try:
+            self._load(key)
+        except Exception as e:
+            logger.error(f"Could not refresh cached value for {key}: {e}")
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.failed_at = time.time()
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def _start_refresh(self, key):
+        with self._lock:
+            thread = self._refreshing.get(key)
+            if thread is None:
+                thread = threading.Thread(target=self._background_load, args=(key,), daemon=True)
+                self._refreshing[key] = thread
+                thread.start()
+            return thread
+
+    def get(self, key):
+        self._check_generation()
+        entry = self._entries.get(key)
+        if entry is None:
+            with self._key_lock(key):
+                entry = self._entries.get(key)
+                if entry is None:
+                    return self._load(key)
+        if entry.failed_at is not None and time.time() - entry.failed_at < self._failure_backoff:
+            return entry.value
+        if entry.invalid:
+            with self._lock:
+                # only the first lookup after invalidate() waits, the others get the last known value
+                wait = key not in self._refreshing and entry.failed_at is None
+            thread = self._start_refresh(key)
+            if not wait:
+                return entry.value
+            thread.join(self._timeout)
+            refreshed = self._entries.get(key)
+            if refreshed is entry:
+                logger.info(f"Serving last known value for {key}, reload is slow or failing.")
+            return refreshed.value
+        if time.time() - entry.loaded_at > self._ttl:
+            self._start_refresh(key)
+        return entry.value
+
+    def invalidate(self, key=None):
+        """
+        Marks key (or every key, if None) for a synchronous reload on next access.
+        """
+        with self._lock:
+            entries = list(self._entries.values()) if key is None else [self._entries.get(key)]
+            for entry in entries:
+                if entry is not None:
+                    entry.invalid = True
+        if self._generation_key is not None:
+            from django.core.cache import cache
+            self._generation = time.time()
+            try:
+                cache.set(self._generation_key, self._generation, None)
+            except Exception as e:
+                logger.error(f"Could not bump cache generation {self._generation_key}: {e}")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                str(key): {
+                    'age_seconds': int(now - entry.loaded_at),
+                    'stale': entry.invalid or now - entry.loaded_at > self._ttl,
+                }
+                for key, entry in self._entries.items()
+            }
+
+
+def conditional_dash_layout(view_function):
+    """
+    django_plotly_dash view decorator (PLOTLY_DASH['view_decorator']) adding an ETag to Dash layout responses, so
+    that a browser revalidating an unchanged layout gets a 304 instead of the full layout again. Other Dash
+    endpoints are passed through untouched.
+
+    The ETag is a hash of the serialized layout, so the layout is still built for every request: a 304 only saves
+    the transfer, not the rendering (which the figure, statistics and navbar caches keep cheap).
+    """
+    @wraps(view_function)
+    def wrapped(request, *args, **kwargs):
+        response = view_function(request, *args, **kwargs)
+        if request.method != 'GET' or not request.path.endswith('_dash-layout') \
+                or response.status_code != 200 or response.streaming:
+            return response
+        etag = '"{}"'.format(hashlib.sha1(response.content).hexdigest())
+        response['ETag'] = etag
+        # layouts can depend on the user, so only the browser may keep them, and must revalidate
+        patch_cache_control(response, private=True, no_cache=True)
+        return get_conditional_response(request, etag=etag, response=response)
+
+    return wrapped
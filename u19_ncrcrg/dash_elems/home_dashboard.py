@@ -1,16 +1,73 @@
+"""
+Portal statistics shown on the home page.
+
+Counts are computed by MongoDB ($group) rather than by loading every Experiment, and are kept in a small cache
+that is refreshed in the background every HOME_STATS['ttl'] seconds, @see caching.RefreshingCache
+
+The figures built from them are cached too, already serialized to plain JSON types, so that rendering the home page
+never runs plotly express.
+"""
+import json
+
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from bson.objectid import ObjectId
-
-from u19_ncrcrg.tools import db
-
-df = pd.DataFrame
-job_records = df(list(db['Experiments'].find()))
+from django.conf import settings
+
+from u19_ncrcrg.caching import RefreshingCache
+from u19_ncrcrg.mongo import db
+
+
+def count_experiments_by(field, column):
+    """
+    :return: dataframe with one row per distinct value of field, and its number of Experiments in column
+    """
+    counts = db['Experiments'].aggregate([
+        {'$match': {field: {'$ne': None}}},
+        {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+        {'$sort': {'_id': 1}},
+    ])
+    records = [(c['_id'], c['count']) for c in counts]
+    return pd.DataFrame.from_records(records, columns=[field, column])
+
+
+def cumulative_jobs_by_month():
+    """
+    :return: dataframe of the cumulative number of Experiments at the end of each month ('MM-YYYY'). ObjectIds
+    embed their creation time, so months are grouped server side from _id.
+    """
+    per_month = db['Experiments'].aggregate([
+        {'$group': {
+            '_id': {'$dateToString': {'format': '%Y-%m', 'date': {'$toDate': '$_id'}}},
+            'count': {'$sum': 1},
+        }},
+        {'$sort': {'_id': 1}},
+    ])
+    job_counts = pd.DataFrame.from_records([(m['_id'], m['count']) for m in per_month], columns=['Month', 'Count'])
+    job_counts['Count'] = job_counts['Count'].cumsum()
+    job_counts['Month'] = job_counts['Month'].str[5:] + '-' + job_counts['Month'].str[:4]
+    return job_counts
+
+
+STATS = {
+    'modality': lambda: count_experiments_by('modality', 'Number of Jobs'),
+    'organization': lambda: count_experiments_by('organization', 'Total Jobs Processed'),
+    'module': lambda: count_experiments_by('module', 'Total Jobs Processed'),
+    'jobs_over_time': cumulative_jobs_by_month,
+}
+
+stats_cache = RefreshingCache(
+    loader=lambda name: STATS[name](),
+    ttl=getattr(settings, 'HOME_STATS', {}).get('ttl', 10 * 60),
+)
+
+
+def get_stat(name):
+    return stats_cache.get(name)
 
 
 def jobs_by_modality_graph():
-    job_modality_counts = job_records.groupby(['modality']).size().reset_index(name="Number of Jobs")
+    job_modality_counts = get_stat('modality')
 
     fig = px.pie(job_modality_counts, values='Number of Jobs', names='modality', title="Jobs by Modality")
 
@@ -19,21 +76,7 @@ def jobs_by_modality_graph():
 
 
 def jobs_over_time():
-    job_counts = job_records.groupby(["_id"]).size().reset_index(name="Cumulative Jobs")
-
-    month = []
-    count = []
-    for index, rec in job_counts.iterrows():
-        created_time = str(ObjectId(rec["_id"]).generation_time)
-        created_date = created_time.split(' ')
-        created_month = str(created_date[0]).split('-')
-        created_str = f'{created_month[1]}-{created_month[0]}'
-        month.append(created_str)
-        count.append(int(index) + 1)
-
-    inter_df = pd.DataFrame({'Month': month, 'Count': count})
-
-    job_counts = inter_df.groupby(["Month"], sort=False)["Count"].max().reset_index()
+    job_counts = get_stat('jobs_over_time')
 
     fig = px.line(job_counts, x='Month', y="Count",
                   title='Jobs Processed over Time')
@@ -42,7 +85,7 @@ def jobs_over_time():
 
 
 def jobs_by_org():
-    job_counts = job_records.groupby(["organization"]).size().reset_index(name="Total Jobs Processed")
+    job_counts = get_stat('organization')
     mod_jobs_count = job_counts.rename(columns={'organization': 'Organization'})
 
     fig = px.bar(mod_jobs_count, y='Organization', x="Total Jobs Processed", color="Organization",
@@ -53,7 +96,7 @@ def jobs_by_org():
 
 
 def jobs_by_org_stacked():
-    job_counts = job_records.groupby(["organization"]).size().reset_index(name="Total Jobs Processed")
+    job_counts = get_stat('organization')
     mod_jobs_count = job_counts.rename(columns={'organization': 'Organization'})
     fig = go.Figure()
     for x in range(mod_jobs_count.shape[0]):
@@ -74,7 +117,7 @@ def jobs_by_org_stacked():
 
 
 def jobs_by_tool():
-    job_counts = job_records.groupby(["module"]).size().reset_index(name="Total Jobs Processed")
+    job_counts = get_stat('module')
 
     fig = px.pie(job_counts, names='module', values="Total Jobs Processed", title="Jobs by Tool")
 
@@ -82,8 +125,29 @@ def jobs_by_tool():
 
 
 def jobs_by_tool_stacked():
-    job_counts = job_records.groupby(["module"]).size().reset_index(name="Total Jobs Processed")
+    job_counts = get_stat('module')
 
     fig = px.pie(job_counts, names='module', values="Total Jobs Processed", title="Jobs by Tool")
 
-    return fig
\ No newline at end of file
+    return fig
+
+
+FIGURES = {
+    'jobs_by_modality_graph': jobs_by_modality_graph,
+    'jobs_over_time': jobs_over_time,
+    'jobs_by_org': jobs_by_org,
+    'jobs_by_org_stacked': jobs_by_org_stacked,
+    'jobs_by_tool': jobs_by_tool,
+}
+
+figure_cache = RefreshingCache(
+    loader=lambda name: json.loads(FIGURES[name]().to_json()),
+    ttl=getattr(settings, 'HOME_STATS', {}).get('figure_ttl', 10 * 60),
+)
+
+
+def get_figure(name):
+    """
+    :return: the figure dictionary for name, as accepted by dcc.Graph(figure=...)
+    """
+    return figure_cache.get(name)
@@ -22,14 +22,11 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import base64
 import datetime
 import logging
 import math
-import os
 from urllib.parse import quote_plus
 
-import boto3
 import dash_bootstrap_components as dbc
 import requests
 from dash import dcc, html
@@ -40,13 +37,15 @@ import plotly.graph_objects as go
 from dash.dependencies import Output, Input, State
 from django_plotly_dash import DjangoDash
 
-from .help_page import tooltip_permanent, tooltip_collection, tooltip_scratch, tooltip_trash
+from .help_page import tooltip_collection, tooltip_scratch, tooltip_trash
 from .helpers import return_breadcrumbs_row, get_filemanager_url, get_jupyter_filemanager_url
 from ..accounts.views import get_globus_https_server, get_https_token
 from .navbars import navbar_authenticated
 from .. import settings
-from ..tools import connect_mongodb
+from ..mongo import db
 from ..statuses import get_progress, get_message
+from .. import status_service, tasks
+from ..trash import TRASH_RETENTION_DAYS
 
 logger = logging.getLogger(__name__)
 
@@ -260,7 +259,7 @@ def toggle_sidebar(active_cell, nclick, prev_select, user_name, data):
 
 def get_current_job_status(experiment_name, soft_limit=14, hard_limit=30):
     """
-    Returns the last (only?) message from the expt_name queue.
+    Returns the last (only?) message from the expt_name queue. @see status_service.get_status
     :param experiment_name: string
         full expt name (with checksum ie. 6mo_cortical_organoids_wt_cellranger3_feab5103e16ff600793fea28bb618f63558e6392.json) # noqa
     :param soft_limit: int
@@ -271,63 +270,7 @@ def get_current_job_status(experiment_name, soft_limit=14, hard_limit=30):
         we don't even check SQS as 1) jobs should not take longer than this to finish, 2) SQS messages have a max
         lifespan of 14 days, meaning these jobs won't have messages in queue anyway.
     """
-    dt = datetime.datetime.now() - datetime.datetime.strptime('-'.join(experiment_name.split('-')[-6:]),
-                                                              "%Y-%m-%d-%H-%M-%S")
-    hard_limit_dt = datetime.timedelta(days=hard_limit)
-    if dt > hard_limit_dt:
-        return f"Job finished.", f'More than {hard_limit} days ago.'
-    session = boto3.session.Session(region_name='us-west-1')
-    sqs = session.client(
-        'sqs',
-        aws_access_key_id=os.environ.get('SQS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('SQS_SECRET_ACCESS_KEY'),
-        region_name='us-west-1'
-    )
-
-    try:
-        url = sqs.get_queue_url(
-            QueueName=str(experiment_name).replace('\"', '') + '.fifo')
-
-    except Exception as e:
-        logger.error(
-            " Exception in experiment_viewer.services.get_current_job_status() : [{}], {}".format(
-                e, experiment_name + '.fifo'
-            )
-        )  # noqa
-
-        return "Error", ' '
-
-    response = sqs.receive_message(
-        QueueUrl=url['QueueUrl'],
-        AttributeNames=[
-            'SentTimestamp',
-        ],
-        MaxNumberOfMessages=10,
-        MessageAttributeNames=[
-            'All'
-        ],
-        VisibilityTimeout=0,
-        WaitTimeSeconds=12
-    )
-    message_to_return = None
-
-    try:
-        max_timestamp = 0
-
-        for message in response['Messages']:
-            if float(message['Attributes']['SentTimestamp']) > max_timestamp:
-                max_timestamp = float(message['Attributes']['SentTimestamp'])
-                message_to_return = message['Body']
-        last_updated = pd.to_datetime(max_timestamp, unit='ms').to_pydatetime()
-
-    except KeyError as e:
-        logger.error("Exception in get_current_job_status for job {}: [{}]".format(experiment_name, e))  # noqa
-        return "Job finished.", f'More than {soft_limit} days ago.'
-    return message_to_return, last_updated.strftime('%m-%d-%y %H:%M:%S')
-
-
-db = connect_mongodb(database='u19', user=bytes(os.environ.get("MONGODB_USER"), 'utf-8'),
-                     password=bytes(os.environ.get("MONGODB_PASSWORD"), 'utf-8'))
+    return status_service.get_status(experiment_name, soft_limit=soft_limit, hard_limit=hard_limit)
 
 
 def get_all_projects(user_name):
@@ -374,75 +317,54 @@ def reformat_date_string(date_string):
 
 
 def get_project_experiments(project_name, user_name):  # noqa
+    return get_user_experiments(user_name, project_name=project_name)
 
-    experiment_metadata = dict()
 
-    project_collection = db['Projects']
+def get_user_experiments(user_name, project_name=None):
+    """
+    Returns a dataframe of all the user's (non-removed) experiments, indexed by aggr_nickname, fetched with a single
+    aggregation over the user's projects.
+    :param user_name: string
+    :param project_name: string, only return experiments from this project
+    """
+    match = {"user": user_name}
+    if project_name is not None:
+        match["project_name"] = project_name
+    pipeline = [
+        {'$match': match},
+        {'$unwind': '$experiments'},
+        # unlike trashed, removed jobs no longer have associated queues or projects
+        {'$match': {'experiments.removed': {'$ne': 1}}},
+        {'$project': {
+            '_id': False,
+            'project_name': True,
+            'aggr_nickname': '$experiments.aggr_nickname',
+            'type': '$experiments.type',
+            'trashed': '$experiments.trashed',
+        }},
+    ]
 
-    # Get the project record matching the project name
-    project_query = project_collection.find_one({"project_name": project_name, "user": user_name},
-                                                {'_id': False})
-    # Extract the experiment list from the project record
-    try:  # edge case when transferring old jobs from V1
-        experiment_list = project_query["experiments"]
-    except KeyError:
-        experiment_list = []
-    for e in experiment_list:
+    columns = {column: [] for column in
+               ['Name & Date', 'Name (Click to expand)', 'Project tag', 'Date', 'Share status', 'Trashed', 'removed']}
+    index = []
+    for e in db['Projects'].aggregate(pipeline):
         job_name_split = e['aggr_nickname'].split('-')
         job_name = '-'.join(job_name_split[:-6])  # dependent on timestamp being appended to the end of the job.
         job_date = reformat_date_string('-'.join(job_name_split[-6:]))
-        trashed = e.get('trashed', 'no')  # due to old methods, 'trashed' can either be 'yes', 'no', or type(datetime)
-        removed = e.get('removed', 0)  # unlike trashed, removed jobs no longer have associated queues or projects
-
-        if trashed == 'yes':  # old trashed jobs need to be 're-trashed' to add the timestamp of trashed
-            trashed = move_experiment_to_trash(e['aggr_nickname'], project_name, user_name)
-
+        # due to old methods, 'trashed' can either be 'yes', 'no', or type(datetime)
+        # 'yes' rows are given a timestamp by the trash sweeper, @see trash.migrate_legacy_trash
+        trashed = e.get('trashed', 'no')
 
-        if removed == 0:
-            experiment_metadata[e['aggr_nickname']] = {
-                'Name & Date': "{} ({})".format(
-                    job_name,
-                    job_date,
-                ),
-                'Name (Click to expand)': job_name,
-                'Project tag': project_name,
-                'Date': job_date,
-                'Share status': e['type'],
-                'Trashed': trashed,
-                'removed': removed
-            }
+        index.append(e['aggr_nickname'])
+        columns['Name & Date'].append("{} ({})".format(job_name, job_date))
+        columns['Name (Click to expand)'].append(job_name)
+        columns['Project tag'].append(e['project_name'])
+        columns['Date'].append(job_date)
+        columns['Share status'].append(e.get('type'))
+        columns['Trashed'].append(trashed)
+        columns['removed'].append(0)
 
-    if len(experiment_metadata.keys()) == 0:  # no projects or experiments yet
-        return pd.DataFrame(
-            columns=['Name & Date', 'Name (Click to expand)', 'Project tag', 'Date', 'Share status', 'Trashed', 'removed'])
-    return pd.DataFrame(experiment_metadata).T
-
-
-def add_new_experiment_to_project(experiment_record, project, user_name):
-    """
-    Appends the experiment (job) to a user's project.
-    @see views.create_job
-    """
-    try:
-        db['Projects'].update_one(
-            {'project_name': project, 'user': user_name},
-            {
-                '$push': {
-                    'experiments': {
-                        'aggr_nickname': experiment_record['aggr_nickname'],
-                        'type': "personal",
-                        'modality': experiment_record['modality']
-                    }
-                },
-                '$inc': {
-                    'num_experiments': 1
-                }
-            }
-        )
-        return True
-    except Exception as e:
-        logger.error(f"Problem append new expt {experiment_record['aggr_nickname']} to project {project}", e)
-        return False
+    return pd.DataFrame(columns, index=index)
 
 
 def remove_experiment_from_project(aggr_nickname, project, user_name):
@@ -469,8 +391,8 @@ def remove_experiment_from_project(aggr_nickname, project, user_name):
 def move_experiment_to_trash(aggr_nickname, project, user_name):
     """
     Modifies 'trashed' tag in metadata database. Adds a timestamp that marks the datetime when user moves job over
-    to trash. We'll need to check this timestamp against some period (see check_and_remove_expt()), and if the
-    job has been sitting in trash for longer than this time, remove from projects and delete the associated sqs queue.
+    to trash. The trash sweeper checks this timestamp against some period (see trash.sweep()), and if the
+    job has been sitting in trash for longer than this time, marks it removed and deletes the associated sqs queue.
     """
     try:
         trashed_datetime = datetime.datetime.now()
@@ -655,53 +577,25 @@ def return_scratch_pad_layout():
     ])
 
 
-def check_and_remove_expt(row, user_name, max_days=14):
+def is_expired(trashed, max_days=TRASH_RETENTION_DAYS):
     """
-    Checks how long a row (expt) has been sitting in trash. If it's been more than max_days:
-    - delete associated sqs queue
-    - remove the job from associated project
-
-    Note: This does NOT remove the job from the databases' "experiments" collection. We might want to keep all records
-    stored just in case. However since we use the "projects" collection to display all of the users' associated jobs/
-    experiments, removed jobs should never show back up in the dashboard.
-
-    Note: This also does NOT remove any files generated by the job. Only removes the SQS queue and job record from its
-    project.
+    True if a job trashed at `trashed` is past the retention period. Expired jobs are hidden right away, and
+    removed for good by the next trash sweep, @see trash.sweep
     """
-    # Dataframe shouldn't have any removed=1 columns, @see get_project_experiments()
-    # So we shouldn't hit this unless there's an edge case I'm not thinking of?
-    if row['removed'] == 1:
-        return 1
-    elif datetime.datetime.now() - row['Trashed'] > datetime.timedelta(days=max_days):
-        try:
-            logger.info(
-                f"Removing fifo name: {row['job_id']}.fifo from SQS {row['Project tag']} and user = {user_name}"
-            )
-            delete_sqs_queue(row['job_id'])
-        except Exception as e:
-            logger.error(
-                f"{e}: Problem removing fifo name: {row['job_id']}.fifo from SQS {row['Project tag']} and user = {user_name}"
-            )
-        return 1
-    return 0
+    return isinstance(trashed, datetime.datetime) and \
+        datetime.datetime.now() - trashed > datetime.timedelta(days=max_days)
 
 
 def return_trashed_job_layout(df, user_name, max_page_size=10):
     """
     Returns layout for displaying trashed jobs
 
-    Also checks 'old' trashed jobs by applying remove_expt() to every job in the 'trashed' dataframe.
-    Sets the 'removed' column to 1 if the trashed job has been trashed for longer than 14 days.
-    Removed jobs should also have their SQS queue removed, as well as their projects disassociated (remove from project)
+    Jobs trashed for longer than the retention period are not shown. Removing them (and their SQS queues) is left
+    to the trash sweeper, so rendering this never writes anything, @see trash.sweep
     """
     _df = df[df['Trashed'] != 'no']  # either trashed = 'yes' or type(datetime)
-
+    _df = _df[~_df['Trashed'].map(is_expired).astype(bool)]
     _df['job_id'] = _df.index
-    try:
-        _df['removed'] = _df.apply(check_and_remove_expt, args=(user_name, ), axis=1)
-        _df = _df[_df['removed']==0]
-    except ValueError as e:  # empty dataframe
-        pass
 
     return html.Div([
         dbc.Card([
@@ -960,11 +854,7 @@ def return_page_layout(df, user_name):
 
 
 def job_status(user):
-    df = pd.DataFrame(columns=job_status_columns)  # noqa
-    projects = get_all_projects(user.username)
-    for project in projects:
-        df = pd.concat([df, get_project_experiments(project, user.username)])
-    df = df[df['removed'] != 1]
+    df = get_user_experiments(user.username)
     df.sort_values(['Date', 'Name (Click to expand)'], ascending=False, inplace=True)
 
     status_app.layout = return_page_layout(df=df[job_status_columns], user_name=user.username)
@@ -1003,25 +893,15 @@ def save_scratchpad(n_clicks, value, user_name):
     now = datetime.datetime.now()
     dt = now.strftime("%b-%d-%Y_%H-%M-%S") + ".txt"
 
-    bvalue = base64.b64encode(bytes(value, 'utf-8'))
-    decoded = base64.b64decode(bvalue)
-
-    endpoint_id = settings.GLOBUS_USS_EP_ID
-    https_server = get_globus_https_server(endpoint_id)
-    transfer_url = f'{https_server}/{user_name}/notes/{dt}'
-    https_token = None
+    # the upload to the USS runs on a background worker, @see background_tasks.save_note
     try:
-        https_token = get_https_token(endpoint_id)
+        tasks.enqueue('save_note', user_name, f'notes/{dt}', value or '')
     except Exception as e:
-        logger.debug(f'\n\nThe exception is {e}\n\n')
-
-    header = {"Authorization": f"Bearer {https_token}"}
-    response = requests.put(transfer_url, data=decoded, headers=header, allow_redirects=False)
-
-    logger.info(f'RESPONSE: \n\n{response.text} -- {header}\n\n')
+        logger.error(f"Could not queue saving notes/{dt} for {user_name}: {e}")
+        return 'Could not save the note, please try again.'
     # If you want to display the text on page.
     if n_clicks > 0:
-        return f'Saved! File at notes/{dt}'
+        return f'Saving... File will be at notes/{dt}'
 
 
 @status_app.callback(
@@ -1126,19 +1006,4 @@ def set_progress(message):
 
 
 def delete_sqs_queue(experiment_name):
-    session = boto3.session.Session(region_name='us-west-1')
-    sqs = session.client(
-        'sqs',
-        aws_access_key_id=os.environ.get('SQS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('SQS_SECRET_ACCESS_KEY'),
-        region_name='us-west-1'
-    )
-
-    try:
-        queue_url = sqs.get_queue_url(
-            QueueName=str(experiment_name).replace('\"', '') + '.fifo'
-        )['QueueUrl']
-        logger.debug(f'deleting queue url: {queue_url}')
-        sqs.delete_queue(QueueUrl=(queue_url))
-    except Exception as e:
-        logger.error(f"{e}. Problem deleting queue for experiment {experiment_name}")
\ No newline at end of file
+    return status_service.delete_queue(experiment_name)
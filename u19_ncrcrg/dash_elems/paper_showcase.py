@@ -1,17 +1,21 @@
+import os
+import threading
 from collections import defaultdict, OrderedDict
-from operator import getitem
+from functools import lru_cache
 
 import dash_bootstrap_components as dbc
-import requests
+from django.core.cache import cache as cache_backend
 from django_plotly_dash import DjangoDash
 from .navbars import navbar_authenticated, navbar_home
 from .helpers import *
 from .. import settings
+from ..publication_cache import PublicationCache
+from ..publication_search import PublicationIndex
+from ..publication_ingest import (ACCESSION_FIELDS, PublicationIngest, clean_doi, esearch, get_esummary,  # noqa: F401
+                                  parse_geo_esummary, efetch, parse_srx, get_srr_from_geo_accession,
+                                  get_files_from_pride_accession, get_omero_images,
+                                  get_base_url_other_repositories)
 import pandas as pd
-from xml.dom import minidom
-import xmltodict
-import re
-import yaml
 
 # from ..util import get_omero_objects
 
@@ -19,25 +23,10 @@ logger = logging.getLogger(__name__)
 
 paper_app = DjangoDash('PaperShowcaseApp', external_stylesheets=[settings.BOOTSTRAP_THEME])
 STATESDICT = defaultdict(list)
+PUBLICATIONS_SHEET = 'NCRCRG-CN-iSearch_-_Publications-export_2022-06-28-19-52-25.tsv'
 
 
-def get_base_url_other_repositories(repo_name):
-    """
-    Returns the base URL for a given repository name (as labeled in the google spreadsheet)
-    """
-    repos = {
-        "SRA": "https://www.ncbi.nlm.nih.gov/sra/?term=",
-        "NDEX": "https://www.ndexbio.org/viewer/networks/",
-        "SYNAPSE": "https://www.synapse.org/#!Synapse:"
-    }
-    try:
-        return repos[repo_name.upper()]
-    except KeyError:
-        logger.error(f"{repo_name.upper()} does not exist in repo dictionary")
-        return ""
-
-
-def read_sheet(tsv='NCRCRG-CN-iSearch_-_Publications-export_2022-06-28-19-52-25.tsv'):
+def read_sheet(tsv=PUBLICATIONS_SHEET):
     """
     NCRCRG-CN-iSearch_-_Publications-export_2022-06-28-19-52-25.tsv
     Reads in a publication metadata sheet from somewhere.
@@ -63,242 +52,86 @@ def paper_showcase_page(cred_user):
     return paper_app
 
 
-def get_publications():
-    df = read_sheet()
-    try:
-        with open('tmp.yaml') as f:
-            y = yaml.load(f, Loader=yaml.FullLoader)
-        records = defaultdict(dict, **y)
-        logger.debug("Successfully loaded from cache")
-    except Exception as e:
-        logger.debug(e)
-        records = defaultdict(dict)
-    all_records = df.to_dict(orient='records')
-
-    for r in all_records:
-        cleaned_doi = clean_doi(r['DOI'])  # forms do NOT like non-alphanumeric characters!
+def _publication_settings():
+    return getattr(settings, 'PUBLICATIONS', {})
 
-        if cleaned_doi in records.keys():
-            logger.debug(f"record {cleaned_doi} exists, do not re-parse.")
-            pass
-        else:
-            records[cleaned_doi]['other_accessions'] = defaultdict(dict)
-            logger.debug(f"record {cleaned_doi} does not exist, parse.", records.keys())
-            authors = r['Authors'].split(';')
-            author_string = '; '.join(authors[:2]) + ' et. al.' if len(authors) > 2 else '; '.join(authors[:2])
-            other_accessions = r['Other accessions'].split(',') if r['Other accessions'] != "" else []
-            for other_accession in other_accessions:
-                try:
-                    other_repo, accession = other_accession.split('::')
-                    records[cleaned_doi]['other_accessions'][f"{other_repo} ({accession})"] = get_base_url_other_repositories(other_repo) + accession
-                except ValueError as e:
-                    logger.error(e, other_accession)
-            records[cleaned_doi]['title'] = r['Title']
-            records[cleaned_doi]['full_authors'] = r['Authors']
-            records[cleaned_doi]['authors'] = author_string
-            records[cleaned_doi]['abstract'] = r['Abstract']
-            records[cleaned_doi]['total_citations'] = r['Total Citations']
-            records[cleaned_doi]['pub_year'] = r['Pub Year']
-            records[cleaned_doi]['mesh_keywords'] = r['MeSH Keywords'].split(';')
-            records[cleaned_doi]['doi_link'] = f"https://doi.org/{r['DOI']}"
-            records[cleaned_doi]['pmid_link'] = f"https://pubmed.ncbi.nlm.nih.gov/{r['PMID']}"
-            records[cleaned_doi]['geo_accessions'] = []
-            records[cleaned_doi]['pride_accessions'] = []
-            records[cleaned_doi]['omero_accessions'] = []
-            if r['GEO accession'] != "":
-                for accession in r['GEO accession'].split(','):
-                    logger.debug(f"parsing publication (GEO) {accession}")
-                    records[cleaned_doi]['geo_accessions'] += get_srr_from_geo_accession(accession)  # GEO -> SRR
-            if r['PRIDE accession'] != "":
-                for accession in r['PRIDE accession'].split(','):
-                    logger.info(f"parsing publication (PRIDE) {accession}")
-                    records[cleaned_doi]['pride_accessions'] += get_files_from_pride_accession(accession)
-            if r['OMERO accession'] != "":
-                for accession in str(r['OMERO accession']).split(','):
-                    logger.info(f"parsing publication (OMERO) {accession}")
-                    records[cleaned_doi]['omero_accessions'] += get_omero_images(str(accession))
 
-    with open('tmp.yaml', 'w') as o:
-        yaml.dump(records, o, default_flow_style=False)
-
-    sorted_records = OrderedDict(sorted(records.items(), key=lambda x: getitem(x[1], 'pub_year'), reverse=True))
-    return sorted_records
-
-
-def get_omero_images(omero_id):
+@lru_cache(maxsize=None)
+def get_publication_cache():
     """
-    Queries OMERO for images associated with a given ID.
-    :params omero_id: str used to query OMERO referred to accession.
-    :return omero_image: list of image tuples containing the image name and path to the image.
+    Opens the SQLite publication cache, importing the legacy YAML cache the first time.
     """
-    logger.info("Start get_omero_images")
-    omero_name, omero_id = str(omero_id).split('::')
-    # omero_image = get_omero_objects(omero_id)
-    # return omero_image
-    return [(omero_id, omero_name)]
+    options = _publication_settings()
+    cache = PublicationCache(options.get('cache_path', 'publications.sqlite3'))
+    cache.import_yaml(options.get('legacy_yaml_cache', 'tmp.yaml'))
+    return cache
 
 
-def esearch(term, db='gds'):
-    """
-    Queries NCBI using the esearch utility. GEO ('gds') database is used as default for search term.
-    """
-    logger.debug(f"Start esearch GDS ({term})")
-    url = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db={db}&term={term}&retmax=5000&usehistory=y'
-    response = urllib.request.urlopen(url)
-    return response.read()
+def sheet_signature(tsv=PUBLICATIONS_SHEET):
+    stat = os.stat(tsv)
+    return stat.st_mtime_ns, stat.st_size
 
 
-def get_esummary(esearch_string, db='gds'):
-    """
-    Parses a http response in XML format to obtain the webenv and querykey tokens.
-    Uses NCBI eutils to transform these tokens into web summaries of GEO (db='gds') datasets.
-    """
-    logger.debug("Start esummary GDS")
-    xmldoc = minidom.parseString(esearch_string)
-    try:
-        webenv = xmldoc.getElementsByTagName('WebEnv')[0].firstChild.data
-        querykey = xmldoc.getElementsByTagName('QueryKey')[0].firstChild.data
-        host = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi'
-        params = f'?db={db}&version=2.0&query_key={querykey}&WebEnv={webenv}'
-        url = host + params
-        response = urllib.request.urlopen(url)
-        return response.read()
-    except IndexError as e:
-        logger.debug(f"Unparsable publication string ({e}, search={esearch_string}")
-        return ""
+_memo = {'signature': None, 'records': None, 'index': None}
+_memo_lock = threading.Lock()
 
 
-def parse_geo_esummary(input_string):
+def get_publication_index(tsv=PUBLICATIONS_SHEET, cache=None):
     """
-    Parses an XML-formatted GEO metadata string and returns series, sample, and platform metadata.
-    Importantly, this function uses the GEO metadata to pull out the SRA accession ID.
+    Returns publication records keyed by cleaned DOI, newest first, and their search index (@see
+    publication_search). Rows already in the cache are not re-fetched; new rows are ingested concurrently and
+    upserted into the cache one by one, @see publication_ingest
+    Both are kept in memory until the sheet changes (mtime or size). The records only hold the number of accessions
+    of each kind; the accessions themselves are loaded per publication, @see get_publication_accessions
+    :return: (records, PublicationIndex)
     """
-    logger.debug("Parsing esummary GDS")
-    try:
-        o = xmltodict.parse(input_string)
-    except Exception as e:
-        logger.debug(f"Could not parse xml to dict: {input_string}")
-        return [], [], []
-    series_metadata = defaultdict()  # should only be one series per xml string
-    sample_metadata = []  # one or more samples
-    platform_metadata = []  # one or more associated platforms
-    try:
-        for document_summary in o['eSummaryResult']['DocumentSummarySet']['DocumentSummary']:
-            acc = document_summary['Accession']
-            title = document_summary['title']
-            description = document_summary['summary']
-            if acc.startswith('GSE'):  # Series
-                series_metadata = {'accession': acc, 'title': title, 'description': description}
-            elif acc.startswith('GSM'):  # Sample
-                sra = ""
-                try:
-                    if document_summary['ExtRelations']['ExtRelation']['RelationType'] == 'SRA':
-                        sra = document_summary['ExtRelations']['ExtRelation']['TargetObject']
-                except KeyError:
-                    logger.error(f"Error parsing GEO Summary. No known SRA or malformed entry {acc}.")
-                    raise
-                except TypeError:
-                    logger.error(f"Error parsing GEO Summary {acc}. Make sure the GEO accession ID is not a superSeries.")
-                    raise
-                metadata = {'accession': acc, 'title': title, 'description': description, 'SRA': sra}
-                sample_metadata.append(metadata)
-            elif acc.startswith('GPL'):  # Platform
-                platform_metadata.append({'accession': acc, 'title': title, 'description': description})
-    except KeyError as e:
-        logger.error(e, input_string)
-    return series_metadata, sample_metadata, platform_metadata
-
+    signature = sheet_signature(tsv)
+    with _memo_lock:
+        if _memo['signature'] != signature:
+            cache = cache or get_publication_cache()
+            records = cache.load(accessions=False)
+            logger.debug(f"Loaded {len(records)} publications from cache")
+            ingest = PublicationIngest(
+                max_workers=_publication_settings().get('ingest_workers', 4),
+                checkpoint=cache.upsert,
+            )
+            records = ingest.run(read_sheet(tsv).to_dict(orient='records'), records)
+            for record in records.values():
+                if 'accession_counts' not in record:  # newly ingested
+                    record['accession_counts'] = {field: len(record.pop(field, [])) for field in ACCESSION_FIELDS}
 
-def efetch(srx, db='sra'):
-    logger.debug(f"Starting efetch SRA {srx}")
-    host = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-    url = host + f'efetch.fcgi?db={db}&id={srx}'
-    try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError as e:
-        logger.error(e)
-        response = urllib.request.urlopen(url, timeout=1)
-    return response.read()
+            _memo['signature'] = signature
+            _memo['records'] = OrderedDict(sorted(records.items(), key=lambda x: x[1]['pub_year'], reverse=True))
+            _memo['index'] = PublicationIndex(_memo['records'])
+        return _memo['records'], _memo['index']
 
 
-def parse_srx(input_string):
+def get_publications(tsv=PUBLICATIONS_SHEET, cache=None):
     """
-    Takes an input string from an API call to eutils, returns a list of tuples [SRR accession, label]
+    :return: publication records keyed by cleaned DOI, newest first, @see get_publication_index
     """
-    logger.debug("Parsing SRA")
-    try:
-        o = xmltodict.parse(input_string)
-    except TypeError as e:
-        logger.error(f"Having trouble parsing SRX input string (starts with: {input_string[:200]}...).")
-        raise
-    accession_metadata = []
-    for _, experiment in o['EXPERIMENT_PACKAGE_SET'].items():
-        try:
-            label = experiment['EXPERIMENT']['TITLE']
-            for key, run in experiment['RUN_SET'].items():
-                if key == 'RUN':
-                    try:  # one RUN per RUN_SET
-                        srr = run['IDENTIFIERS']['PRIMARY_ID']
-                        label2 = label + f' (SRR: {srr})'
-                        accession_metadata.append((srr, label2))
-                    except TypeError:  # multiple RUNS per RUN_SET
-                        for r in run:
-                            srr = r['IDENTIFIERS']['PRIMARY_ID']
-                            label2 = label + f' (SRR: {srr})'
-                            accession_metadata.append((srr, label2))
-        except KeyError:
-            logger.error(f"Dictionary does not have the requisite keys {o}")
+    return get_publication_index(tsv, cache)[0]
 
-    return sorted(accession_metadata)
 
-
-def get_srr_from_geo_accession(geo_term):
+def get_publication_accessions(doi):
     """
-    Converts GEO accession codes into a list of SRA accessions.
-    Returns a list of tuples [(SRR_accession1, label1), (SRR_accession2, label2), etc.]
+    Returns the GEO/PRIDE/OMERO accessions of one publication as {field: [[accession, label], ...]}, or None for
+    an unknown DOI. Kept in the django cache for PUBLICATIONS['accessions_ttl'] seconds.
     """
-    logger.debug(f"parsing {geo_term}")
-    esummary = get_esummary(esearch(geo_term, db='gds'), db='gds')
-    try:
-        series_metadata, sample_metadata, platform_metadata = parse_geo_esummary(esummary)
-    except TypeError as e:
-        logger.error(f"Problem parsing GEO term {geo_term}: {e}")
-        return []
-    accessions = []
-    for sample in sample_metadata:  # one for each GSM id
-
-        try:
-            fetched = efetch(srx=sample['SRA'])
-            accessions += parse_srx(fetched)
-        except IndexError as e:
-            logger.error(f"Error in get_srr_from_geo_accession({geo_term}) {e}")
-            pass
+    key = f'publication-accessions:{doi}'
+    accessions = cache_backend.get(key)
+    if accessions is None:
+        accessions = get_publication_cache().get_accessions(doi)
+        if accessions is not None:
+            cache_backend.set(key, accessions, _publication_settings().get('accessions_ttl', 60 * 60))
     return accessions
 
 
-def get_files_from_pride_accession(pride_accession):
-    files = []
-    response = requests.get(
-        f'https://www.ebi.ac.uk/pride/ws/archive/v2/projects/{pride_accession}/files',
-        headers={'Accept': 'application/json'}
-    )
-    responsej = response.json()
-    for file_object in responsej['_embedded']['files']:
-        for f in file_object['publicFileLocations']:
-            if f['name'] == 'FTP Protocol':
-                files.append((f['value'], os.path.basename(f['value'])))
-
-    return files
-
-
-def clean_doi(doi):
-    """
-    Turns DOI accession IDs into something parseable by django forms.
-    Forms do not work well with '.' or '/', so to be safe, we'll
-    transform non-alphanumeric characters into underscores.
-    (eg. 10.1038/s41593-019-0393-4 -> 10_1038_s41593_019_0393_4
-    """
-    return re.sub(r"[^a-zA-Z0-9]", '_', doi)
+def invalidate_publications():
+    with _memo_lock:
+        _memo['signature'] = None
+        _memo['records'] = None
+        _memo['index'] = None
 
 
-publications = get_publications()
\ No newline at end of file
+publications = get_publications()
@@ -6,17 +6,13 @@ from .navbars import navbar_home, navbar_authenticated
 from .helpers import *
 
 from .. import settings
-from ..tools import connect_mongodb
+from ..mongo import db
 
 logger = logging.getLogger(__name__)
 
 search_app = DjangoDash('MetadataSearchApp', external_stylesheets=[settings.BOOTSTRAP_THEME])
 
 
-db = connect_mongodb(database='u19', user=bytes(os.environ.get("MONGODB_USER"), 'utf-8'),
-                     password=bytes(os.environ.get("MONGODB_PASSWORD"), 'utf-8'))
-
-
 def mongodb_search(experiment_nickname, experiment_summary, email_search, tool, db=db):
     results = []
     if experiment_nickname != "":
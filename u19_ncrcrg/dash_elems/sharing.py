@@ -9,7 +9,7 @@ from django_plotly_dash import DjangoDash
 from .helpers import *
 from .navbars import navbar_authenticated
 from .. import settings
-from ..accounts.views import get_admin_client
+from ..accounts.views import already_exists, get_admin_client
 from ..settings import GLOBUS_USS_EP_ID, CRED_BASE_URL
 
 logger = logging.getLogger(__name__)
@@ -400,12 +400,15 @@ def confirm_share(session):
     """
     Create the share
 
+    Paths already shared with the group are skipped, so a failed share can be confirmed again.
+
     :param session: a dictionary-like session object containing the information about the object being shared
     :return Boolean, string: regarding whether the share attempt is successful or not, and the message (None if success)
     """
     endpoint_id = session.get('endpoint_id', None)
     path = session.get('path', [])
     uuid = session.get('uuid', None)
+    cred_admin = get_admin_client()
     for p in path:
         r_data = {
             "DATA_TYPE": "access",
@@ -414,12 +417,15 @@ def confirm_share(session):
             "path": p,
             "permissions": "r",
         }
-        cred_admin = get_admin_client()
         try:
             cred_admin.add_endpoint_acl_rule(endpoint_id, r_data)
         except Exception as e:
-            logger.error('The sharing confirmation error is', e)
-            return False
+            if already_exists(e):
+                # added by an earlier attempt
+                logger.debug(f'{p} is already shared with group {uuid}')
+                continue
+            logger.error(f'The sharing confirmation error is {e}')
+            return False, str(e)
     return True, None
 
 
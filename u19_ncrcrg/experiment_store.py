@@ -0,0 +1,236 @@
+"""
+Mongo records of submitted jobs.
+
+A job is an Experiments document (its job_metadata) plus an entry in the experiments array of its owner's project in
+the Projects collection:
+
+    {
+        'project_name': ..., 'user': ..., 'description': 'default', 'tags': ['CREDV2'], 'removed': 0, 'trashed': 'no',
+        'experiments': [{'aggr_nickname', 'type', 'modality'}, ...],
+        'num_experiments': len(experiments)
+    }
+
+The project is created on the job's first submission by the same upsert that appends the job ($setOnInsert with
+$push and $inc), so concurrent submissions to a new project cannot race into duplicates; the unique
+(user, project_name) index (@see mongo.INDEXES) backs this up. With JOB_SUBMISSION['transactions'] the experiment
+insert and the project upsert commit together (this needs a replica set, e.g. Atlas).
+"""
+import logging
+
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .mongo import db
+
+logger = logging.getLogger(__name__)
+
+EXPERIMENTS = 'Experiments'
+PROJECTS = 'Projects'
+
+
+def new_project(project_name, username, description='default'):
+    """
+    :return: the Projects document of a project with no experiments
+    """
+    return {
+        "project_name": project_name,
+        "description": description,
+        "user": username,
+        "tags": ["CREDV2"],
+        "removed": 0,
+        "trashed": "no",
+        "experiments": [],
+        "num_experiments": 0,
+    }
+
+
+def experiment_entry(job_metadata):
+    """
+    :return: the entry of a job in its project's experiments array
+    """
+    return {
+        'aggr_nickname': job_metadata['aggr_nickname'],
+        'type': "personal",
+        'modality': job_metadata['modality'],
+    }
+
+
+def project_upsert(project_name, username, entries):
+    """
+    :param entries: list of experiment entries, @see experiment_entry
+    :return: (filter, update) of the upsert creating the project if needed and appending entries to it
+    """
+    defaults = new_project(project_name, username)
+    for field in ('project_name', 'user', 'experiments', 'num_experiments'):
+        # set by the query, or by $push / $inc
+        defaults.pop(field)
+    return (
+        {'user': username, 'project_name': project_name},
+        {
+            '$setOnInsert': defaults,
+            '$push': {'experiments': {'$each': entries}},
+            '$inc': {'num_experiments': len(entries)},
+        },
+    )
+
+
+def _transactions():
+    return getattr(settings, 'JOB_SUBMISSION', {}).get('transactions', False)
+
+
+class ExperimentStore:
+    """
+    Writes job records.
+
+    :param experiments: pymongo Collection of experiments, defaults to db.Experiments
+    :param projects: pymongo Collection of projects, defaults to db.Projects
+    """
+
+    def __init__(self, experiments=None, projects=None):
+        self._experiments = experiments
+        self._projects = projects
+
+    @property
+    def experiments(self):
+        return self._experiments if self._experiments is not None else db[EXPERIMENTS]
+
+    @property
+    def projects(self):
+        return self._projects if self._projects is not None else db[PROJECTS]
+
+    def _in_transaction(self, write, transaction):
+        """
+        Runs write(session), inside a transaction if transaction (JOB_SUBMISSION['transactions'] if None) is set.
+        """
+        if not (_transactions() if transaction is None else transaction):
+            return write(None)
+        with self.experiments.database.client.start_session() as session:
+            return session.with_transaction(write)
+
+    def _upsert_projects(self, upserts, session):
+        """
+        :param upserts: list of (filter, update), @see project_upsert
+        """
+        operations = [UpdateOne(query, update, upsert=True) for query, update in upserts]
+        try:
+            self.projects.bulk_write(operations, ordered=False, session=session)
+        except BulkWriteError as e:
+            # two upserts creating the same project at once: the loser hits the unique index and is run again now
+            # that the project exists. Inside a transaction the write conflict makes with_transaction retry instead.
+            errors = e.details.get('writeErrors', [])
+            if session is not None or any(error.get('code') != 11000 for error in errors):
+                raise
+            self.projects.bulk_write([operations[error['index']] for error in errors], ordered=False)
+
+    def add(self, job_metadata, username, transaction=None):
+        """
+        Records a job: inserts its Experiments document and appends it to its project, creating the project if needed.
+        Raises on failure.
+        :param job_metadata: dictionary, not modified
+        :param transaction: bool, overrides JOB_SUBMISSION['transactions']
+        """
+        query, update = project_upsert(job_metadata['project'], username, [experiment_entry(job_metadata)])
+
+        def write(session):
+            # a copy, insert_one adds an _id to what it is given
+            self.experiments.insert_one(dict(job_metadata), session=session)
+            try:
+                self.projects.update_one(query, update, upsert=True, session=session)
+            except DuplicateKeyError:
+                if session is not None:
+                    raise
+                # @see _upsert_projects
+                self.projects.update_one(query, update, upsert=True)
+
+        self._in_transaction(write, transaction)
+
+    def add_many(self, job_documents, username, transaction=None):
+        """
+        Bulk version of add: one insert_many for the experiments and one bulk_write with an upsert per project.
+        Without a transaction a job whose experiment could not be inserted is left out of its project and the others
+        go ahead; in a transaction any error fails the whole batch.
+        :param job_documents: list of job_metadata dictionaries, not modified
+        :return: list holding, for each job, None or the error that kept it from being recorded
+        """
+        errors = [None] * len(job_documents)
+        if not job_documents:
+            return errors
+        use_transaction = _transactions() if transaction is None else transaction
+
+        def write(session):
+            errors[:] = [None] * len(job_documents)
+            try:
+                self.experiments.insert_many([dict(job_metadata) for job_metadata in job_documents], ordered=False,
+                                             session=session)
+            except BulkWriteError as e:
+                if use_transaction:
+                    raise
+                for error in e.details.get('writeErrors', []):
+                    errors[error['index']] = f"experiment: {error.get('errmsg')}"
+            by_project = {}
+            for job_metadata, error in zip(job_documents, errors):
+                if error is None:
+                    by_project.setdefault(job_metadata['project'], []).append(experiment_entry(job_metadata))
+            if by_project:
+                self._upsert_projects([project_upsert(project, username, entries)
+                                       for project, entries in by_project.items()], session)
+
+        try:
+            self._in_transaction(write, use_transaction)
+        except Exception as e:
+            logger.error(f"Problem recording {len(job_documents)} jobs for {username}: {e}")
+            return [f"mongo: {e}"] * len(job_documents)
+        return errors
+
+    def add_project(self, project_record):
+        """
+        Creates a project unless the user already has one with that name.
+        :param project_record: dictionary with at least project_name and user
+        :return: True if the project was created
+        """
+        defaults = new_project(project_record['project_name'], project_record['user'])
+        defaults.update(project_record)
+        for field in ('project_name', 'user'):
+            defaults.pop(field)
+        result = self.projects.update_one(
+            {'user': project_record['user'], 'project_name': project_record['project_name']},
+            {'$setOnInsert': defaults},
+            upsert=True,
+        )
+        return result.upserted_id is not None
+
+    def duplicate_projects(self):
+        """
+        :return: list of {'_id': {'user', 'project_name'}, 'ids': [...]} for every project stored more than once
+        """
+        return list(self.projects.aggregate([
+            {'$group': {'_id': {'user': '$user', 'project_name': '$project_name'}, 'ids': {'$push': '$_id'},
+                        'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}},
+        ]))
+
+    def merge_duplicate_projects(self):
+        """
+        Merges projects stored more than once (by the old find-then-insert code) into their oldest copy, so the unique
+        (user, project_name) index can be built.
+        :return: number of project documents removed
+        """
+        removed = 0
+        for duplicate in self.duplicate_projects():
+            projects = sorted(self.projects.find({'_id': {'$in': duplicate['ids']}}), key=lambda project: project['_id'])
+            keep, others = projects[0], projects[1:]
+            experiments = list(keep.get('experiments', []))
+            seen = {experiment.get('aggr_nickname') for experiment in experiments}
+            for project in others:
+                for experiment in project.get('experiments', []):
+                    if experiment.get('aggr_nickname') not in seen:
+                        seen.add(experiment.get('aggr_nickname'))
+                        experiments.append(experiment)
+            self.projects.update_one({'_id': keep['_id']},
+                                     {'$set': {'experiments': experiments, 'num_experiments': len(experiments)}})
+            removed += self.projects.delete_many({'_id': {'$in': [project['_id'] for project in others]}}).deleted_count
+        return removed
+
+
+store = ExperimentStore()
@@ -183,50 +183,3 @@ class DynamicForm(forms.Form):
             raise ValidationError("Passwords did not match")
         """
         pass
-
-
-class PublicationForm(forms.Form):
-    def __init__(self, *args, **kwargs):
-        self.title = kwargs.pop('title')
-        self.authors = kwargs.pop('authors')
-        self.full_authors = kwargs.pop('full_authors')
-        self.abstract = kwargs.pop('abstract')
-        self.geo_accessions = kwargs.pop('geo_accessions')
-        self.pride_accessions = kwargs.pop('pride_accessions')
-        self.omero_accessions = kwargs.pop('omero_accessions')
-        self.pub_year = kwargs.pop('pub_year')
-        self.total_citations = kwargs.pop('total_citations')
-        super().__init__(*args, **kwargs)
-        self.helper = FormHelper()
-        geo_accessions = []
-        pride_accessions = []
-        omero_accessions = []
-        for accession in self.geo_accessions:
-            geo_accessions.append(accession)
-        for accession in self.pride_accessions:
-            pride_accessions.append(accession)
-        for accession in self.omero_accessions:
-            omero_accessions.append(accession)
-
-        self.fields['geo_accessions'] = forms.MultipleChoiceField(
-            label='Select files to import:',
-            choices=geo_accessions,
-            widget=forms.SelectMultiple(attrs={'size': min(10, len(geo_accessions)), 'width': 15})
-        )
-        self.fields['pride_accessions'] = forms.MultipleChoiceField(
-            label='Select files to import:',
-            choices=pride_accessions,
-            widget=forms.SelectMultiple(attrs={'size': min(10, len(pride_accessions)), 'width': 15})
-        )
-        self.fields['omero_accessions'] = forms.MultipleChoiceField(
-            label='Select files to import:',
-            choices=omero_accessions,
-            widget=forms.SelectMultiple(attrs={'size': min(10, len(omero_accessions)), 'width': 15})
-        )
-        self.helper.form_method = 'POST'
-
-    def clean(self):
-        """
-        Currently does nothing.
-        """
-        pass
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Moves job status messages from SQS (the shared status queues, and the per-job queues while
+JOB_STATUS['legacy_queues'] is set) into the JobStatuses collection.
+
+    python manage.py consume_job_statuses [--once] [--interval 30] [--days 14]
+
+The per-job queues are emptied, so JOB_STATUS['store_first'] must be set wherever statuses are read
+(@see status_service).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import status_service
+from ...status_consumer import StatusConsumer, recent_jobs
+
+
+class Command(BaseCommand):
+    help = ('Drains status messages from the shared status queues and the queues of recent jobs into the job '
+            'status store.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain every queue once and exit.')
+        parser.add_argument('--interval', type=int, default=30,
+                            help='Seconds between passes when running continuously.')
+        parser.add_argument('--days', type=int, default=14,
+                            help='Only consume queues of jobs submitted in the last DAYS days.')
+
+    def handle(self, *args, **options):
+        if not status_service.store_first():
+            self.stderr.write("JOB_STATUS['store_first'] is not set: the statuses this moves out of the per-job "
+                              "queues will not be read from the store")
+        consumer = StatusConsumer()
+        while True:
+            started = time.time()
+            recorded = sum(consumer.drain_shared(name) for name in status_service.shared_queue_names())
+            if status_service.legacy_queues():
+                recorded += consumer.drain_all(recent_jobs(days=options['days']))
+            self.stdout.write(f"Recorded {recorded} status message(s) in {time.time() - started:.1f}s")
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
@@ -0,0 +1,110 @@
+"""
+Builds the MongoDB indexes declared in u19_ncrcrg.mongo.INDEXES and reports which of the
+portal's hot queries still fall back to a collection scan.
+
+    python manage.py ensure_indexes [--skip-build] [--skip-explain] [--merge-duplicate-projects]
+
+An existing index whose unique option differs from its declaration is dropped and built again. An index
+being made unique is left alone while the collection holds duplicate keys (@see --merge-duplicate-projects).
+"""
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import OperationFailure, PyMongoError
+
+from ...experiment_store import store as experiment_store
+from ...mongo import INDEXES, INDEXED_QUERIES, db
+
+
+def _has_duplicates(collection, keys):
+    """
+    :return: whether two documents of collection share the same values for keys
+    """
+    group = {field.replace('.', '_'): f'${field}' for field, _ in keys}
+    return any(True for _ in db[collection].aggregate([
+        {'$group': {'_id': group, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$limit': 1},
+    ], allowDiskUse=True))
+
+
+def _plan_stages(plan):
+    """
+    Yields every stage name in an explain() plan tree.
+    """
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ('inputStage', 'queryPlan'):
+        yield from _plan_stages(plan.get(key))
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+class Command(BaseCommand):
+    help = 'Builds the declared MongoDB indexes (idempotent) and reports queries that use COLLSCAN.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-build', action='store_true',
+                            help="Don't create indexes, only report on query plans.")
+        parser.add_argument('--skip-explain', action='store_true',
+                            help="Don't explain() the declared queries.")
+        parser.add_argument('--merge-duplicate-projects', action='store_true',
+                            help="Merge projects stored more than once for the same user before building the "
+                                 "unique (user, project_name) index.")
+
+    def handle(self, *args, **options):
+        failures = 0
+        if options['merge_duplicate_projects']:
+            removed = experiment_store.merge_duplicate_projects()
+            self.stdout.write(f"Merged duplicate projects, removed {removed} document(s)")
+        if not options['skip_build']:
+            failures += self.build_indexes()
+        if not options['skip_explain']:
+            self.explain_queries()
+        if failures:
+            raise CommandError(f"{failures} index(es) could not be built.")
+
+    def build_indexes(self):
+        failures = 0
+        existing = {}
+        for collection, keys, index_options in INDEXES:
+            name = index_options['name']
+            try:
+                if collection not in existing:
+                    existing[collection] = db[collection].index_information()
+                if name in existing[collection]:
+                    if existing[collection][name].get('unique', False) == index_options.get('unique', False):
+                        self.stdout.write(f"{collection}.{name}: exists")
+                        continue
+                    if index_options.get('unique', False) and _has_duplicates(collection, keys):
+                        # dropping the old index first would leave the collection with none
+                        failures += 1
+                        self.stderr.write(self.style.ERROR(
+                            f"{collection}.{name}: duplicate keys, not made unique (@see --merge-duplicate-projects)"))
+                        continue
+                    self.stdout.write(f"{collection}.{name}: rebuilding, unique={index_options.get('unique', False)}")
+                    db[collection].drop_index(name)
+                db[collection].create_index(keys, **index_options)
+                self.stdout.write(self.style.SUCCESS(f"{collection}.{name}: created"))
+            except OperationFailure as e:
+                # typically an equivalent index under another name, a second text index, or duplicates keeping a
+                # unique index from being built (@see --merge-duplicate-projects)
+                failures += 1
+                self.stderr.write(self.style.ERROR(f"{collection}.{name}: {e.details.get('errmsg', e)}"))
+            except PyMongoError as e:
+                failures += 1
+                self.stderr.write(self.style.ERROR(f"{collection}.{name}: {e}"))
+        return failures
+
+    def explain_queries(self):
+        for description, collection, query in INDEXED_QUERIES:
+            try:
+                explanation = db[collection].find(query).explain()
+            except PyMongoError as e:
+                self.stderr.write(self.style.ERROR(f"{description}: could not explain ({e})"))
+                continue
+            stages = list(_plan_stages(explanation.get('queryPlanner', {}).get('winningPlan', {})))
+            if 'COLLSCAN' in stages:
+                self.stdout.write(self.style.WARNING(f"{description}: COLLSCAN"))
+            else:
+                self.stdout.write(f"{description}: {' <- '.join(stages)}")
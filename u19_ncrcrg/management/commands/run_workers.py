@@ -0,0 +1,52 @@
+"""
+Runs background tasks, @see tasks and background_tasks.
+
+    python manage.py run_workers [--workers 8] [--once]
+    python manage.py run_workers --status
+"""
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ... import tasks
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background tasks (job submission, Globus sharing, USS setup, ...).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'TASKS', {}).get('workers', 8),
+                            help="Number of worker threads, TASKS['workers'] by default.")
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due.')
+        parser.add_argument('--status', action='store_true',
+                            help='Print the number of tasks in each state and the latest failures, then exit.')
+
+    def handle(self, *args, **options):
+        broker = tasks.get_broker()
+        if options['status']:
+            for status, count in broker.counts().items():
+                self.stdout.write(f"{status:>10}: {count}")
+            for document in broker.tasks(status=tasks.FAILED):
+                self.stdout.write(f"{document['_id']} {document['name']} after {document['attempts']} attempt(s): "
+                                  f"{document['last_error']}")
+            return
+
+        tasks.load_task_modules()
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=tasks.Worker(broker).run, kwargs={'stop': stop, 'exit_when_idle': options['once']},
+                             daemon=True)
+            for _ in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} worker(s)")
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,31 @@
+"""
+Removes jobs that have been in the trash for longer than the retention period.
+
+    python manage.py sweep_trash [--max-days 14] [--workers 8] [--dry-run] [--interval SECONDS]
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...trash import TRASH_RETENTION_DAYS, sweep
+
+
+class Command(BaseCommand):
+    help = 'Deletes the SQS queues of expired trashed jobs and marks them removed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-days', type=int, default=TRASH_RETENTION_DAYS,
+                            help='Days a job stays in the trash before it is removed.')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent queue deletions.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report expired jobs.')
+        parser.add_argument('--interval', type=int, default=None,
+                            help='Keep running, sweeping every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            summary = sweep(max_days=options['max_days'], max_workers=options['workers'],
+                            dry_run=options['dry_run'])
+            self.stdout.write(', '.join(f'{key}: {value}' for key, value in summary.items()))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,233 @@
+"""
+Process-wide MongoDB client.
+
+Every module that talks to the portal database goes through `db` (or get_db()/get_client()) so
+that a worker opens a single connection pool to the cluster instead of one per importing module.
+The client is created on first use, not at import time, and is re-created in a child process
+after a fork (e.g. gunicorn --preload), since pymongo clients must not be shared across forks.
+"""
+import datetime
+import logging
+import os
+import threading
+import urllib.parse
+
+import pymongo
+from django.conf import settings
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+DATABASE = 'u19'
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Counts connection pool events so the pool size and checkout pressure can be inspected at
+    runtime. @see pool_stats()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {
+                'connections_created': 0,
+                'connections_closed': 0,
+                'checked_out': 0,
+                'checkout_failures': 0,
+                'pools_cleared': 0,
+            }
+            self.open_connections = 0
+            self.in_use = 0
+
+    def pool_created(self, event):
+        logger.debug(f"MongoDB pool created for {event.address}")
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.counts['pools_cleared'] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.counts['connections_created'] += 1
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.counts['connections_closed'] += 1
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.counts['checkout_failures'] += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.counts['checked_out'] += 1
+            self.in_use += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counts)
+            stats['open_connections'] = self.open_connections
+            stats['in_use'] = self.in_use
+        return stats
+
+
+pool_listener = PoolStatsListener()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _client_settings():
+    return getattr(settings, 'MONGODB_CLIENT', {})
+
+
+def _build_client():
+    options = _client_settings()
+    uri = "mongodb+srv://{}:{}@cluster0-hcum8.mongodb.net/test?retryWrites=true".format(
+        urllib.parse.quote_plus(settings.MONGODB_USER),
+        urllib.parse.quote_plus(settings.MONGODB_PASSWORD))
+    return pymongo.MongoClient(
+        uri,
+        tls=True,
+        tlsAllowInvalidCertificates=True,
+        maxPoolSize=options.get('max_pool_size', 20),
+        minPoolSize=options.get('min_pool_size', 0),
+        maxIdleTimeMS=options.get('max_idle_time_ms', None),
+        connectTimeoutMS=options.get('connect_timeout_ms', 10000),
+        socketTimeoutMS=options.get('socket_timeout_ms', None),
+        serverSelectionTimeoutMS=options.get('server_selection_timeout_ms', 10000),
+        readPreference=options.get('read_preference', 'primary'),
+        event_listeners=[pool_listener],
+    )
+
+
+def get_client():
+    """
+    Returns the MongoClient for this process, creating it on first use and after a fork.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                if _client is not None:
+                    # inherited from the parent process; its sockets belong to the parent
+                    logger.debug(f"Re-creating MongoDB client after fork (pid {pid})")
+                    pool_listener.reset()
+                _client = _build_client()
+                _client_pid = pid
+    return _client
+
+
+def get_db(name=DATABASE):
+    return get_client()[name]
+
+
+def close():
+    """
+    Closes this process's client, if any. The next access opens a new one.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def pool_stats():
+    """
+    :return: dictionary of connection pool counters for this process
+    """
+    stats = pool_listener.stats()
+    stats['max_pool_size'] = _client_settings().get('max_pool_size', 20)
+    return stats
+
+
+class _LazyDatabase:
+    """
+    Stand-in for a pymongo Database that resolves the shared client on each access, so modules can
+    keep a module-level `db` without connecting at import time.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getitem__(self, collection):
+        return get_db(self._name)[collection]
+
+    def __getattr__(self, attr):
+        return getattr(get_db(self._name), attr)
+
+    def __repr__(self):
+        return f"<lazy MongoDB database {self._name!r}>"
+
+
+db = _LazyDatabase(DATABASE)
+
+
+# Indexes backing the portal's queries. Built by `manage.py ensure_indexes`.
+# Each entry is (collection, keys, options); keys use the same (field, direction) pairs as
+# pymongo's create_index().
+INDEXES = [
+    # job_status.get_all_projects / get_project_experiments, experiment_store (one project per name and user)
+    ('Projects', [('user', pymongo.ASCENDING), ('project_name', pymongo.ASCENDING)],
+     {'name': 'user_project_name', 'unique': True}),
+    # trash.find_expired
+    ('Projects', [('experiments.trashed', pymongo.ASCENDING)],
+     {'name': 'experiments_trashed'}),
+    # job_status.get_job_metadata
+    ('Experiments', [('aggr_nickname', pymongo.ASCENDING), ('user', pymongo.ASCENDING)],
+     {'name': 'aggr_nickname_user'}),
+    # search.mongodb_search
+    ('Experiments', [('experiment_summary', pymongo.TEXT)],
+     {'name': 'experiment_summary_text'}),
+    ('Experiments', [('user', pymongo.ASCENDING), ('module', pymongo.ASCENDING)],
+     {'name': 'user_module'}),
+    ('Experiments', [('user', pymongo.ASCENDING), ('email', pymongo.ASCENDING)],
+     {'name': 'user_email'}),
+    ('Experiments', [('user', pymongo.ASCENDING), ('contact_email', pymongo.ASCENDING)],
+     {'name': 'user_contact_email'}),
+    # tasks.MongoBroker.claim / put
+    ('Tasks', [('status', pymongo.ASCENDING), ('run_at', pymongo.ASCENDING)],
+     {'name': 'status_run_at'}),
+    ('Tasks', [('idempotency_key', pymongo.ASCENDING)],
+     {'name': 'idempotency_key', 'unique': True, 'sparse': True}),
+]
+
+# Representative queries, checked with explain() after the indexes are built.
+# Each entry is (description, collection, filter).
+INDEXED_QUERIES = [
+    ('projects by user', 'Projects', {'user': 'public'}),
+    ('project by name and user', 'Projects', {'project_name': '', 'user': 'public'}),
+    ('expired trash', 'Projects', {'experiments.trashed': {'$lt': datetime.datetime(2000, 1, 1)}}),
+    ('experiment by aggr_nickname and user', 'Experiments', {'aggr_nickname': '', 'user': 'public'}),
+    ('public experiments by summary text', 'Experiments', {'$text': {'$search': 'rna'}, 'user': 'public'}),
+    ('public experiments by module', 'Experiments', {'module': '', 'user': 'public'}),
+    ('public experiments by email', 'Experiments', {'email': '', 'user': 'public'}),
+    ('public experiments by contact email', 'Experiments', {'contact_email': '', 'user': 'public'}),
+    ('due tasks', 'Tasks', {'status': 'pending', 'run_at': {'$lte': datetime.datetime(2000, 1, 1)}}),
+]
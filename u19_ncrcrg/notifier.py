@@ -0,0 +1,166 @@
+"""
+Emails job owners when their job completes or fails.
+
+Every NOTIFIER['interval'] seconds, the statuses of recent non-public jobs are checked (at most
+NOTIFIER['concurrency'] at a time) and each owner is emailed once per finished job. Sent emails
+are recorded in the job status store (@see status_store.StatusStore.claim_notification), so a
+restart or a second notifier process never emails the same job twice.
+
+Run with `python query_sqs.py`.
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from django.conf import settings
+from django.core.mail import send_mail
+
+from . import status_service
+from .mongo import db
+from .status_store import store as default_store
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_USERS_JOB_STATUS = ['^Complete!', '^Failed', ]
+
+
+def _notifier_settings():
+    return getattr(settings, 'NOTIFIER', {})
+
+
+def recent_experiments(days):
+    """
+    Returns the non-public experiments submitted in the last `days` days. ObjectIds start with
+    their creation time, so this is a range scan on _id.
+    """
+    cutoff = ObjectId.from_datetime(datetime.datetime.utcnow() - datetime.timedelta(days=days))
+    return list(db['Experiments'].find(
+        {'_id': {'$gte': cutoff}, 'user': {'$ne': 'public'}},
+        {'aggr_nickname': True, 'contact_email': True, 'user': True}
+    ))
+
+
+def should_notify(status):
+    return any(re.match(pattern, status) for pattern in NOTIFY_USERS_JOB_STATUS)
+
+
+class Notifier:
+    """
+    :param interval: int, seconds between the start of two polls
+    :param concurrency: int, maximum number of status lookups and emails in flight
+    :param days: int, only jobs submitted in the last `days` days are checked
+    :param store: StatusStore that records which jobs were notified
+    :param get_statuses: callable taking job ids and returning {job id: (status, last updated)}
+    :param send: callable with django.core.mail.send_mail's signature
+    :param get_experiments: callable taking `days` and returning experiment documents
+    """
+
+    def __init__(self, interval=60, concurrency=8, days=30, store=None, get_statuses=None, send=None,
+                 get_experiments=None):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.days = days
+        self.store = store or default_store
+        self.get_statuses = get_statuses or status_service.get_statuses
+        self.send = send or send_mail
+        self.get_experiments = get_experiments or recent_experiments
+        self.from_email = _notifier_settings().get('from_email', 'ncrcrg.u19@gmail.com')
+        self.metrics = {
+            'polls': 0,
+            'last_poll_seconds': None,
+            'max_poll_seconds': 0,
+            'backlog': 0,
+            'checked': 0,
+            'emails_sent': 0,
+            'errors': 0,
+        }
+
+    async def _run_blocking(self, executor, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    async def check(self, experiment, status, semaphore, executor):
+        job_id = experiment['aggr_nickname']
+        async with semaphore:
+            try:
+                self.metrics['checked'] += 1
+                if not should_notify(status):
+                    return False
+                if not self.store.claim_notification(job_id, status):
+                    return False
+                try:
+                    await self._run_blocking(
+                        executor, self.send,
+                        'Job {}'.format(job_id),
+                        'Hello, you are receiving an update for this job: {}'.format(status),
+                        self.from_email,
+                        [experiment['contact_email']]
+                    )
+                except Exception:
+                    self.store.release_notification(job_id, status)
+                    raise
+                self.metrics['emails_sent'] += 1
+                return True
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.error(f"Problem notifying the owner of {job_id}: {e}")
+                return False
+            finally:
+                self.metrics['backlog'] -= 1
+
+    async def poll(self):
+        """
+        Checks every recent job once.
+        :return: int, the number of emails sent
+        """
+        started = time.monotonic()
+        experiments = [e for e in self.get_experiments(self.days)
+                       if e.get('aggr_nickname') and e.get('contact_email')]
+        notified = self.store.notified([e['aggr_nickname'] for e in experiments])
+        experiments = [e for e in experiments if e['aggr_nickname'] not in notified]
+
+        self.metrics['backlog'] = len(experiments)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # all statuses in one lookup, @see status_service.get_statuses
+            statuses = await self._run_blocking(executor, self.get_statuses,
+                                                [e['aggr_nickname'] for e in experiments])
+            results = await asyncio.gather(*(self.check(e, statuses[e['aggr_nickname']][0], semaphore, executor)
+                                             for e in experiments))
+
+        elapsed = time.monotonic() - started
+        self.metrics['polls'] += 1
+        self.metrics['last_poll_seconds'] = round(elapsed, 3)
+        self.metrics['max_poll_seconds'] = max(self.metrics['max_poll_seconds'], round(elapsed, 3))
+        logger.info(f"Checked {len(experiments)} jobs in {elapsed:.1f}s, metrics: {self.metrics}")
+        return sum(results)
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll()
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.error(f"Notifier poll failed: {e}")
+            elapsed = time.monotonic() - started
+            if elapsed > self.interval:
+                logger.warning(f"Poll took {elapsed:.1f}s, longer than the {self.interval}s interval")
+            await asyncio.sleep(max(0, self.interval - elapsed))
+
+
+def main(argv=None):
+    options = _notifier_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interval', type=int, default=options.get('interval', 60))
+    parser.add_argument('--concurrency', type=int, default=options.get('concurrency', 8))
+    parser.add_argument('--days', type=int, default=options.get('days', 30))
+    parser.add_argument('--once', action='store_true', help='Poll once and exit.')
+    args = parser.parse_args(argv)
+
+    notifier = Notifier(interval=args.interval, concurrency=args.concurrency, days=args.days)
+    asyncio.run(notifier.poll() if args.once else notifier.run())
@@ -0,0 +1,160 @@
+"""
+SQLite cache of the featured publication records, one row per (cleaned) DOI.
+
+Records are split in two JSON columns: the summary shown in the publication list, and the resolved GEO/PRIDE/OMERO
+accessions, which are by far the largest part of a record and can be left out of a load. Every write is an atomic
+upsert in its own transaction and the database runs in WAL mode, so several web workers can read it while one of
+them ingests. Replaces the tmp.yaml cache, which is imported once (@see PublicationCache.import_yaml).
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import yaml
+
+from .publication_ingest import ACCESSION_FIELDS
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS publications (
+    doi TEXT PRIMARY KEY,
+    pub_year INTEGER,
+    updated_at REAL NOT NULL,
+    summary TEXT NOT NULL,
+    accessions TEXT NOT NULL
+)
+"""
+
+
+def _json_default(o):
+    # numpy scalars coming from the sheet
+    if hasattr(o, 'item'):
+        return o.item()
+    return str(o)
+
+
+def _dumps(value):
+    return json.dumps(value, default=_json_default)
+
+
+class PublicationCache:
+    """
+    :param path: str, path of the SQLite database. Created on first use.
+    :param timeout: float, seconds to wait for another writer's lock
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+
+    def _connect(self):
+        # one connection per call: sqlite3 connections can't be shared between threads
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    def upsert(self, doi, record):
+        """
+        Inserts or replaces the record of a publication and stamps it with the current time.
+        Has the signature of a PublicationIngest checkpoint.
+        """
+        summary = {k: v for k, v in record.items() if k not in ACCESSION_FIELDS and k != 'accession_counts'}
+        accessions = {k: record.get(k, []) for k in ACCESSION_FIELDS}
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT INTO publications (doi, pub_year, updated_at, summary, accessions) '
+                    'VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT(doi) DO UPDATE SET pub_year = excluded.pub_year, updated_at = excluded.updated_at, '
+                    'summary = excluded.summary, accessions = excluded.accessions',
+                    (doi, record.get('pub_year'), time.time(), _dumps(summary), _dumps(accessions))
+                )
+        finally:
+            conn.close()
+
+    __call__ = upsert
+
+    def load(self, accessions=True, max_age=None):
+        """
+        :param accessions: bool, also load the GEO/PRIDE/OMERO accessions of each record. If False, records get an
+            'accession_counts' dictionary of {field: number of accessions} instead.
+        :param max_age: float, only load records updated in the last max_age seconds
+        :return: dictionary of records keyed by DOI, newest publication first
+        """
+        if accessions:
+            columns = 'doi, summary, accessions'
+        else:
+            columns = 'doi, summary, ' + ', '.join(
+                f"json_array_length(accessions, '$.{field}')" for field in ACCESSION_FIELDS)
+        query = f'SELECT {columns} FROM publications'
+        params = ()
+        if max_age is not None:
+            query += ' WHERE updated_at >= ?'
+            params = (time.time() - max_age,)
+        query += ' ORDER BY pub_year DESC, rowid'
+        conn = self._connect()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        records = {}
+        for row in rows:
+            record = json.loads(row[1])
+            if accessions:
+                record.update(json.loads(row[2]))
+            else:
+                record['accession_counts'] = {field: count or 0 for field, count in zip(ACCESSION_FIELDS, row[2:])}
+            records[row[0]] = record
+        return records
+
+    def get_accessions(self, doi):
+        """
+        :return: dictionary of the accessions of one publication ({field: [[accession, label], ...]}), or None
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT accessions FROM publications WHERE doi = ?', (doi,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def updated_at(self):
+        """
+        :return: dictionary of {DOI: unix time of the last upsert}
+        """
+        conn = self._connect()
+        try:
+            return dict(conn.execute('SELECT doi, updated_at FROM publications').fetchall())
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM publications').fetchone()[0]
+        finally:
+            conn.close()
+
+    def import_yaml(self, path):
+        """
+        One-time import of the legacy tmp.yaml cache. Does nothing if this cache already has records or there is no
+        file at path.
+        :return: int, the number of imported records
+        """
+        if not os.path.exists(path) or len(self):
+            return 0
+        try:
+            with open(path) as f:
+                records = yaml.load(f, Loader=yaml.FullLoader) or {}
+        except Exception as e:
+            logger.error(f"Could not import the publication cache {path}: {e}")
+            return 0
+        for doi, record in records.items():
+            self.upsert(doi, record)
+        logger.info(f"Imported {len(records)} publications from {path} into {self.path}")
+        return len(records)
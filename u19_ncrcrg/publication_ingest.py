@@ -0,0 +1,466 @@
+"""
+Ingest of the featured publications sheet into the records shown on the papers page.
+
+Each publication row can reference GEO, PRIDE and OMERO accessions, which are resolved into importable files
+(GEO series -> SRR runs via NCBI eutils, PRIDE projects -> FTP files). PublicationIngest resolves the accessions of
+all new rows concurrently with a bounded worker pool, keeps NCBI requests under its rate limit
+(3 requests/sec, or 10 with an NCBI_API_KEY) and checkpoints every record as soon as it is complete, so an
+interrupted run picks up where it stopped.
+
+All HTTP goes through an HttpClient, which can be replaced (e.g. by recorded fixtures in tests).
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.dom import minidom
+from xml.etree import ElementTree
+
+import requests
+import xmltodict
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EUTILS = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+PRIDE = 'https://www.ebi.ac.uk/pride/ws/archive/v2/projects/'
+
+
+def _publication_settings():
+    return getattr(settings, 'PUBLICATIONS', {})
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available.
+
+    :param rate: float, tokens added per second
+    :param capacity: int, maximum burst size, defaults to rate
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class HttpClient:
+    """
+    requests-based HTTP client used by the ingest. Requests to NCBI eutils are rate limited and carry the API key,
+    and failed requests (connection errors, 429 and 5xx) are retried with exponential backoff.
+
+    :param session: requests.Session, one is created if not given
+    :param timeout: float, seconds before a request is abandoned
+    :param api_key: string, NCBI API key
+    :param retries: int, attempts after the first one
+    """
+
+    def __init__(self, session=None, timeout=30, api_key=None, retries=2):
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.api_key = api_key
+        self.retries = retries
+        self.ncbi_bucket = TokenBucket(rate=10 if api_key else 3)
+
+    def _request(self, method, url, **kwargs):
+        if url.startswith(EUTILS):
+            if self.api_key:
+                key = 'data' if method == 'POST' else 'params'
+                kwargs[key] = dict(kwargs.get(key) or {}, api_key=self.api_key)
+        for attempt in range(self.retries + 1):
+            if url.startswith(EUTILS):
+                self.ncbi_bucket.acquire()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} for {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                logger.debug(f"Retrying {url} after {error}")
+                time.sleep(2 ** attempt)
+        raise error
+
+    def get(self, url, params=None, headers=None):
+        """
+        :return: bytes, the response body
+        """
+        return self._request('GET', url, params=params, headers=headers).content
+
+    def get_json(self, url, params=None):
+        return self._request('GET', url, params=params, headers={'Accept': 'application/json'}).json()
+
+    def post_stream(self, url, data=None):
+        """
+        :return: file-like object streaming the (decompressed) response body
+        """
+        response = self._request('POST', url, data=data, stream=True)
+        response.raw.decode_content = True
+        return response.raw
+
+
+_default_http = None
+_default_http_lock = threading.Lock()
+
+
+def default_http():
+    global _default_http
+    if _default_http is None:
+        with _default_http_lock:
+            if _default_http is None:
+                options = _publication_settings()
+                _default_http = HttpClient(timeout=options.get('http_timeout', 30),
+                                           api_key=options.get('ncbi_api_key'))
+    return _default_http
+
+
+def get_base_url_other_repositories(repo_name):
+    """
+    Returns the base URL for a given repository name (as labeled in the google spreadsheet)
+    """
+    repos = {
+        "SRA": "https://www.ncbi.nlm.nih.gov/sra/?term=",
+        "NDEX": "https://www.ndexbio.org/viewer/networks/",
+        "SYNAPSE": "https://www.synapse.org/#!Synapse:"
+    }
+    try:
+        return repos[repo_name.upper()]
+    except KeyError:
+        logger.error(f"{repo_name.upper()} does not exist in repo dictionary")
+        return ""
+
+
+def clean_doi(doi):
+    """
+    Turns DOI accession IDs into something parseable by django forms.
+    Forms do not work well with '.' or '/', so to be safe, we'll
+    transform non-alphanumeric characters into underscores.
+    (eg. 10.1038/s41593-019-0393-4 -> 10_1038_s41593_019_0393_4
+    """
+    return re.sub(r"[^a-zA-Z0-9]", '_', doi)
+
+
+def get_omero_images(omero_id, http=None):
+    """
+    Queries OMERO for images associated with a given ID.
+    :params omero_id: str used to query OMERO referred to accession.
+    :return omero_image: list of image tuples containing the image name and path to the image.
+    """
+    logger.info("Start get_omero_images")
+    omero_name, omero_id = str(omero_id).split('::')
+    # omero_image = get_omero_objects(omero_id)
+    # return omero_image
+    return [(omero_id, omero_name)]
+
+
+def esearch(term, db='gds', http=None):
+    """
+    Queries NCBI using the esearch utility. GEO ('gds') database is used as default for search term.
+    """
+    logger.debug(f"Start esearch GDS ({term})")
+    http = http or default_http()
+    return http.get(EUTILS + 'esearch.fcgi', params={'db': db, 'term': term, 'retmax': 5000, 'usehistory': 'y'})
+
+
+def get_esummary(esearch_string, db='gds', http=None):
+    """
+    Parses a http response in XML format to obtain the webenv and querykey tokens.
+    Uses NCBI eutils to transform these tokens into web summaries of GEO (db='gds') datasets.
+    """
+    logger.debug("Start esummary GDS")
+    http = http or default_http()
+    xmldoc = minidom.parseString(esearch_string)
+    try:
+        webenv = xmldoc.getElementsByTagName('WebEnv')[0].firstChild.data
+        querykey = xmldoc.getElementsByTagName('QueryKey')[0].firstChild.data
+        return http.get(EUTILS + 'esummary.fcgi',
+                        params={'db': db, 'version': '2.0', 'query_key': querykey, 'WebEnv': webenv})
+    except IndexError as e:
+        logger.debug(f"Unparsable publication string ({e}, search={esearch_string}")
+        return ""
+
+
+def parse_geo_esummary(input_string):
+    """
+    Parses an XML-formatted GEO metadata string and returns series, sample, and platform metadata.
+    Importantly, this function uses the GEO metadata to pull out the SRA accession ID.
+    """
+    logger.debug("Parsing esummary GDS")
+    try:
+        o = xmltodict.parse(input_string)
+    except Exception as e:
+        logger.debug(f"Could not parse xml to dict: {input_string}")
+        return [], [], []
+    series_metadata = defaultdict()  # should only be one series per xml string
+    sample_metadata = []  # one or more samples
+    platform_metadata = []  # one or more associated platforms
+    try:
+        for document_summary in o['eSummaryResult']['DocumentSummarySet']['DocumentSummary']:
+            acc = document_summary['Accession']
+            title = document_summary['title']
+            description = document_summary['summary']
+            if acc.startswith('GSE'):  # Series
+                series_metadata = {'accession': acc, 'title': title, 'description': description}
+            elif acc.startswith('GSM'):  # Sample
+                sra = ""
+                try:
+                    if document_summary['ExtRelations']['ExtRelation']['RelationType'] == 'SRA':
+                        sra = document_summary['ExtRelations']['ExtRelation']['TargetObject']
+                except KeyError:
+                    logger.error(f"Error parsing GEO Summary. No known SRA or malformed entry {acc}.")
+                    raise
+                except TypeError:
+                    logger.error(f"Error parsing GEO Summary {acc}. Make sure the GEO accession ID is not a superSeries.")
+                    raise
+                metadata = {'accession': acc, 'title': title, 'description': description, 'SRA': sra}
+                sample_metadata.append(metadata)
+            elif acc.startswith('GPL'):  # Platform
+                platform_metadata.append({'accession': acc, 'title': title, 'description': description})
+    except KeyError as e:
+        logger.error(e, input_string)
+    return series_metadata, sample_metadata, platform_metadata
+
+
+def efetch(srx, db='sra', http=None):
+    logger.debug(f"Starting efetch SRA {srx}")
+    http = http or default_http()
+    return http.get(EUTILS + 'efetch.fcgi', params={'db': db, 'id': srx})
+
+
+def parse_srx(input_string):
+    """
+    Takes an input string from an API call to eutils, returns a list of tuples [SRR accession, label]
+    """
+    logger.debug("Parsing SRA")
+    try:
+        o = xmltodict.parse(input_string)
+    except TypeError as e:
+        logger.error(f"Having trouble parsing SRX input string (starts with: {input_string[:200]}...).")
+        raise
+    accession_metadata = []
+    for _, experiment in o['EXPERIMENT_PACKAGE_SET'].items():
+        try:
+            label = experiment['EXPERIMENT']['TITLE']
+            for key, run in experiment['RUN_SET'].items():
+                if key == 'RUN':
+                    try:  # one RUN per RUN_SET
+                        srr = run['IDENTIFIERS']['PRIMARY_ID']
+                        label2 = label + f' (SRR: {srr})'
+                        accession_metadata.append((srr, label2))
+                    except TypeError:  # multiple RUNS per RUN_SET
+                        for r in run:
+                            srr = r['IDENTIFIERS']['PRIMARY_ID']
+                            label2 = label + f' (SRR: {srr})'
+                            accession_metadata.append((srr, label2))
+        except KeyError:
+            logger.error(f"Dictionary does not have the requisite keys {o}")
+
+    return sorted(accession_metadata)
+
+
+def parse_srx_stream(stream):
+    """
+    Incrementally parses an efetch (db=sra) response holding any number of experiments.
+    :return: dictionary of {SRX accession: sorted list of tuples [SRR accession, label]}
+    """
+    accessions = {}
+    for _, element in ElementTree.iterparse(stream, events=('end',)):
+        if element.tag != 'EXPERIMENT_PACKAGE':
+            continue
+        experiment = element.find('EXPERIMENT')
+        if experiment is None:
+            logger.error("efetch response has an EXPERIMENT_PACKAGE without an EXPERIMENT")
+            element.clear()
+            continue
+        srx = experiment.get('accession') or experiment.findtext('IDENTIFIERS/PRIMARY_ID')
+        label = experiment.findtext('TITLE', default='')
+        runs = [run.findtext('IDENTIFIERS/PRIMARY_ID') for run in element.iterfind('RUN_SET/RUN')]
+        accessions[srx] = sorted((srr, label + f' (SRR: {srr})') for srr in runs if srr)
+        element.clear()
+    return accessions
+
+
+def efetch_batch(srx_ids, db='sra', http=None, chunk_size=200):
+    """
+    Fetches many SRA experiments with one POSTed efetch per chunk_size ids.
+    :return: dictionary of {SRX accession: sorted list of tuples [SRR accession, label]}, @see parse_srx_stream
+    """
+    http = http or default_http()
+    srx_ids = list(dict.fromkeys(srx_ids))
+    accessions = {}
+    for start in range(0, len(srx_ids), chunk_size):
+        chunk = srx_ids[start:start + chunk_size]
+        logger.debug(f"Starting efetch SRA for {len(chunk)} experiments")
+        accessions.update(parse_srx_stream(http.post_stream(EUTILS + 'efetch.fcgi', data={'db': db, 'id': ','.join(chunk)})))
+    return accessions
+
+
+def get_srr_from_geo_accession(geo_term, http=None, chunk_size=200):
+    """
+    Converts GEO accession codes into a list of SRA accessions.
+    Returns a list of tuples [(SRR_accession1, label1), (SRR_accession2, label2), etc.], grouped by GSM sample in
+    series order.
+    """
+    logger.debug(f"parsing {geo_term}")
+    esummary = get_esummary(esearch(geo_term, db='gds', http=http), db='gds', http=http)
+    try:
+        series_metadata, sample_metadata, platform_metadata = parse_geo_esummary(esummary)
+    except TypeError as e:
+        logger.error(f"Problem parsing GEO term {geo_term}: {e}")
+        return []
+    srx_ids = [sample['SRA'] for sample in sample_metadata if sample['SRA']]  # one for each GSM id
+    by_srx = efetch_batch(srx_ids, http=http, chunk_size=chunk_size)
+    accessions = []
+    for srx in srx_ids:
+        if srx not in by_srx:
+            logger.error(f"Error in get_srr_from_geo_accession({geo_term}): no runs found for {srx}")
+        accessions += by_srx.get(srx, [])
+    return accessions
+
+
+def get_files_from_pride_accession(pride_accession, http=None):
+    http = http or default_http()
+    files = []
+    responsej = http.get_json(f'{PRIDE}{pride_accession}/files')
+    for file_object in responsej['_embedded']['files']:
+        for f in file_object['publicFileLocations']:
+            if f['name'] == 'FTP Protocol':
+                files.append((f['value'], os.path.basename(f['value'])))
+
+    return files
+
+
+# record field -> (sheet column, resolver)
+ACCESSION_FIELDS = {
+    'geo_accessions': ('GEO accession', get_srr_from_geo_accession),  # GEO -> SRR
+    'pride_accessions': ('PRIDE accession', get_files_from_pride_accession),
+    'omero_accessions': ('OMERO accession', get_omero_images),
+}
+
+
+def build_record(row):
+    """
+    Returns the publication record for a sheet row, without its GEO/PRIDE/OMERO accessions (@see accession_tasks)
+    """
+    authors = row['Authors'].split(';')
+    author_string = '; '.join(authors[:2]) + ' et. al.' if len(authors) > 2 else '; '.join(authors[:2])
+    record = {'other_accessions': {}}
+    other_accessions = row['Other accessions'].split(',') if row['Other accessions'] != "" else []
+    for other_accession in other_accessions:
+        try:
+            other_repo, accession = other_accession.split('::')
+            record['other_accessions'][f"{other_repo} ({accession})"] = \
+                get_base_url_other_repositories(other_repo) + accession
+        except ValueError as e:
+            logger.error(e, other_accession)
+    record['title'] = row['Title']
+    record['full_authors'] = row['Authors']
+    record['authors'] = author_string
+    record['abstract'] = row['Abstract']
+    record['total_citations'] = row['Total Citations']
+    record['pub_year'] = row['Pub Year']
+    record['mesh_keywords'] = row['MeSH Keywords'].split(';')
+    record['doi_link'] = f"https://doi.org/{row['DOI']}"
+    record['pmid_link'] = f"https://pubmed.ncbi.nlm.nih.gov/{row['PMID']}"
+    for field in ACCESSION_FIELDS:
+        record[field] = []
+    return record
+
+
+def accession_tasks(row):
+    """
+    :return: list of (record field, accession) to resolve for a sheet row, in sheet order
+    """
+    tasks = []
+    for field, (column, _) in ACCESSION_FIELDS.items():
+        if str(row[column]) != "":
+            tasks += [(field, accession) for accession in str(row[column]).split(',')]
+    return tasks
+
+
+class PublicationIngest:
+    """
+    Resolves the accessions of publication rows concurrently and assembles their records.
+
+    :param http: HttpClient (or compatible) used for every request
+    :param max_workers: int, accessions resolved at the same time
+    :param checkpoint: callable(doi, record) called as soon as a record is complete. Records with a failed
+        accession are not checkpointed, so they are retried on the next run.
+    """
+
+    def __init__(self, http=None, max_workers=4, checkpoint=None):
+        self.http = http
+        self.max_workers = max_workers
+        self.checkpoint = checkpoint
+
+    def _resolve(self, field, accession):
+        logger.info(f"parsing publication ({field}) {accession}")
+        return ACCESSION_FIELDS[field][1](accession, http=self.http)
+
+    def _complete(self, records, doi, record, failed):
+        records[doi] = record
+        if failed:
+            logger.error(f"Publication {doi} is incomplete and will be retried on the next ingest.")
+        elif self.checkpoint is not None:
+            self.checkpoint(doi, record)
+
+    def run(self, rows, records=None):
+        """
+        :param rows: iterable of sheet rows (dictionaries keyed by column name)
+        :param records: dictionary of already ingested records, keyed by cleaned DOI. These rows are skipped.
+        :return: dictionary of all records, keyed by cleaned DOI
+        """
+        records = dict(records or {})
+        pending = {}  # doi -> [record, {task index: result}, number of tasks, failed]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for row in rows:
+                doi = clean_doi(row['DOI'])  # forms do NOT like non-alphanumeric characters!
+                if doi in records or doi in pending:
+                    logger.debug(f"record {doi} exists, do not re-parse.")
+                    continue
+                logger.debug(f"record {doi} does not exist, parse.")
+                record = build_record(row)
+                tasks = accession_tasks(row)
+                if not tasks:
+                    self._complete(records, doi, record, failed=False)
+                    continue
+                pending[doi] = [record, {}, tasks, False]
+                for index, (field, accession) in enumerate(tasks):
+                    futures[executor.submit(self._resolve, field, accession)] = (doi, index)
+
+            for future in as_completed(futures):
+                doi, index = futures[future]
+                state = pending[doi]
+                try:
+                    state[1][index] = future.result()
+                except Exception as e:
+                    logger.error(f"Problem resolving {state[2][index]} for {doi}: {e}")
+                    state[1][index] = []
+                    state[3] = True
+                if len(state[1]) == len(state[2]):
+                    record, results, tasks, failed = pending.pop(doi)
+                    for i, (field, _) in enumerate(tasks):
+                        record[field] += results[i]
+                    self._complete(records, doi, record, failed)
+        return records
+
@@ -0,0 +1,86 @@
+"""
+In-memory search over the featured publications, used by the papers page filters.
+
+Title and author filters are case-insensitive substring matches, as before, but answered from an inverted index
+of character n-grams: the candidates are the records holding every trigram of the term, and only those are checked
+with a substring test. MeSH keyword filters are exact (case-insensitive) keyword lookups. A search costs in
+proportion to the number of candidates, not the size of the catalog.
+"""
+from collections import defaultdict
+
+NGRAM = 3
+
+
+def ngrams(text, n=NGRAM):
+    """
+    :return: set of the substrings of text with length n. Text shorter than n is its own only n-gram.
+    """
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class SubstringIndex:
+    """
+    Inverted index from n-grams (of length 1 to NGRAM) to keys, for case-insensitive substring search.
+    """
+
+    def __init__(self):
+        self.texts = {}
+        self.postings = defaultdict(set)
+
+    def add(self, key, text):
+        text = (text or '').upper()
+        self.texts[key] = text
+        for n in range(1, NGRAM + 1):
+            for gram in ngrams(text, n):
+                self.postings[gram].add(key)
+
+    def search(self, term):
+        """
+        :return: set of keys whose text contains term
+        """
+        term = term.upper()
+        grams = sorted(ngrams(term), key=lambda g: len(self.postings.get(g, ())))
+        candidates = set(self.postings.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self.postings.get(gram, set())
+        if len(term) <= NGRAM:
+            return candidates
+        return {key for key in candidates if term in self.texts[key]}
+
+
+class PublicationIndex:
+    """
+    :param records: ordered dictionary of publication records keyed by DOI, @see publication_ingest.build_record
+    """
+
+    def __init__(self, records):
+        self.order = {}
+        self.titles = SubstringIndex()
+        self.authors = SubstringIndex()
+        self.mesh_keywords = defaultdict(set)
+        for position, (doi, record) in enumerate(records.items()):
+            self.order[doi] = position
+            self.titles.add(doi, record.get('title'))
+            self.authors.add(doi, record.get('authors'))
+            for keyword in record.get('mesh_keywords') or []:
+                self.mesh_keywords[keyword.upper()].add(doi)
+
+    def search(self, title_term='', author_term='', mesh_keywords=''):
+        """
+        A record matches if it matches any of the non-empty filters. Without filters every record matches.
+        :return: list of matching DOIs, in catalog order
+        """
+        if not (title_term or author_term or mesh_keywords):
+            return list(self.order)
+        hits = set()
+        if title_term:
+            hits |= self.titles.search(title_term)
+        if author_term:
+            hits |= self.authors.search(author_term)
+        if mesh_keywords:
+            hits |= self.mesh_keywords.get(mesh_keywords.upper(), set())
+        return sorted(hits, key=self.order.__getitem__)
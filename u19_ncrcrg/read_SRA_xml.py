@@ -3,8 +3,7 @@
 import argparse
 import xml.etree.ElementTree as et 
 import os
-import glob
-from xml.dom import minidom
+import io
 from collections import defaultdict
 import yaml
 
@@ -17,186 +16,257 @@ def get_metadata_from_xml_file(input_file, transcriptome, chemistry, cr11, read1
     return 0  # TODO: process from file instead of string
 
 
-def get_10x_metadata_from_xml(input_string, transcriptome, chemistry, cr11, read1_length, read2_length, expect_cells):
+# The parsers below stream the efetch XML with et.iterparse and handle one EXPERIMENT_PACKAGE at a time.
+# Package-level fields (platform, organism, sample characteristics) are read once per package instead of once per
+# run. The helpers reproduce the minidom accessors the parsers used before, so the output is unchanged.
+
+def _elements(element, tag):
     """
-    Transforms the metadata XML file into a dictionary that can be dumped into 1 or more properly 
-    formatted JSON files.
-    
-    input_file: string
-    transcriptome: string
-    chemistry: string
-    cr11: string
-    module: string
-    module_version: string
-    module_script: string
+    Descendants of element named tag, in document order (minidom's getElementsByTagName).
+    """
+    return [e for e in element.iter(tag) if e is not element]
+
+
+def _data(element):
+    """
+    minidom's element.firstChild.data: the text before the element's first child.
+    """
+    if element.text is None:
+        raise AttributeError("{} has no text".format(element.tag))
+    return element.text
+
+
+def _node_value(element):
+    """
+    minidom's element.firstChild.nodeValue: like _data, but None if the first child is an element.
+    """
+    if element.text is None and len(element) == 0:
+        raise AttributeError("{} has no children".format(element.tag))
+    return element.text
+
+
+def _first_child_tag(element):
+    """
+    minidom's element.firstChild.tagName
+    """
+    if element.text is not None or len(element) == 0:
+        raise AttributeError("{} does not start with an element".format(element.tag))
+    return element[0].tag
+
+
+def _child_data(element, index):
+    """
+    minidom's element.childNodes[index].firstChild.data, where text between children counts as a node.
+    """
+    nodes = [None] if element.text is not None else []  # None stands for a text node
+    for child in element:
+        nodes.append(child)
+        if child.tail is not None:
+            nodes.append(None)
+    node = nodes[index]
+    if node is None:
+        raise AttributeError("text nodes have no children")
+    return _data(node)
+
+
+def iter_experiment_packages(source):
+    """
+    Streams the EXPERIMENT_PACKAGE elements of an efetch (db=sra) response, releasing each one once the caller is
+    done with it.
+
+    source: bytes, string or binary file-like object (e.g. an HTTP response)
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    elif isinstance(source, str):
+        source = io.StringIO(source)
+    root = None
+    for event, element in et.iterparse(source, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'end' and element.tag == 'EXPERIMENT_PACKAGE':
+            yield element
+            element.clear()
+            if element is not root:
+                root.clear()
+
+
+def _experiment_metadata(expt_package, my_expt_metadata):
+    """
+    Adds the experiment and study level fields (experiment nickname, summary, study title/abstract, external
+    databases and references) shared by the 10x and RNA-seq parsers.
     """
-    my_expt_set_metadata = []
+    expt_metadata = _elements(expt_package, 'EXPERIMENT')
+    for metadata in expt_metadata:
+        title = _data(_elements(metadata, 'TITLE')[0])
+        my_expt_metadata['experiment_nickname'].append(metadata.attrib['accession'])
+        my_expt_metadata['experiment_summary'].append(title)
+    my_expt_metadata['experiment_nickname'] = ','.join(my_expt_metadata['experiment_nickname'])
+    my_expt_metadata['experiment_summary'] = ','.join(my_expt_metadata['experiment_summary'])
+
+
+def _study_metadata(expt_package, my_expt_metadata):
+    study_metadata = _elements(expt_package, 'STUDY')[0]
+    my_expt_metadata['study_title'] = _node_value(_elements(study_metadata, 'STUDY_TITLE')[0])
+    my_expt_metadata['study_abstract'] = _node_value(_elements(study_metadata, 'STUDY_ABSTRACT')[0])
+    my_expt_metadata['experiment_summary'] = my_expt_metadata['experiment_summary'] + "\n[ABSTRACT]: " + \
+                                             my_expt_metadata['study_abstract']
+    external_ids = _elements(study_metadata, 'EXTERNAL_ID')
+    for external_id in external_ids:
+        for attr in external_id.attrib:
+            ddb = external_id.attrib[attr]
+            did = _data(external_id)
+            my_expt_metadata['database'].append({ddb: did})
+    study_links = _elements(study_metadata, 'STUDY_LINKS')
+
+    for link in study_links:
+        xref_link = _elements(link, 'XREF_LINK')[0]
+        sdb = _child_data(xref_link, 0)
+        sid = _child_data(xref_link, 1)
+        my_expt_metadata['reference'].append({sdb: sid})
+
+
+def _organism(expt_package):
+    """
+    :return: the scientific name of the last SAMPLE_NAME, or None if there is none
+    """
+    organism = None
+    for metadata in _elements(expt_package, 'SAMPLE_NAME'):
+        organism = _data(_elements(metadata, 'SCIENTIFIC_NAME')[0])
+    return organism
+
+
+def _characteristics(expt_package):
+    """
+    :return: list of {'name': tag, 'value': value} attributes of the last SAMPLE, or None if there is none
+    """
+    characteristics_list = None
+    for sample in _elements(expt_package, 'SAMPLE'):
+        characteristics_list = []
+        for metadata in _elements(sample, 'SAMPLE_ATTRIBUTES'):
+            for attribute in _elements(metadata, 'SAMPLE_ATTRIBUTE'):
+                characteristics_list.append({
+                    'name': _data(_elements(attribute, 'TAG')[0]),
+                    'value': _data(_elements(attribute, 'VALUE')[0])
+                })
+    return characteristics_list
+
+
+def iter_10x_metadata_from_xml(input_string, transcriptome, chemistry, cr11, read1_length, read2_length,
+                               expect_cells):
+    """
+    Generator version of get_10x_metadata_from_xml, yielding one experiment dictionary per EXPERIMENT_PACKAGE.
 
-    xmldoc = minidom.parseString(input_string)
-    expt_packages = xmldoc.getElementsByTagName('EXPERIMENT_PACKAGE')
-    for expt_package in expt_packages:
+    input_string: bytes, string or binary file-like object
+    """
+    for expt_package in iter_experiment_packages(input_string):
         my_expt_metadata = defaultdict(list)
-        
-        organization_metadata = expt_package.getElementsByTagName('Organization')
+
+        organization_metadata = _elements(expt_package, 'Organization')
         for metadata in organization_metadata:
             try:
-                my_expt_metadata['organization'].append(metadata.getElementsByTagName('Name')[0].firstChild.data)
+                my_expt_metadata['organization'].append(_data(_elements(metadata, 'Name')[0]))
             except KeyError:
                 pass
             try:
-                my_expt_metadata['email'].append(metadata.getElementsByTagName('Contact')[0].attributes['email'].value)
+                my_expt_metadata['email'].append(_elements(metadata, 'Contact')[0].attrib['email'])
             except KeyError:
                 pass
         my_expt_metadata['organization'] = ','.join(my_expt_metadata['organization'])
         my_expt_metadata['email'] = ','.join(my_expt_metadata['email'])
 
-        expt_metadata = expt_package.getElementsByTagName('EXPERIMENT')
-        for metadata in expt_metadata:
-            title = metadata.getElementsByTagName('TITLE')[0].firstChild.data
-            my_expt_metadata['experiment_nickname'].append(metadata.attributes['accession'].value)
-            my_expt_metadata['experiment_summary'].append(title)
-        my_expt_metadata['experiment_nickname'] = ','.join(my_expt_metadata['experiment_nickname'])
-        my_expt_metadata['experiment_summary'] = ','.join(my_expt_metadata['experiment_summary'])
+        _experiment_metadata(expt_package, my_expt_metadata)
 
-        design_metadata = expt_package.getElementsByTagName('DESIGN')
+        design_metadata = _elements(expt_package, 'DESIGN')
         for metadata in design_metadata:
             try:
-                design = metadata.getElementsByTagName('DESIGN_DESCRIPTION')[0].firstChild.data
+                design = _data(_elements(metadata, 'DESIGN_DESCRIPTION')[0])
             except AttributeError:
                 design = ''
             my_expt_metadata['experiment_design'].append(design)
         my_expt_metadata['experiment_design'] = ','.join(my_expt_metadata['experiment_design'])
-        
-        study_metadata = expt_package.getElementsByTagName('STUDY')[0]
-        my_expt_metadata['study_title'] = study_metadata.getElementsByTagName('STUDY_TITLE')[0].firstChild.nodeValue
-        my_expt_metadata['study_abstract'] = study_metadata.getElementsByTagName('STUDY_ABSTRACT')[0].firstChild.nodeValue
-        my_expt_metadata['experiment_summary'] = my_expt_metadata['experiment_summary'] + "\n[ABSTRACT]: " + my_expt_metadata['study_abstract']
-        external_ids = study_metadata.getElementsByTagName('EXTERNAL_ID')
-        for external_id in external_ids:
-            for attr in external_id.attributes.keys():
-                ddb = external_id.attributes[attr].value
-                did = external_id.firstChild.data
-                my_expt_metadata['database'].append({ddb:did})
-        study_links = study_metadata.getElementsByTagName('STUDY_LINKS')
-        
-        for link in study_links:
-            sdb = link.getElementsByTagName('XREF_LINK')[0].childNodes[0].firstChild.data
-            sid = link.getElementsByTagName('XREF_LINK')[0].childNodes[1].firstChild.data
-            my_expt_metadata['reference'].append({sdb:sid})
-            
-        run_set = expt_package.getElementsByTagName('RUN_SET')
 
-        run_accession_list = []
-        for run in run_set:
+        _study_metadata(expt_package, my_expt_metadata)
 
-            run_metadata = run.getElementsByTagName('RUN')
-            for metadata in run_metadata:
-                my_run_metadata = defaultdict(dict)
-                accession = metadata.attributes['accession'].value
-                run_accession_list.append(accession)
-                try:
-                    print('processing run {}'.format(accession))
-                    my_run_metadata['library_nickname'] = metadata.attributes['accession'].value
-                except KeyError:
-                    my_run_metadata['library_nickname'] = ''
-                try:
-                    my_run_metadata['library_prep'] = ""
-                except KeyError:
-                    my_run_metadata['library_prep'] = ""
+        runs = [run for run_set in _elements(expt_package, 'RUN_SET') for run in _elements(run_set, 'RUN')]
+        if runs:
+            platforms = _elements(expt_package, 'PLATFORM')
+            for imetadata in platforms:
                 try:
-                    my_run_metadata['sample_id'] = metadata.attributes['accession'].value
-                except KeyError:
-                    my_run_metadata['sample_id'] = ""
+                    instrument = _data(_elements(imetadata, 'INSTRUMENT_MODEL')[0])
+                except AttributeError:
+                    instrument = ''
+            # This actually belong on the top level per-expt, but we apply characteristics to each file.
+            organism = _organism(expt_package)
+            characteristics_list = _characteristics(expt_package)
+
+        for metadata in runs:
+            my_run_metadata = defaultdict(dict)
+            accession = metadata.attrib['accession']
+            print('processing run {}'.format(accession))
+            my_run_metadata['library_nickname'] = accession
+            my_run_metadata['library_prep'] = ""
+            my_run_metadata['sample_id'] = accession
+            my_run_metadata['original_assembly'] = metadata.attrib.get('assembly', "")
+
+            file_metadata = _elements(metadata, 'SRAFile')
+            for fmetadata in file_metadata:
                 try:
-                    my_run_metadata['original_assembly'] = metadata.attributes['assembly'].value
+                    filename = fmetadata.attrib['filename']
+                    url = fmetadata.attrib['url']
+                    if filename.endswith('.bam') or filename.endswith('.bam.1'):
+                        my_run_metadata['bam_file_url'] = url
+                        print(my_run_metadata['library_nickname'], my_run_metadata['bam_file_url'])
                 except KeyError:
-                    my_run_metadata['original_assembly'] = ""
-
-                file_metadata = metadata.getElementsByTagName('SRAFile')
-                for fmetadata in file_metadata:
-                    # print("FILE METADATA: {}".format(metadata))
-                    try:
-                        filename = fmetadata.attributes['filename'].value
-                        url = fmetadata.attributes['url'].value
-                        if filename.endswith('.bam') or filename.endswith('.bam.1'):
-                            my_run_metadata['bam_file_url'] = fmetadata.attributes['url'].value
-                            print(my_run_metadata['library_nickname'], my_run_metadata['bam_file_url'])
-                    except KeyError:
-                        print("{} does not have a file associated with it.".format(fmetadata))
-                instrument_metadata = expt_package.getElementsByTagName('PLATFORM')
-                for imetadata in instrument_metadata:
-                    try:
-                        instrument = imetadata.getElementsByTagName('INSTRUMENT_MODEL')[0].firstChild.data
-                    except AttributeError:
-                        instrument = ''
-                    my_run_metadata['instrument_model'] = instrument
-                    my_run_metadata['read1_length'] = int(read1_length)
-                    my_run_metadata['read2_length'] = int(read2_length)
-                    my_run_metadata['expect_cells'] = int(expect_cells)
-                    my_run_metadata['chemistry'] = chemistry
-                    my_run_metadata['transcriptome'] = {
-                        'class': 'Directory',
-                        'path': transcriptome
-                    }
-
-                    # cr11_as_yaml_bool = 'false' if cr11 is False else 'true'
-
-                    my_run_metadata['cr11'] = cr11
-
-                # This actually belong on the top level per-expt, but we apply characteristics to each file.
-                taxonomy_metadata = expt_package.getElementsByTagName('SAMPLE_NAME')
-                for tmetadata in taxonomy_metadata:
-                    scientific_name = tmetadata.getElementsByTagName('SCIENTIFIC_NAME')[0].firstChild.data
-                    my_expt_metadata['organism'] = scientific_name
-
-                sample_set = expt_package.getElementsByTagName('SAMPLE')
-                for sample in sample_set:
-                    sample_metadata = sample.getElementsByTagName('SAMPLE_ATTRIBUTES')
-                    characteristics_list = []
-                    for smetadata in sample_metadata:
-                        attributes = smetadata.getElementsByTagName('SAMPLE_ATTRIBUTE')
-                        my_sample_metadata = defaultdict()
-                        for attribute in attributes:
-                            characteristics_tag = {
-                                'name': attribute.getElementsByTagName('TAG')[0].firstChild.data,
-                                'value': attribute.getElementsByTagName('VALUE')[0].firstChild.data
-                            }
-                            characteristics_list.append(characteristics_tag)
-                    my_run_metadata['characteristics'] = characteristics_list
-                if 'bam_file_url' not in my_run_metadata.keys():
-                    print('missing key', my_run_metadata.keys())
-                    # WE NEED THIS URL TO DOWNLOAD AND PROCESS
-                    print("{} is missing 10X bam file url.".format(my_expt_metadata['experiment_nickname']))
-                else:
-                    my_expt_metadata['samples'].append(my_run_metadata)
-
-        my_expt_set_metadata.append(my_expt_metadata)
-    return my_expt_set_metadata
+                    print("{} does not have a file associated with it.".format(fmetadata))
+            if platforms:
+                my_run_metadata['instrument_model'] = instrument
+                my_run_metadata['read1_length'] = int(read1_length)
+                my_run_metadata['read2_length'] = int(read2_length)
+                my_run_metadata['expect_cells'] = int(expect_cells)
+                my_run_metadata['chemistry'] = chemistry
+                my_run_metadata['transcriptome'] = {
+                    'class': 'Directory',
+                    'path': transcriptome
+                }
+                my_run_metadata['cr11'] = cr11
+            if organism is not None:
+                my_expt_metadata['organism'] = organism
+            if characteristics_list is not None:
+                my_run_metadata['characteristics'] = [dict(c) for c in characteristics_list]
+
+            if 'bam_file_url' not in my_run_metadata.keys():
+                print('missing key', my_run_metadata.keys())
+                # WE NEED THIS URL TO DOWNLOAD AND PROCESS
+                print("{} is missing 10X bam file url.".format(my_expt_metadata['experiment_nickname']))
+            else:
+                my_expt_metadata['samples'].append(my_run_metadata)
+
+        yield my_expt_metadata
 
 
-def get_rnaseq_metadata_from_xml(input_string, genome_index, start0base, end, b_adapters, chrom_sizes):
+def get_10x_metadata_from_xml(input_string, transcriptome, chemistry, cr11, read1_length, read2_length, expect_cells):
     """
-    Transforms the metadata XML file into a dictionary that can be dumped into 1 or more properly
+    Transforms the metadata XML file into a dictionary that can be dumped into 1 or more properly 
     formatted JSON files.
-
-    input_string: string
-        XML of metadata in string format
-    genome_index: string
-        relative path to genome index
-    start0base: string
-        Assuming the UMIs are embedded in the read header, where does the UMI start (0-based half-open)?
-    end: string
-        Assuming the UMIs are embedded in the read header, where does the UMI end (0-based half-open)?
-    b_adapters: string
-        relative path to the adapter fasta file.
-    chrom_sizes: string
-        relative path to the chrom_sizes file (tabbed file containing chrom\tlength)
+    
+    input_string: bytes, string or binary file-like object
+    transcriptome: string
+    chemistry: string
+    cr11: string
+    read1_length: string
+    read2_length: string
+    expect_cells: string
     """
-    my_expt_set_metadata = []
+    return list(iter_10x_metadata_from_xml(input_string, transcriptome, chemistry, cr11, read1_length,
+                                           read2_length, expect_cells))
 
-    xmldoc = minidom.parseString(input_string)
-    expt_packages = xmldoc.getElementsByTagName('EXPERIMENT_PACKAGE')
-    for expt_package in expt_packages:
+
+def iter_rnaseq_metadata_from_xml(input_string, genome_index, start0base, end, b_adapters, chrom_sizes):
+    """
+    Generator version of get_rnaseq_metadata_from_xml, yielding one experiment dictionary per EXPERIMENT_PACKAGE.
+    """
+    for expt_package in iter_experiment_packages(input_string):
         my_expt_metadata = defaultdict(list)
 
         ### USER INPUT ###
@@ -218,128 +288,87 @@ def get_rnaseq_metadata_from_xml(input_string, genome_index, start0base, end, b_
         }
 
         ### EXPERIMENTAL METADATA. Describe experiment-level details. Broken up into 1) organization, 2) experiment 3) design 4) study ###
-        organization_metadata = expt_package.getElementsByTagName('Organization')
+        organization_metadata = _elements(expt_package, 'Organization')
         for metadata in organization_metadata:
             try:
-                my_expt_metadata['organization'].append(metadata.getElementsByTagName('Name')[0].firstChild.data)
+                my_expt_metadata['organization'].append(_data(_elements(metadata, 'Name')[0]))
             except IndexError:
                 pass
             try:
-                print(metadata.getElementsByTagName('Contact'))
-                my_expt_metadata['email'].append(metadata.getElementsByTagName('Contact')[0].attributes['email'].value)
+                my_expt_metadata['email'].append(_elements(metadata, 'Contact')[0].attrib['email'])
             except IndexError:
                 pass
-        try:
-            my_expt_metadata['organization'] = ','.join(my_expt_metadata['organization'])
-        except KeyError:
-            pass
-        try:
-            my_expt_metadata['email'] = ','.join(my_expt_metadata['email'])
-        except KeyError:
-            pass
-        expt_metadata = expt_package.getElementsByTagName('EXPERIMENT')
-        for metadata in expt_metadata:
-            title = metadata.getElementsByTagName('TITLE')[0].firstChild.data
-            my_expt_metadata['experiment_nickname'].append(metadata.attributes['accession'].value)
-            my_expt_metadata['experiment_summary'].append(title)
-        my_expt_metadata['experiment_nickname'] = ','.join(my_expt_metadata['experiment_nickname'])
-        my_expt_metadata['experiment_summary'] = ','.join(my_expt_metadata['experiment_summary'])
-
-        design_metadata = expt_package.getElementsByTagName('DESIGN')[0]
-        my_expt_metadata['library_layout'] = \
-        design_metadata.getElementsByTagName('LIBRARY_DESCRIPTOR')[0].getElementsByTagName('LIBRARY_LAYOUT')[
-            0].firstChild.tagName
-        my_expt_metadata['library_source'] = \
-        design_metadata.getElementsByTagName('LIBRARY_DESCRIPTOR')[0].getElementsByTagName('LIBRARY_SOURCE')[
-            0].firstChild.nodeValue
-        my_expt_metadata['library_description'] = \
-        design_metadata.getElementsByTagName('LIBRARY_DESCRIPTOR')[0].getElementsByTagName('LIBRARY_SELECTION')[
-            0].firstChild.nodeValue
-
-        study_metadata = expt_package.getElementsByTagName('STUDY')[0]
-        my_expt_metadata['study_title'] = study_metadata.getElementsByTagName('STUDY_TITLE')[0].firstChild.nodeValue
-        my_expt_metadata['study_abstract'] = study_metadata.getElementsByTagName('STUDY_ABSTRACT')[
-            0].firstChild.nodeValue
-        my_expt_metadata['experiment_summary'] = my_expt_metadata['experiment_summary'] + "\n[ABSTRACT]: " + \
-                                                 my_expt_metadata['study_abstract']
-        external_ids = study_metadata.getElementsByTagName('EXTERNAL_ID')
-        for external_id in external_ids:
-            for attr in external_id.attributes.keys():
-                ddb = external_id.attributes[attr].value
-                did = external_id.firstChild.data
-                my_expt_metadata['database'].append({ddb: did})
-        study_links = study_metadata.getElementsByTagName('STUDY_LINKS')
-
-        for link in study_links:
-            sdb = link.getElementsByTagName('XREF_LINK')[0].childNodes[0].firstChild.data
-            sid = link.getElementsByTagName('XREF_LINK')[0].childNodes[1].firstChild.data
-            my_expt_metadata['reference'].append({sdb: sid})
+        my_expt_metadata['organization'] = ','.join(my_expt_metadata['organization'])
+        my_expt_metadata['email'] = ','.join(my_expt_metadata['email'])
+
+        _experiment_metadata(expt_package, my_expt_metadata)
+
+        library_descriptor = _elements(_elements(expt_package, 'DESIGN')[0], 'LIBRARY_DESCRIPTOR')[0]
+        my_expt_metadata['library_layout'] = _first_child_tag(_elements(library_descriptor, 'LIBRARY_LAYOUT')[0])
+        my_expt_metadata['library_source'] = _node_value(_elements(library_descriptor, 'LIBRARY_SOURCE')[0])
+        my_expt_metadata['library_description'] = _node_value(
+            _elements(library_descriptor, 'LIBRARY_SELECTION')[0])
+
+        _study_metadata(expt_package, my_expt_metadata)
 
         ### RUN METADATA. Describe each individual sequencing run. ###
-        run_set = expt_package.getElementsByTagName('RUN_SET')
+        run_set = _elements(expt_package, 'RUN_SET')
+        if run_set:
+            platforms = _elements(expt_package, 'PLATFORM')
+            for metadata in platforms:
+                try:
+                    instrument = _node_value(_elements(metadata, 'INSTRUMENT_MODEL')[0])
+                except AttributeError:
+                    instrument = ''
+            # This actually belong on the top level per-expt, but we apply characteristics to each file.
+            organism = _organism(expt_package)
+            sample_characteristics = _characteristics(expt_package)
+
         for run in run_set:
             my_run_metadata = defaultdict(dict)
 
-            run_metadata = run.getElementsByTagName('RUN')
-            for metadata in run_metadata:
-                try:
-                    my_run_metadata['library_nickname'] = metadata.attributes['accession'].value
-                except KeyError:
-                    my_run_metadata['library_nickname'] = ''
-                try:
-                    my_run_metadata['library_prep'] = ""
-                except KeyError:
-                    my_run_metadata['library_prep'] = ""
-                try:
-                    my_run_metadata['sample_id'] = metadata.attributes['accession'].value
-                except KeyError:
-                    my_run_metadata['sample_id'] = ""
-                try:
-                    my_run_metadata['original_assembly'] = metadata.attributes['assembly'].value
-                except KeyError:
-                    my_run_metadata['original_assembly'] = ""
+            for metadata in _elements(run, 'RUN'):
+                my_run_metadata['library_nickname'] = metadata.attrib.get('accession', '')
+                my_run_metadata['library_prep'] = ""
+                my_run_metadata['sample_id'] = metadata.attrib.get('accession', "")
+                my_run_metadata['original_assembly'] = metadata.attrib.get('assembly', "")
 
             ### Comment out for now. Supposedly NCBI will move to AWS and will eventually have s3 links available. ###
-            # file_metadata = run.getElementsByTagName('SRAFile')
-            # for metadata in file_metadata:
-            #     if 'url' in metadata.attributes:
-            #         print(metadata.attributes['url'].value)
-            # filename = metadata.attributes['filename'].value
-            # url = metadata.attributes['url'].value
-            # print(url)
-
-            instrument_metadata = expt_package.getElementsByTagName('PLATFORM')
-            for metadata in instrument_metadata:
-                try:
-                    instrument = metadata.getElementsByTagName('INSTRUMENT_MODEL')[0].firstChild.nodeValue
-                except AttributeError:
-                    instrument = ''
-                my_run_metadata['instrument_model'] = instrument
+            # file_metadata = _elements(run, 'SRAFile')
 
-            # This actually belong on the top level per-expt, but we apply characteristics to each file.
-            taxonomy_metadata = expt_package.getElementsByTagName('SAMPLE_NAME')
-            for metadata in taxonomy_metadata:
-                scientific_name = metadata.getElementsByTagName('SCIENTIFIC_NAME')[0].firstChild.data
-                my_expt_metadata['organism'] = scientific_name
-
-            sample_set = expt_package.getElementsByTagName('SAMPLE')
-            for sample in sample_set:
-                sample_metadata = sample.getElementsByTagName('SAMPLE_ATTRIBUTES')
-                characteristics_list = []
-                for metadata in sample_metadata:
-                    attributes = metadata.getElementsByTagName('SAMPLE_ATTRIBUTE')
-                    my_sample_metadata = defaultdict()
-                    for attribute in attributes:
-                        characteristics_tag = {
-                            'name': attribute.getElementsByTagName('TAG')[0].firstChild.data,
-                            'value': attribute.getElementsByTagName('VALUE')[0].firstChild.data
-                        }
-                        characteristics_list.append(characteristics_tag)
+            if platforms:
+                my_run_metadata['instrument_model'] = instrument
+            if organism is not None:
+                my_expt_metadata['organism'] = organism
+            if sample_characteristics is not None:
+                characteristics_list = [dict(c) for c in sample_characteristics]
+            # without a SAMPLE, the characteristics of the previous package are reused
             my_run_metadata['characteristics'] = characteristics_list
             my_expt_metadata['samples'].append(my_run_metadata)
 
-        my_expt_set_metadata.append(my_expt_metadata)
-    return my_expt_set_metadata
+        yield my_expt_metadata
+
+
+def get_rnaseq_metadata_from_xml(input_string, genome_index, start0base, end, b_adapters, chrom_sizes):
+    """
+    Transforms the metadata XML file into a dictionary that can be dumped into 1 or more properly
+    formatted JSON files.
+
+    input_string: bytes, string or binary file-like object
+        XML of metadata
+    genome_index: string
+        relative path to genome index
+    start0base: string
+        Assuming the UMIs are embedded in the read header, where does the UMI start (0-based half-open)?
+    end: string
+        Assuming the UMIs are embedded in the read header, where does the UMI end (0-based half-open)?
+    b_adapters: string
+        relative path to the adapter fasta file.
+    chrom_sizes: string
+        relative path to the chrom_sizes file (tabbed file containing chrom\tlength)
+    """
+    return list(iter_rnaseq_metadata_from_xml(input_string, genome_index, start0base, end, b_adapters,
+                                              chrom_sizes))
 
 
 def main():
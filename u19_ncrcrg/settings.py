@@ -114,7 +114,8 @@ PLOTLY_DASH = {
 
     "http_poke_enabled": True,  # Flag controlling availability of direct-to-messaging http endpoint
 
-    "view_decorator": None,  # Specify a function to be used to wrap each of the dpd view functions
+    # Specify a function to be used to wrap each of the dpd view functions
+    "view_decorator": "u19_ncrcrg.caching.conditional_dash_layout",
 
     "cache_arguments": False,  # True for cache, False for session-based argument propagation
 }
@@ -141,6 +142,13 @@ EMAIL_HOST_PASSWORD = os.environ['EMAIL_HOST_PASSWORD']
 EMAIL_PORT = os.environ['EMAIL_PORT']
 EMAIL_USE_TLS = str2bool(os.environ['EMAIL_USE_TLS'])
 EMAIL_USE_SSL = str2bool(os.environ['EMAIL_USE_SSL'])
+# job completion emails, @see u19_ncrcrg/notifier.py
+NOTIFIER = {
+    'interval': int(os.environ.get('NOTIFIER_INTERVAL', 60)),
+    'concurrency': int(os.environ.get('NOTIFIER_CONCURRENCY', 8)),
+    'days': int(os.environ.get('NOTIFIER_DAYS', 30)),
+    'from_email': os.environ.get('NOTIFIER_FROM_EMAIL', 'ncrcrg.u19@gmail.com'),
+}
 
 # Globus settings
 CRED_BASE_URL = os.environ['CRED_BASE_URL']
@@ -157,10 +165,53 @@ GLOBUS_USS_EP_ID = os.environ['GLOBUS_USS_EP_ID']
 GLOBUS_LOGOUT_URI = os.environ['GLOBUS_LOGOUT_URI']
 GLOBUS_HTTPS_SERVER_BASE_URL = os.environ['GLOBUS_HTTPS_SERVER_BASE_URL']
 GLOBUS_JUPYTER_EP_ID = os.environ['GLOBUS_JUPYTER_EP_ID']
+GLOBUS_CACHE = {
+    # client-credential tokens are refreshed this many seconds before they expire
+    'token_leeway': int(os.environ.get('GLOBUS_TOKEN_LEEWAY', 300)),
+    # share client-credential tokens between workers through CACHES['default']
+    'share_tokens': str2bool(os.environ.get('GLOBUS_SHARE_TOKENS', 'false')),
+    # collection https_server urls are revalidated in the background after this many seconds
+    'https_server_ttl': int(os.environ.get('GLOBUS_HTTPS_SERVER_TTL', 6 * 60 * 60)),
+    # how long a request waits on an invalidated https_server lookup before using the last known url
+    'https_server_timeout': float(os.environ.get('GLOBUS_HTTPS_SERVER_TIMEOUT', 3)),
+    # per-user auth/transfer/groups client bundles kept in each worker
+    'user_clients_max_size': int(os.environ.get('GLOBUS_USER_CLIENTS_MAX_SIZE', 256)),
+    'user_clients_max_age': int(os.environ.get('GLOBUS_USER_CLIENTS_MAX_AGE', 60 * 60)),
+}
 
 # MongoDB settings
 MONGODB_USER = os.environ['MONGODB_USER']
 MONGODB_PASSWORD = os.environ['MONGODB_PASSWORD']
+# options for the process-wide client in u19_ncrcrg/mongo.py
+MONGODB_CLIENT = {
+    'max_pool_size': int(os.environ.get('MONGODB_MAX_POOL_SIZE', 20)),
+    'min_pool_size': int(os.environ.get('MONGODB_MIN_POOL_SIZE', 0)),
+    'connect_timeout_ms': int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', 10000)),
+    'server_selection_timeout_ms': int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 10000)),
+    'socket_timeout_ms': int(os.environ['MONGODB_SOCKET_TIMEOUT_MS']) if 'MONGODB_SOCKET_TIMEOUT_MS' in os.environ else None,
+    'read_preference': os.environ.get('MONGODB_READ_PREFERENCE', 'primary'),
+}
+
+# home page statistics and figures are recomputed in the background after this many seconds
+HOME_STATS = {
+    'ttl': int(os.environ.get('HOME_STATS_TTL', 10 * 60)),
+    'figure_ttl': int(os.environ.get('HOME_FIGURE_TTL', 10 * 60)),
+}
+
+# featured publications ingest, @see u19_ncrcrg/publication_ingest.py
+PUBLICATIONS = {
+    # with an API key NCBI allows 10 requests/second instead of 3
+    'ncbi_api_key': os.environ.get('NCBI_API_KEY'),
+    'ingest_workers': int(os.environ.get('PUBLICATIONS_INGEST_WORKERS', 4)),
+    'http_timeout': int(os.environ.get('PUBLICATIONS_HTTP_TIMEOUT', 30)),
+    # SQLite publication cache, @see u19_ncrcrg/publication_cache.py. tmp.yaml is imported into it once.
+    'cache_path': os.environ.get('PUBLICATIONS_CACHE', 'publications.sqlite3'),
+    'legacy_yaml_cache': os.environ.get('PUBLICATIONS_LEGACY_YAML_CACHE', 'tmp.yaml'),
+    # publications per page on /papers
+    'page_size': int(os.environ.get('PUBLICATIONS_PAGE_SIZE', 25)),
+    # seconds a publication's accession lists stay in the django cache, @see /papers/<doi>/accessions/
+    'accessions_ttl': int(os.environ.get('PUBLICATIONS_ACCESSIONS_TTL', 60 * 60)),
+}
 
 # redis
 REDIS_HOST = 'cred-test-portal.com'
@@ -284,6 +335,60 @@ AUTH_PASSWORD_VALIDATORS = [
 # Get our user role for read/write to SQS
 SQS_ACCESS_KEY_ID = os.environ['SQS_ACCESS_KEY_ID']
 SQS_SECRET_ACCESS_KEY = os.environ['SQS_SECRET_ACCESS_KEY']
+# process-wide AWS clients, @see u19_ncrcrg/aws.py
+AWS_CLIENTS = {
+    'region_name': os.environ.get('AWS_CLIENTS_REGION_NAME', 'us-west-1'),
+    # connections per client, shared by all threads of a process
+    'max_pool_connections': int(os.environ.get('AWS_CLIENTS_MAX_POOL_CONNECTIONS', 50)),
+    # legacy | standard | adaptive
+    'retry_mode': os.environ.get('AWS_CLIENTS_RETRY_MODE', 'standard'),
+    'max_attempts': int(os.environ.get('AWS_CLIENTS_MAX_ATTEMPTS', 5)),
+    'connect_timeout': float(os.environ.get('AWS_CLIENTS_CONNECT_TIMEOUT', 5)),
+    'read_timeout': float(os.environ.get('AWS_CLIENTS_READ_TIMEOUT', 30)),
+}
+# job status lookups, @see u19_ncrcrg/status_service.py
+JOB_STATUS = {
+    # seconds a job's latest status is served from cache
+    'ttl': int(os.environ.get('JOB_STATUS_TTL', 15)),
+    # concurrent queue lookups in get_statuses()
+    'max_workers': int(os.environ.get('JOB_STATUS_MAX_WORKERS', 8)),
+    # long poll used only when a non-empty queue returns nothing to a short poll
+    'fallback_wait_seconds': int(os.environ.get('JOB_STATUS_FALLBACK_WAIT_SECONDS', 2)),
+    # per_job: a FIFO queue per job. shared: new jobs post to one of a few shared FIFO queues, whose
+    # messages the status consumer moves into the status store
+    'transport': os.environ.get('JOB_STATUS_TRANSPORT', 'per_job'),
+    'shared_queues': int(os.environ.get('JOB_STATUS_SHARED_QUEUES', 4)),
+    'shared_queue_prefix': os.environ.get('JOB_STATUS_SHARED_QUEUE_PREFIX', 'cred-job-status'),
+    # read the status store before SQS. Only set this when `python manage.py consume_job_statuses` runs: it
+    # empties the queues into the store, which otherwise keeps the status recorded at submission. Implied by
+    # the shared transport.
+    'store_first': str2bool(os.environ.get('JOB_STATUS_STORE_FIRST', 'false')),
+    # keep reading (and consuming) the queues of jobs submitted before the switch to shared queues
+    'legacy_queues': str2bool(os.environ.get('JOB_STATUS_LEGACY_QUEUES', 'true')),
+}
+
+# job submission, @see util.enqueue_jobs
+JOB_SUBMISSION = {
+    # write a job's experiment and project records in one transaction (needs a replica set),
+    # @see experiment_store
+    'transactions': str2bool(os.environ.get('JOB_SUBMISSION_TRANSACTIONS', 'false')),
+}
+
+# background task queue, @see tasks and `python manage.py run_workers`
+TASKS = {
+    # mongo | sqlite | memory
+    'broker': os.environ.get('TASKS_BROKER', 'mongo'),
+    'sqlite_path': os.environ.get('TASKS_SQLITE_PATH', os.path.join(BASE_DIR, 'tasks.sqlite3')),
+    # seconds after which the task of an unresponsive worker is run again
+    'lease_seconds': int(os.environ.get('TASKS_LEASE_SECONDS', 300)),
+    'poll_interval': float(os.environ.get('TASKS_POLL_INTERVAL', 2)),
+    # worker threads started by run_workers, i.e. job documents uploaded at the same time
+    'workers': int(os.environ.get('TASKS_WORKERS', 8)),
+    'max_retries': int(os.environ.get('TASKS_MAX_RETRIES', 5)),
+    # seconds before the first retry, doubled for each further retry
+    'backoff': float(os.environ.get('TASKS_BACKOFF', 10)),
+    'modules': ['u19_ncrcrg.background_tasks'],
+}
 
 LANGUAGE_CODE = 'en-us'
 
@@ -0,0 +1,134 @@
+"""
+Drains status messages from the shared and per-job SQS queues into the job status store.
+@see status_store, status_service, management/commands/consume_job_statuses.py
+"""
+import datetime
+import logging
+
+from bson import ObjectId
+
+from . import aws, status_service
+from .mongo import db
+from .status_store import store as default_store
+
+logger = logging.getLogger(__name__)
+
+
+class StatusConsumer:
+    """
+    Moves status messages out of job queues and into a StatusStore. Messages are only deleted from
+    a queue once they are recorded, so a consumer that dies midway loses nothing.
+
+    :param store: StatusStore to record into
+    :param sqs: boto3 SQS client, defaults to aws.get_sqs_client()
+    :param get_queue_url: callable taking a job id and returning its queue URL
+    :param visibility_timeout: int, seconds received messages stay hidden from other consumers
+    """
+
+    def __init__(self, store=None, sqs=None, get_queue_url=None, visibility_timeout=30):
+        self.store = store or default_store
+        self.sqs = sqs or aws.get_sqs_client()
+        self.get_queue_url = get_queue_url or status_service.get_queue_url
+        self.visibility_timeout = visibility_timeout
+
+    def drain(self, job_id, user=None):
+        """
+        Records and deletes every message currently in job_id's queue.
+        :return: int, the number of new statuses recorded
+        """
+        try:
+            url = self.get_queue_url(job_id)
+        except Exception as e:
+            logger.debug(f"No queue for {job_id}: {e}")
+            return 0
+
+        recorded = 0
+        while True:
+            response = self.sqs.receive_message(
+                QueueUrl=url,
+                AttributeNames=['SentTimestamp'],
+                MaxNumberOfMessages=10,
+                VisibilityTimeout=self.visibility_timeout,
+                WaitTimeSeconds=0
+            )
+            messages = response.get('Messages', [])
+            if not messages:
+                return recorded
+
+            for message in messages:
+                sent_at = datetime.datetime.utcfromtimestamp(
+                    int(message['Attributes']['SentTimestamp']) / 1000)
+                if self.store.record(job_id, message['Body'], sent_at,
+                                     message_id=message['MessageId'], user=user):
+                    recorded += 1
+
+            self.sqs.delete_message_batch(
+                QueueUrl=url,
+                Entries=[{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                         for i, message in enumerate(messages)]
+            )
+
+    def drain_shared(self, name):
+        """
+        Records and deletes every message currently in the shared status queue name. The job and user
+        of each message come from its MessageGroupId, user:job.
+        :return: int, the number of new statuses recorded
+        """
+        try:
+            url = status_service.get_shared_queue_url(name)
+        except Exception as e:
+            logger.error(f"Could not open status queue {name}: {e}")
+            return 0
+
+        recorded = 0
+        while True:
+            response = self.sqs.receive_message(
+                QueueUrl=url,
+                AttributeNames=['SentTimestamp', 'MessageGroupId'],
+                MaxNumberOfMessages=10,
+                VisibilityTimeout=self.visibility_timeout,
+                WaitTimeSeconds=0
+            )
+            messages = response.get('Messages', [])
+            if not messages:
+                return recorded
+
+            for message in messages:
+                user, _, job_id = message['Attributes']['MessageGroupId'].rpartition(':')
+                sent_at = datetime.datetime.utcfromtimestamp(
+                    int(message['Attributes']['SentTimestamp']) / 1000)
+                if self.store.record(job_id, message['Body'], sent_at,
+                                     message_id=message['MessageId'], user=user or None):
+                    recorded += 1
+
+            self.sqs.delete_message_batch(
+                QueueUrl=url,
+                Entries=[{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                         for i, message in enumerate(messages)]
+            )
+
+    def drain_all(self, jobs):
+        """
+        :param jobs: iterable of (job_id, user) pairs
+        :return: int, the number of new statuses recorded
+        """
+        recorded = 0
+        for job_id, user in jobs:
+            try:
+                recorded += self.drain(job_id, user=user)
+            except Exception as e:
+                logger.error(f"Problem consuming statuses for {job_id}: {e}")
+        return recorded
+
+
+def recent_jobs(days=14):
+    """
+    Yields (aggr_nickname, user) for jobs with their own queue submitted in the last `days` days. SQS
+    drops messages after 14 days, so older queues have nothing left to consume.
+    """
+    cutoff = ObjectId.from_datetime(datetime.datetime.utcnow() - datetime.timedelta(days=days))
+    for experiment in db['Experiments'].find({'_id': {'$gte': cutoff}, 'user': {'$ne': 'public'},
+                                              'status_queue': {'$exists': False}},
+                                             {'aggr_nickname': True, 'user': True}):
+        if 'aggr_nickname' in experiment:
+            yield experiment['aggr_nickname'], experiment.get('user')
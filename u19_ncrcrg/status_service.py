@@ -0,0 +1,323 @@
+"""
+Job status lookups against the per-job SQS queues.
+
+Each submitted job has a FIFO queue named after its aggr_nickname, to which the pipeline posts
+status messages (@see create_queue). Looking a status up used to mean building a boto3
+client, resolving the queue URL and long polling the queue for up to 12 seconds, all inside a Dash
+callback. Here the client and queue URLs are shared through the aws module, queues are checked
+with get_queue_attributes before being read with a short poll, and the latest status of each job
+is cached for a few seconds.
+
+The status consumer (`python manage.py consume_job_statuses`, @see status_consumer) moves the
+messages of the queues into the status store and deletes them. Once it runs, JOB_STATUS['store_first']
+must be set, so that stored statuses take precedence and SQS is only read for jobs the consumer has not
+seen yet. Otherwise the queues are read first and the store, which also holds the statuses recorded at
+submission (e.g. Submitting…), only answers for jobs that have no queue.
+
+With JOB_STATUS['transport'] = 'shared', new jobs get no queue of their own. Their statuses go to one of
+JOB_STATUS['shared_queues'] shared FIFO queues, named in the job document as status_queue, with
+MessageGroupId user:job (so each job's messages stay ordered) and a MessageDeduplicationId unique to the
+job, since content based deduplication would otherwise drop the same status sent for two jobs. The
+status consumer moves them into the status store, which is then the only place their statuses are read
+from. JOB_STATUS['legacy_queues'] keeps the per-job queues of older jobs readable (and consumed) until
+they have all expired.
+"""
+import datetime
+import hashlib
+import logging
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import aws
+from .status_store import store
+
+logger = logging.getLogger(__name__)
+
+ERROR = ("Error", ' ')
+
+_statuses = {}  # job_id -> (fetched_at, (message, last_updated))
+_statuses_lock = threading.Lock()
+
+
+def _status_settings():
+    return getattr(settings, 'JOB_STATUS', {})
+
+
+def queue_name(job_id):
+    return str(job_id).replace('\"', '') + '.fifo'
+
+
+def get_queue_url(job_id):
+    """
+    Returns the URL of job_id's queue, @see aws.get_queue_url
+    """
+    return aws.get_queue_url(queue_name(job_id))
+
+
+def forget_queue(job_id):
+    """
+    Drops cached state for job_id, e.g. once its queue has been deleted.
+    """
+    aws.forget_queue(queue_name(job_id))
+    with _statuses_lock:
+        _statuses.pop(job_id, None)
+
+
+QUEUE_ATTRIBUTES = {
+    'FifoQueue': 'true',
+    'ContentBasedDeduplication': 'true',
+    # Max is 14 days
+    'MessageRetentionPeriod': '1209600',
+}
+
+
+def store_first():
+    """
+    :return: whether the status store is read before SQS, @see module docstring
+    """
+    options = _status_settings()
+    # shared queues are only ever read by the consumer
+    return options.get('store_first', False) or options.get('transport') == 'shared'
+
+
+def legacy_queues():
+    """
+    :return: whether per-job queues are still read, @see module docstring
+    """
+    return _status_settings().get('legacy_queues', True)
+
+
+def shared_queue_names():
+    options = _status_settings()
+    prefix = options.get('shared_queue_prefix', 'cred-job-status')
+    return [f'{prefix}-{index}.fifo' for index in range(options.get('shared_queues', 4))]
+
+
+def assign_status_queue(job_metadata, username):
+    """
+    Sets job_metadata['status_queue'], the shared queue the job's statuses are sent to, when
+    JOB_STATUS['transport'] is 'shared'. Jobs of the legacy transport are left without one.
+    :return: the queue name, or None
+    """
+    if _status_settings().get('transport', 'per_job') != 'shared':
+        return None
+    names = shared_queue_names()
+    group = f"{username}:{job_metadata['aggr_nickname']}"
+    job_metadata['status_queue'] = names[zlib.crc32(group.encode('utf-8')) % len(names)]
+    return job_metadata['status_queue']
+
+
+def get_shared_queue_url(name):
+    """
+    Returns the URL of the shared queue name, creating the queue the first time it is used.
+    """
+    return aws.create_queue(name, QUEUE_ATTRIBUTES)
+
+
+def send_status(job_id, username, status, url):
+    """
+    :return: the SQS MessageId
+    """
+    group = username + ':' + job_id
+    return aws.get_sqs_client().send_message(
+        QueueUrl=url,
+        MessageBody=status,
+        MessageGroupId=group,
+        MessageDeduplicationId=hashlib.sha256(f'{group}:{status}'.encode('utf-8')).hexdigest(),
+        MessageAttributes={
+            'Status': {
+                'StringValue': status,
+                'DataType': 'String'
+            },
+        },
+    )['MessageId']
+
+
+def create_queue(job_id, username, status='Queued.', status_queue=None):
+    """
+    Posts job_id's first status, and records it in the status store under the same message id, so
+    the consumer does not record it twice. Without a status_queue this creates the job's own FIFO queue.
+    :param status_queue: name of the job's shared status queue, @see assign_status_queue
+    :return: the queue URL
+    """
+    if status_queue is not None:
+        url = get_shared_queue_url(status_queue)
+    else:
+        url = aws.create_queue(queue_name(job_id), QUEUE_ATTRIBUTES)
+    message_id = send_status(job_id, username, status, url)
+    store.record(job_id, status, datetime.datetime.utcnow(), message_id=message_id, user=username)
+    return url
+
+
+def delete_queue(job_id):
+    """
+    Deletes job_id's queue and records the removal in the status store.
+    :return: True if the queue is gone (including if it never existed), False otherwise
+    """
+    url = None
+    if legacy_queues():
+        sqs = aws.get_sqs_client()
+        try:
+            url = get_queue_url(job_id)
+        except sqs.exceptions.QueueDoesNotExist:
+            # e.g. a job on the shared transport, or a queue already deleted
+            pass
+        except Exception as e:
+            logger.error(f"{e}. Problem deleting queue for experiment {job_id}")
+            return False
+
+    try:
+        if url is not None:
+            logger.debug(f'deleting queue url: {url}')
+            sqs.delete_queue(QueueUrl=url)
+        forget_queue(job_id)
+        store.mark_removed(job_id)
+    except Exception as e:
+        logger.error(f"{e}. Problem deleting queue for experiment {job_id}")
+        return False
+    return True
+
+
+def _job_age(job_id):
+    return datetime.datetime.now() - datetime.datetime.strptime('-'.join(job_id.split('-')[-6:]),
+                                                                "%Y-%m-%d-%H-%M-%S")
+
+
+def _latest_message(sqs, url, wait_seconds):
+    response = sqs.receive_message(
+        QueueUrl=url,
+        AttributeNames=[
+            'SentTimestamp',
+        ],
+        MaxNumberOfMessages=10,
+        MessageAttributeNames=[
+            'All'
+        ],
+        VisibilityTimeout=0,
+        WaitTimeSeconds=wait_seconds
+    )
+    latest = None
+    max_timestamp = 0
+    for message in response.get('Messages', []):
+        if float(message['Attributes']['SentTimestamp']) > max_timestamp:
+            max_timestamp = float(message['Attributes']['SentTimestamp'])
+            latest = message['Body']
+    return latest, max_timestamp
+
+
+def fetch_status(job_id, soft_limit=14, hard_limit=30):
+    """
+    Reads the latest status of job_id from SQS, bypassing the status cache.
+    @see get_status
+    """
+    if _job_age(job_id) > datetime.timedelta(days=hard_limit):
+        return f"Job finished.", f'More than {hard_limit} days ago.'
+
+    sqs = aws.get_sqs_client()
+    try:
+        url = get_queue_url(job_id)
+    except Exception as e:
+        logger.error(f"Exception in status_service.fetch_status() : [{e}], {queue_name(job_id)}")
+        return ERROR
+
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=url,
+        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+    )['Attributes']
+    if not any(int(count) for count in attributes.values()):
+        # messages have a 14 day retention, so an empty queue means the job finished a while ago
+        return "Job finished.", f'More than {soft_limit} days ago.'
+
+    message, max_timestamp = _latest_message(sqs, url, wait_seconds=0)
+    if message is None:
+        # a short poll only samples some of the queue's servers and can come back empty
+        message, max_timestamp = _latest_message(
+            sqs, url, wait_seconds=_status_settings().get('fallback_wait_seconds', 2))
+    if message is None:
+        logger.debug(f"No status message received for {job_id}")
+        return "Job finished.", f'More than {soft_limit} days ago.'
+
+    last_updated = datetime.datetime.utcfromtimestamp(max_timestamp / 1000)
+    return message, last_updated.strftime('%m-%d-%y %H:%M:%S')
+
+
+def _stored_statuses(job_ids):
+    try:
+        return store.get_many(job_ids)
+    except Exception as e:
+        logger.error(f"Could not read stored job statuses: {e}")
+        return {}
+
+
+def _cache(job_id, status):
+    with _statuses_lock:
+        _statuses[job_id] = (time.time(), status)
+
+
+def get_status(job_id, soft_limit=14, hard_limit=30):
+    """
+    Returns (status message, last updated) for job_id, @see get_statuses
+    :param job_id: string, the job's aggr_nickname
+    :param soft_limit: int, days after which status messages have expired from the queue
+    :param hard_limit: int, days after submission after which SQS is not checked at all
+    """
+    return get_statuses([job_id], soft_limit=soft_limit, hard_limit=hard_limit)[job_id]
+
+
+def _fetch_and_cache(job_id, soft_limit, hard_limit):
+    if not legacy_queues():
+        # every job has a shared status queue, whose statuses are all in the status store
+        return ERROR
+    try:
+        status = fetch_status(job_id, soft_limit=soft_limit, hard_limit=hard_limit)
+    except Exception as e:
+        logger.error(f"Exception in status_service.get_status() for job {job_id}: [{e}]")
+        return ERROR
+    if status != ERROR:
+        _cache(job_id, status)
+    return status
+
+
+def get_statuses(job_ids, soft_limit=14, hard_limit=30):
+    """
+    Returns {job_id: (status message, last updated)} for many jobs. Statuses fetched in the last
+    JOB_STATUS['ttl'] seconds are served from cache. The others are looked up in SQS concurrently
+    and in the status store with one query, the store first if store_first().
+    """
+    job_ids = list(dict.fromkeys(job_ids))
+    if not job_ids:
+        return {}
+    ttl = _status_settings().get('ttl', 15)
+    now = time.time()
+    statuses = {}
+    with _statuses_lock:
+        for job_id in job_ids:
+            cached = _statuses.get(job_id)
+            if cached is not None and now - cached[0] < ttl:
+                statuses[job_id] = cached[1]
+
+    missing = [job_id for job_id in job_ids if job_id not in statuses]
+    if missing and store_first():
+        stored = _stored_statuses(missing)
+        for job_id, status in stored.items():
+            _cache(job_id, status)
+        statuses.update(stored)
+        missing = [job_id for job_id in missing if job_id not in stored]
+
+    if missing:
+        max_workers = min(_status_settings().get('max_workers', 8), len(missing))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetched = dict(zip(missing, executor.map(
+                lambda job_id: _fetch_and_cache(job_id, soft_limit, hard_limit), missing)))
+        failed = [job_id for job_id, status in fetched.items() if status == ERROR]
+        if failed and not store_first():
+            # no queue (yet), e.g. a job still being submitted or whose submission failed
+            for job_id, status in _stored_statuses(failed).items():
+                _cache(job_id, status)
+                fetched[job_id] = status
+        statuses.update(fetched)
+    return {job_id: statuses[job_id] for job_id in job_ids}
@@ -0,0 +1,159 @@
+"""
+Persisted job statuses.
+
+Status messages posted to a job's SQS queue are drained by the status consumer
+(@see status_consumer.StatusConsumer) and recorded here, one document per job in the JobStatuses
+collection:
+
+    {
+        '_id': aggr_nickname,
+        'user': username,
+        'status': latest status message,
+        'last_updated': datetime (UTC) the latest message was sent,
+        'history': [{'status', 'timestamp', 'message_id'}, ...],
+        'removed_at': datetime the job's queue was deleted, if it was,
+        'notified': the status the job's owner was last emailed about (@see notifier)
+    }
+
+so that reading a job's status is a single lookup by _id, and the record outlives the queue.
+"""
+import datetime
+import logging
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .mongo import db
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = 'JobStatuses'
+DATE_FORMAT = '%m-%d-%y %H:%M:%S'
+
+
+class StatusStore:
+    """
+    Reads and writes job statuses.
+
+    :param collection: pymongo Collection to use, defaults to db.JobStatuses
+    """
+
+    def __init__(self, collection=None):
+        self._collection = collection
+
+    @property
+    def collection(self):
+        return self._collection if self._collection is not None else db[COLLECTION]
+
+    def record(self, job_id, status, sent_at, message_id=None, user=None):
+        """
+        Appends a status message to job_id's history, and makes it the job's current status unless
+        a later message has already been recorded. Recording the same message_id twice is a no-op.
+        :param job_id: string, the job's aggr_nickname
+        :param status: string, the message body
+        :param sent_at: datetime (UTC) the message was sent
+        :param message_id: string, SQS MessageId used to drop redelivered messages
+        :param user: string, the job's owner
+        :return: True if the message was new
+        """
+        entry = {'status': status, 'timestamp': sent_at, 'message_id': message_id}
+        query = {'_id': job_id}
+        if message_id is not None:
+            query['history.message_id'] = {'$ne': message_id}
+        update = {'$push': {'history': entry}}
+        if user is not None:
+            update['$set'] = {'user': user}
+        try:
+            self.collection.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            # the document exists and already has this message
+            return False
+
+        self.collection.update_one(
+            {'_id': job_id, '$or': [{'last_updated': {'$lte': sent_at}}, {'last_updated': None}]},
+            {'$set': {'status': status, 'last_updated': sent_at}}
+        )
+        return True
+
+    def record_many(self, job_ids, status, sent_at, user=None):
+        """
+        Records the same status for many jobs with one insert, e.g. when they are submitted. Jobs that already have a
+        document go through record.
+        """
+        job_ids = list(job_ids)
+        documents = []
+        for job_id in job_ids:
+            document = {'_id': job_id, 'status': status, 'last_updated': sent_at,
+                        'history': [{'status': status, 'timestamp': sent_at, 'message_id': None}]}
+            if user is not None:
+                document['user'] = user
+            documents.append(document)
+        if not documents:
+            return
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != 11000:
+                    raise
+                self.record(job_ids[error['index']], status, sent_at, user=user)
+
+    def mark_removed(self, job_id, removed_at=None):
+        self.collection.update_one(
+            {'_id': job_id},
+            {'$set': {'removed_at': removed_at or datetime.datetime.utcnow()}}
+        )
+
+    def claim_notification(self, job_id, status):
+        """
+        Atomically marks job_id's owner as notified of status.
+        :return: True if the caller should send the notification, False if it was already claimed
+        """
+        try:
+            self.collection.update_one(
+                {'_id': job_id, 'notified': {'$ne': status}},
+                {'$set': {'notified': status, 'notified_at': datetime.datetime.utcnow()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def release_notification(self, job_id, status):
+        """
+        Undoes claim_notification, e.g. if sending the email failed.
+        """
+        self.collection.update_one({'_id': job_id, 'notified': status},
+                                   {'$unset': {'notified': '', 'notified_at': ''}})
+
+    def notified(self, job_ids):
+        """
+        :return: {job_id: status} for the job_ids whose owner has been notified
+        """
+        return {record['_id']: record['notified']
+                for record in self.collection.find({'_id': {'$in': list(job_ids)}, 'notified': {'$exists': True}},
+                                                   {'notified': True})}
+
+    def get(self, job_id):
+        """
+        :return: (status, last updated string) for job_id, or None if nothing was recorded
+        """
+        return self.get_many([job_id]).get(job_id)
+
+    def get_many(self, job_ids):
+        """
+        :return: {job_id: (status, last updated string)} for the job_ids that have a status
+        """
+        statuses = {}
+        for record in self.collection.find({'_id': {'$in': list(job_ids)}, 'status': {'$exists': True}},
+                                           {'status': True, 'last_updated': True}):
+            statuses[record['_id']] = (record['status'], record['last_updated'].strftime(DATE_FORMAT))
+        return statuses
+
+    def history(self, job_id):
+        record = self.collection.find_one({'_id': job_id}, {'history': True})
+        if record is None:
+            return []
+        return sorted(record.get('history', []), key=lambda entry: entry['timestamp'])
+
+
+store = StatusStore()
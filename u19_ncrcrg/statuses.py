@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 STATUS_MESSAGES = {
+    'SUBMITTING': {'status': 'Submitting…', 'progress': 0},
     'QUEUED': {'status': 'Queued.', 'progress': 1},
     'SUBMITDOWNLOAD': {'status': 'Submitting download job', 'progress': 10},
     'DOWNLOADING': {'status': 'Downloading.', 'progress': 15},
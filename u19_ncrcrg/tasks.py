@@ -0,0 +1,481 @@
+"""
+A small background task queue, for slow side effects that should not run inside a request or Dash callback
+(Globus uploads and ACL changes, SQS queue creation, ...).
+
+Functions are registered by name with @task and enqueued with enqueue(name, *args, **kwargs); arguments must be
+BSON/JSON serializable. `python manage.py run_workers` claims and runs them. A claimed task is leased to its worker
+for TASKS['lease_seconds'], so the task of a crashed worker is picked up again once the lease runs out. A failing
+task is retried with exponential backoff (backoff * 2 ** (attempt - 1) seconds) up to max_retries times, then marked
+failed and its on_failure callback is called. Passing an idempotency_key makes enqueue a no-op while a task with the
+same key is pending, running or has succeeded (only pending or running with pending_only); otherwise that task is
+queued again with the new arguments.
+
+Brokers: MongoBroker (the Tasks collection, the default) and SQLiteBroker (a file, or ':memory:' for tests and
+local development), chosen with TASKS['broker'] = 'mongo' | 'sqlite' | 'memory'.
+"""
+import datetime
+import importlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+STATUSES = (PENDING, RUNNING, SUCCEEDED, FAILED)
+
+
+def _requeued(document):
+    """
+    :return: the statuses in which a task holding document's idempotency key is queued again, @see enqueue
+    """
+    return (FAILED, SUCCEEDED) if document.get('pending_only') else (FAILED,)
+
+
+def _task_settings():
+    return getattr(settings, 'TASKS', {})
+
+
+class Task:
+    """
+    :param func: the function run by workers
+    :param name: str, name the task is enqueued with
+    :param max_retries: int, retries after the first attempt
+    :param backoff: float, seconds before the first retry; doubled for each further retry
+    :param on_failure: callable(task document, error string), called once the task has failed for good
+    """
+
+    def __init__(self, func, name, max_retries, backoff, on_failure=None):
+        self.func = func
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_failure = on_failure
+
+
+REGISTRY = {}
+
+
+def task(name=None, max_retries=None, backoff=None, on_failure=None):
+    """
+    Registers the decorated function as a task. The function itself is returned unchanged.
+    """
+
+    def decorator(func):
+        options = _task_settings()
+        spec = Task(
+            func,
+            name or f'{func.__module__}.{func.__name__}',
+            options.get('max_retries', 5) if max_retries is None else max_retries,
+            options.get('backoff', 10) if backoff is None else backoff,
+            on_failure,
+        )
+        REGISTRY[spec.name] = spec
+        func.task_name = spec.name
+        return func
+
+    return decorator
+
+
+class MongoBroker:
+    """
+    Tasks stored in a MongoDB collection (Tasks by default).
+    """
+
+    def __init__(self, collection=None):
+        if collection is None:
+            from .mongo import db
+            collection = db['Tasks']
+        self.collection = collection
+        # @see mongo.INDEXES, repeated here so a fresh database works without running ensure_indexes first
+        self.collection.create_index('idempotency_key', name='idempotency_key', unique=True, sparse=True)
+
+    def _new_document(self, document, now):
+        document = dict(document)
+        document.update(created_at=now, updated_at=now,
+                        run_at=now + datetime.timedelta(seconds=document.pop('delay', 0)))
+        if document.get('idempotency_key') is None:
+            document.pop('idempotency_key', None)
+        return document
+
+    def put(self, document):
+        from pymongo.errors import DuplicateKeyError
+        now = datetime.datetime.utcnow()
+        document = self._new_document(document, now)
+        try:
+            self.collection.insert_one(document)
+            return document['_id']
+        except DuplicateKeyError:
+            return self._existing(document, now)
+
+    def put_many(self, documents):
+        """
+        Bulk version of put: one insert_many, then put's handling for the documents whose idempotency key is taken.
+        """
+        from pymongo.errors import BulkWriteError
+        now = datetime.datetime.utcnow()
+        documents = [self._new_document(document, now) for document in documents]
+        task_ids = [document['_id'] for document in documents]
+        if not documents:
+            return task_ids
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != 11000:
+                    raise
+                task_ids[error['index']] = self._existing(documents[error['index']], now)
+        return task_ids
+
+    def _existing(self, document, now):
+        """
+        :return: the id of the task holding document's idempotency key, re-queued with document's arguments if it is
+            done, @see _requeued
+        """
+        existing = self.collection.find_one_and_update(
+            {'idempotency_key': document['idempotency_key'], 'status': {'$in': list(_requeued(document))}},
+            {'$set': {'status': PENDING, 'attempts': 0, 'run_at': now, 'updated_at': now, 'args': document['args'],
+                      'kwargs': document['kwargs'], 'pending_only': document.get('pending_only', False)}},
+        )
+        if existing is None:
+            existing = self.collection.find_one({'idempotency_key': document['idempotency_key']}, {'_id': True})
+        return existing['_id']
+
+    def claim(self, worker, lease_seconds):
+        from pymongo import ReturnDocument
+        now = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {'$or': [
+                {'status': PENDING, 'run_at': {'$lte': now}},
+                {'status': RUNNING, 'lease_until': {'$lt': now}},
+            ]},
+            {'$set': {'status': RUNNING, 'worker': worker, 'updated_at': now,
+                      'lease_until': now + datetime.timedelta(seconds=lease_seconds)},
+             '$inc': {'attempts': 1}},
+            sort=[('run_at', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _finish(self, task_id, update):
+        update['updated_at'] = datetime.datetime.utcnow()
+        self.collection.update_one({'_id': task_id}, {'$set': update})
+
+    def succeed(self, task_id):
+        self._finish(task_id, {'status': SUCCEEDED, 'last_error': None})
+
+    def retry(self, task_id, error, delay):
+        self._finish(task_id, {'status': PENDING, 'last_error': error,
+                               'run_at': datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)})
+
+    def fail(self, task_id, error):
+        self._finish(task_id, {'status': FAILED, 'last_error': error})
+
+    def get(self, task_id):
+        return self.collection.find_one({'_id': task_id})
+
+    def counts(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        for row in self.collection.aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+            counts[row['_id']] = row['count']
+        return counts
+
+    def tasks(self, status=None, limit=20):
+        query = {} if status is None else {'status': status}
+        return list(self.collection.find(query).sort('updated_at', -1).limit(limit))
+
+
+class SQLiteBroker:
+    """
+    Tasks stored in SQLite. path=':memory:' keeps them in this process only.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        _id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        args TEXT NOT NULL,
+        kwargs TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_retries INTEGER NOT NULL,
+        backoff REAL NOT NULL,
+        idempotency_key TEXT UNIQUE,
+        run_at REAL NOT NULL,
+        lease_until REAL,
+        worker TEXT,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS tasks_status_run_at ON tasks (status, run_at);
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        # one connection shared by the worker threads of this process, serialized by _lock
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self._lock:
+            if path != ':memory:':
+                self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(self.SCHEMA)
+
+    def _document(self, row):
+        if row is None:
+            return None
+        document = dict(row)
+        document['args'] = json.loads(document['args'])
+        document['kwargs'] = json.loads(document['kwargs'])
+        return document
+
+    def _put(self, document, now):
+        args = json.dumps(document['args'], default=str)
+        kwargs = json.dumps(document['kwargs'], default=str)
+        existing = None
+        if document.get('idempotency_key') is not None:
+            existing = self.conn.execute('SELECT _id, status FROM tasks WHERE idempotency_key = ?',
+                                         (document['idempotency_key'],)).fetchone()
+        if existing is None:
+            self.conn.execute(
+                'INSERT INTO tasks (_id, name, args, kwargs, status, attempts, max_retries, backoff, '
+                'idempotency_key, run_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)',
+                (document['_id'], document['name'], args, kwargs, PENDING, document['max_retries'],
+                 document['backoff'], document.get('idempotency_key'), now + document.get('delay', 0), now, now))
+            return document['_id']
+        if existing['status'] in _requeued(document):
+            self.conn.execute(
+                'UPDATE tasks SET status = ?, attempts = 0, run_at = ?, updated_at = ?, args = ?, '
+                'kwargs = ? WHERE _id = ?', (PENDING, now, now, args, kwargs, existing['_id']))
+        return existing['_id']
+
+    def put(self, document):
+        return self.put_many([document])[0]
+
+    def put_many(self, documents):
+        """
+        Bulk version of put, in one transaction.
+        """
+        now = time.time()
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                task_ids = [self._put(document, now) for document in documents]
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return task_ids
+
+    def claim(self, worker, lease_seconds):
+        now = time.time()
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    'SELECT _id FROM tasks WHERE (status = ? AND run_at <= ?) OR (status = ? AND lease_until < ?) '
+                    'ORDER BY run_at LIMIT 1', (PENDING, now, RUNNING, now)).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        'UPDATE tasks SET status = ?, worker = ?, lease_until = ?, updated_at = ?, '
+                        'attempts = attempts + 1 WHERE _id = ?', (RUNNING, worker, now + lease_seconds, now, row[0]))
+                    row = self.conn.execute('SELECT * FROM tasks WHERE _id = ?', (row[0],)).fetchone()
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return self._document(row)
+
+    def _finish(self, task_id, status, error=None, run_at=None):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'UPDATE tasks SET status = ?, last_error = ?, run_at = COALESCE(?, run_at), updated_at = ? '
+                'WHERE _id = ?', (status, error, run_at, now, task_id))
+
+    def succeed(self, task_id):
+        self._finish(task_id, SUCCEEDED)
+
+    def retry(self, task_id, error, delay):
+        self._finish(task_id, PENDING, error, run_at=time.time() + delay)
+
+    def fail(self, task_id, error):
+        self._finish(task_id, FAILED, error)
+
+    def get(self, task_id):
+        with self._lock:
+            return self._document(self.conn.execute('SELECT * FROM tasks WHERE _id = ?', (task_id,)).fetchone())
+
+    def counts(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        with self._lock:
+            for status, count in self.conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status'):
+                counts[status] = count
+        return counts
+
+    def tasks(self, status=None, limit=20):
+        query = 'SELECT * FROM tasks'
+        params = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            params = (status,)
+        with self._lock:
+            rows = self.conn.execute(query + ' ORDER BY updated_at DESC LIMIT ?', params + (limit,)).fetchall()
+        return [self._document(row) for row in rows]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Returns this process' broker, @see TASKS['broker']
+    """
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                options = _task_settings()
+                kind = options.get('broker', 'mongo')
+                if kind == 'mongo':
+                    _broker = MongoBroker()
+                elif kind == 'sqlite':
+                    _broker = SQLiteBroker(options.get('sqlite_path', 'tasks.sqlite3'))
+                elif kind == 'memory':
+                    _broker = SQLiteBroker(':memory:')
+                else:
+                    raise ValueError(f"Unknown TASKS['broker']: {kind}")
+    return _broker
+
+
+def _task_document(name, args, kwargs, idempotency_key, delay, pending_only=False):
+    spec = REGISTRY.get(name)
+    options = _task_settings()
+    return {
+        '_id': uuid.uuid4().hex,
+        'name': name,
+        'args': list(args),
+        'kwargs': kwargs,
+        'status': PENDING,
+        'attempts': 0,
+        'max_retries': spec.max_retries if spec else options.get('max_retries', 5),
+        'backoff': spec.backoff if spec else options.get('backoff', 10),
+        'idempotency_key': idempotency_key,
+        'delay': delay,
+        'pending_only': pending_only,
+    }
+
+
+def enqueue(name, *args, idempotency_key=None, delay=0, pending_only=False, broker=None, **kwargs):
+    """
+    Queues the task registered as name.
+    :param idempotency_key: str, @see module docstring
+    :param delay: float, seconds before the task may run
+    :param pending_only: bool, also queue the task again if the one holding idempotency_key has succeeded
+    :return: the task id
+    """
+    task_id = (broker or get_broker()).put(_task_document(name, args, kwargs, idempotency_key, delay, pending_only))
+    logger.debug(f"Enqueued task {name} ({task_id})")
+    return task_id
+
+
+def enqueue_many(name, calls, delay=0, broker=None):
+    """
+    Queues the task registered as name once per call, with a single write to the broker.
+    :param calls: list of (args, idempotency_key) tuples, @see enqueue
+    :return: list of task ids, in the order of calls
+    """
+    task_ids = (broker or get_broker()).put_many(
+        [_task_document(name, args, {}, idempotency_key, delay) for args, idempotency_key in calls])
+    logger.debug(f"Enqueued {len(task_ids)} {name} tasks")
+    return task_ids
+
+
+def load_task_modules(modules=None):
+    """
+    Imports the modules defining tasks, so workers know every registered name.
+    """
+    for module in modules if modules is not None else _task_settings().get('modules', ['u19_ncrcrg.background_tasks']):
+        importlib.import_module(module)
+
+
+class Worker:
+    """
+    Claims and runs tasks one at a time.
+
+    :param broker: broker to claim tasks from, get_broker() by default
+    :param name: str, recorded on claimed tasks
+    :param lease_seconds: float, time after which a running task is considered abandoned
+    :param poll_interval: float, seconds to sleep when there is nothing to do
+    """
+
+    def __init__(self, broker=None, name=None, lease_seconds=None, poll_interval=None):
+        options = _task_settings()
+        self.broker = broker or get_broker()
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lease_seconds = lease_seconds or options.get('lease_seconds', 300)
+        self.poll_interval = poll_interval or options.get('poll_interval', 2)
+
+    def run_once(self):
+        """
+        Runs the next due task, if any.
+        :return: False if there was nothing to run
+        """
+        document = self.broker.claim(self.name, self.lease_seconds)
+        if document is None:
+            return False
+        self.execute(document)
+        return True
+
+    def execute(self, document):
+        spec = REGISTRY.get(document['name'])
+        if spec is None:
+            logger.error(f"Unknown task {document['name']} ({document['_id']})")
+            self.broker.fail(document['_id'], f"Unknown task {document['name']}")
+            return
+        try:
+            spec.func(*document['args'], **document['kwargs'])
+        except Exception as e:
+            error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            if document['attempts'] <= document['max_retries']:
+                delay = document['backoff'] * 2 ** (document['attempts'] - 1)
+                logger.warning(f"Task {spec.name} ({document['_id']}) failed, retrying in {delay:.0f}s: {error}")
+                self.broker.retry(document['_id'], error, delay)
+                return
+            logger.error(f"Task {spec.name} ({document['_id']}) failed for good: {error}")
+            self.broker.fail(document['_id'], error)
+            if spec.on_failure is not None:
+                try:
+                    spec.on_failure(document, error)
+                except Exception as callback_error:
+                    logger.error(f"on_failure of {spec.name} ({document['_id']}) raised: {callback_error}")
+            return
+        self.broker.succeed(document['_id'])
+
+    def run(self, stop=None, exit_when_idle=False):
+        """
+        :param stop: threading.Event ending the loop
+        :param exit_when_idle: return as soon as no task is due
+        """
+        while stop is None or not stop.is_set():
+            try:
+                ran = self.run_once()
+            except Exception as e:
+                logger.error(f"Worker {self.name} could not claim a task: {e}")
+                ran = False
+            if not ran:
+                if exit_when_idle:
+                    return
+                time.sleep(self.poll_interval)
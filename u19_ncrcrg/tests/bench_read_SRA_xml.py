@@ -0,0 +1,75 @@
+"""
+Benchmark of the SRA XML parsers on one large multi-run EXPERIMENT_PACKAGE.
+
+    python -m u19_ncrcrg.tests.bench_read_SRA_xml [--runs 500 1000 2000] [--baseline path/to/old/read_SRA_xml.py]
+
+--baseline loads another version of read_SRA_xml.py (e.g. from `git show <commit>:u19_ncrcrg/read_SRA_xml.py`)
+and times it on the same input.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import time
+
+from u19_ncrcrg import read_SRA_xml
+
+PACKAGE_HEAD = (
+    '<EXPERIMENT_PACKAGE><EXPERIMENT accession="SRX1"><TITLE>GSM1: big series</TITLE>'
+    '<DESIGN><DESIGN_DESCRIPTION>10x</DESIGN_DESCRIPTION><LIBRARY_DESCRIPTOR><LIBRARY_SOURCE>TRANSCRIPTOMIC'
+    '</LIBRARY_SOURCE><LIBRARY_SELECTION>cDNA</LIBRARY_SELECTION><LIBRARY_LAYOUT><PAIRED/></LIBRARY_LAYOUT>'
+    '</LIBRARY_DESCRIPTOR></DESIGN><PLATFORM><ILLUMINA><INSTRUMENT_MODEL>NovaSeq</INSTRUMENT_MODEL></ILLUMINA>'
+    '</PLATFORM></EXPERIMENT><Organization><Name>UCSD</Name><Contact email="a@ucsd.edu"/></Organization>'
+    '<STUDY><IDENTIFIERS><EXTERNAL_ID namespace="BioProject">PRJNA1</EXTERNAL_ID></IDENTIFIERS><DESCRIPTOR>'
+    '<STUDY_TITLE>Title</STUDY_TITLE><STUDY_ABSTRACT>Abstract</STUDY_ABSTRACT></DESCRIPTOR></STUDY>'
+    '<SAMPLE><SAMPLE_NAME><SCIENTIFIC_NAME>Homo sapiens</SCIENTIFIC_NAME></SAMPLE_NAME><SAMPLE_ATTRIBUTES>'
+    + ''.join(f'<SAMPLE_ATTRIBUTE><TAG>tag{i}</TAG><VALUE>value{i}</VALUE></SAMPLE_ATTRIBUTE>' for i in range(20))
+    + '</SAMPLE_ATTRIBUTES></SAMPLE><RUN_SET>'
+)
+RUN = (
+    '<RUN accession="SRR{0}"><SRAFiles><SRAFile filename="SRR{0}" url="https://sra.example/SRR{0}"/>'
+    '<SRAFile filename="run{0}.bam" url="https://s3.example/SRR{0}/run{0}.bam"/></SRAFiles></RUN>'
+)
+
+
+def multi_run_package(runs):
+    return ('<EXPERIMENT_PACKAGE_SET>' + PACKAGE_HEAD + ''.join(RUN.format(i) for i in range(runs))
+            + '</RUN_SET></EXPERIMENT_PACKAGE></EXPERIMENT_PACKAGE_SET>').encode()
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('baseline_read_SRA_xml', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the 10x parser prints every run
+        func(*args)
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, nargs='+', default=[250, 500, 1000, 2000])
+    parser.add_argument('--baseline', help='path of another read_SRA_xml.py to compare with')
+    args = parser.parse_args(argv)
+
+    modules = [('current', read_SRA_xml)]
+    if args.baseline:
+        modules.append((os.path.basename(args.baseline), load_module(args.baseline)))
+
+    print(f"{'runs':>6} {'module':>20} {'10x (s)':>10} {'rnaseq (s)':>12}")
+    for runs in args.runs:
+        xml = multi_run_package(runs)
+        for name, module in modules:
+            tenx = timed(module.get_10x_metadata_from_xml, xml, 'refdata', 'auto', False, '28', '91', '3000')
+            rnaseq = timed(module.get_rnaseq_metadata_from_xml, xml, 'star', '0', '10', 'adapters.fa', 'chrom.sizes')
+            print(f"{runs:>6} {name:>20} {tenx:>10.3f} {rnaseq:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
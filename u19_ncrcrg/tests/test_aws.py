@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from u19_ncrcrg import aws
+
+mock_aws = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_sqs')
+
+
+@pytest.fixture(autouse=True)
+def clients(monkeypatch):
+    monkeypatch.setattr(settings, 'SQS_ACCESS_KEY_ID', 'testing', raising=False)
+    monkeypatch.setattr(settings, 'SQS_SECRET_ACCESS_KEY', 'testing', raising=False)
+    monkeypatch.setattr(settings, 'AWS_CLIENTS', {'max_pool_connections': 7, 'read_timeout': 25}, raising=False)
+    monkeypatch.setattr(aws, '_clients', {})
+    monkeypatch.setattr(aws, '_clients_pid', None)
+    monkeypatch.setattr(aws, '_queue_urls', {})
+    with mock_aws():
+        yield
+
+
+def test_one_configured_client_per_process():
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(aws.get_sqs_client())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in clients}) == 1
+    config = clients[0].meta.config
+    assert config.region_name == 'us-west-1'
+    assert config.max_pool_connections == 7
+    assert config.read_timeout == 25
+    assert config.retries['mode'] == 'standard'
+
+
+def test_client_is_rebuilt_after_fork(monkeypatch):
+    client = aws.get_sqs_client()
+    monkeypatch.setattr(aws, '_clients_pid', -1)
+    assert aws.get_sqs_client() is not client
+
+
+def test_queue_urls_are_cached():
+    url = aws.create_queue('jobs.fifo', {'FifoQueue': 'true'})
+    assert aws.get_queue_url('jobs.fifo') == url
+
+    aws.get_sqs_client().delete_queue(QueueUrl=url)
+    assert aws.get_queue_url('jobs.fifo') == url  # no request made
+    aws.forget_queue('jobs.fifo')
+    with pytest.raises(Exception):
+        aws.get_queue_url('jobs.fifo')
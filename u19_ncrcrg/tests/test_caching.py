@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from u19_ncrcrg.caching import RefreshingCache
+
+
+def test_failed_reload_serves_last_value_without_waiting():
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        if len(calls) > 1:
+            time.sleep(0.2)
+            raise RuntimeError('down')
+        return 'first'
+
+    cache = RefreshingCache(loader, ttl=60, timeout=1, failure_backoff=60)
+    assert cache.get('k') == 'first'
+    cache.invalidate('k')
+
+    assert cache.get('k') == 'first'
+    started = time.monotonic()
+    assert cache.get('k') == 'first'
+    assert time.monotonic() - started < 0.1
+    assert len(calls) == 2
+
+
+def test_lookups_during_a_slow_reload_do_not_wait():
+    values = iter(['first', 'second'])
+
+    def loader(key):
+        value = next(values)
+        if value == 'second':
+            time.sleep(0.5)
+        return value
+
+    cache = RefreshingCache(loader, ttl=60, timeout=0.05)
+    assert cache.get('k') == 'first'
+    cache.invalidate('k')
+    assert cache.get('k') == 'first'
+
+    started = time.monotonic()
+    assert cache.get('k') == 'first'
+    assert time.monotonic() - started < 0.05
+    time.sleep(0.6)
+    assert cache.get('k') == 'second'
@@ -0,0 +1,136 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from u19_ncrcrg.experiment_store import ExperimentStore
+
+
+def job(name, project='my-project'):
+    return {'aggr_nickname': name, 'project': project, 'modality': 'rnaseq'}
+
+
+@pytest.fixture
+def store():
+    database = mongomock.MongoClient().db
+    database.Projects.create_index([('user', 1), ('project_name', 1)], unique=True)
+    return ExperimentStore(experiments=database.Experiments, projects=database.Projects)
+
+
+class BulkCollection:
+    """
+    mongomock collection whose bulk_write runs each UpdateOne with update_one, since the pinned mongomock rejects the
+    arguments newer pymongo versions pass to its bulk API. Records the batches it is given.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.batches = []
+
+    def __getattr__(self, attr):
+        return getattr(self.collection, attr)
+
+    def bulk_write(self, requests, ordered=True, session=None):
+        self.batches.append(requests)
+        for request in requests:
+            self.collection.update_one(request._filter, request._doc, upsert=request._upsert)
+
+
+@pytest.fixture
+def bulk_store(store):
+    store._projects = BulkCollection(store.projects)
+    return store
+
+
+def test_add_creates_project_once(store):
+    store.add(job('a'), 'alice')
+    store.add(job('b'), 'alice')
+    store.add(job('c'), 'bob')
+
+    project = store.projects.find_one({'user': 'alice', 'project_name': 'my-project'})
+    assert [experiment['aggr_nickname'] for experiment in project['experiments']] == ['a', 'b']
+    assert project['num_experiments'] == 2
+    assert project['tags'] == ['CREDV2'] and project['trashed'] == 'no'
+    assert store.projects.count_documents({}) == 2
+    assert store.experiments.count_documents({}) == 3
+
+
+def test_add_does_not_modify_job_metadata(store):
+    metadata = job('a')
+    store.add(metadata, 'alice')
+    assert '_id' not in metadata
+
+
+def test_add_project_keeps_existing_project(store):
+    assert store.add_project({'project_name': 'p', 'user': 'alice', 'description': 'mine'})
+    store.add(job('a', project='p'), 'alice')
+    assert not store.add_project({'project_name': 'p', 'user': 'alice', 'description': 'other'})
+
+    project = store.projects.find_one({'project_name': 'p'})
+    assert project['description'] == 'mine'
+    assert project['num_experiments'] == 1
+
+
+def test_add_many_groups_jobs_by_project(bulk_store):
+    errors = bulk_store.add_many([job('a'), job('b', project='other'), job('c')], 'alice')
+
+    assert errors == [None, None, None]
+    projects = {project['project_name']: project for project in bulk_store.projects.find()}
+    assert [experiment['aggr_nickname'] for experiment in projects['my-project']['experiments']] == ['a', 'c']
+    assert projects['my-project']['num_experiments'] == 2
+    assert projects['other']['num_experiments'] == 1
+    # one upsert per project, in one batch
+    assert [len(batch) for batch in bulk_store.projects.batches] == [2]
+
+
+def test_add_many_leaves_out_jobs_whose_experiment_fails(bulk_store):
+    bulk_store.experiments.create_index('aggr_nickname', unique=True)
+    bulk_store.add(job('a'), 'alice')
+
+    errors = bulk_store.add_many([job('a'), job('b')], 'alice')
+
+    assert errors[0].startswith('experiment:') and errors[1] is None
+    project = bulk_store.projects.find_one({'project_name': 'my-project'})
+    assert [experiment['aggr_nickname'] for experiment in project['experiments']] == ['a', 'b']
+    assert project['num_experiments'] == 2
+
+
+def test_merge_duplicate_projects():
+    database = mongomock.MongoClient().db
+    store = ExperimentStore(experiments=database.Experiments, projects=database.Projects)
+    database.Projects.insert_many([
+        {'_id': 1, 'user': 'alice', 'project_name': 'p', 'experiments': [{'aggr_nickname': 'a'}], 'num_experiments': 1},
+        {'_id': 2, 'user': 'alice', 'project_name': 'p', 'experiments': [{'aggr_nickname': 'a'},
+                                                                         {'aggr_nickname': 'b'}], 'num_experiments': 2},
+        {'_id': 3, 'user': 'bob', 'project_name': 'p', 'experiments': [], 'num_experiments': 0},
+    ])
+
+    assert store.merge_duplicate_projects() == 1
+    assert not store.duplicate_projects()
+    project = database.Projects.find_one({'_id': 1})
+    assert [experiment['aggr_nickname'] for experiment in project['experiments']] == ['a', 'b']
+    assert project['num_experiments'] == 2
+
+
+def test_ensure_indexes_keeps_index_while_projects_are_duplicated(monkeypatch):
+    from u19_ncrcrg.management.commands import ensure_indexes
+
+    database = mongomock.MongoClient().db
+    database.Projects.create_index([('user', 1), ('project_name', 1)], name='user_project_name')
+    database.Projects.insert_many([{'user': 'alice', 'project_name': 'p'}, {'user': 'alice', 'project_name': 'p'}])
+    monkeypatch.setattr(ensure_indexes, 'db', database)
+    monkeypatch.setattr(ensure_indexes, 'INDEXES', [
+        ('Projects', [('user', 1), ('project_name', 1)], {'name': 'user_project_name', 'unique': True})])
+    command = ensure_indexes.Command()
+
+    assert command.build_indexes() == 1
+    assert not database.Projects.index_information()['user_project_name'].get('unique', False)
+
+    ExperimentStore(experiments=database.Experiments, projects=database.Projects).merge_duplicate_projects()
+    assert command.build_indexes() == 0
+    assert database.Projects.index_information()['user_project_name']['unique']
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from u19_ncrcrg.notifier import Notifier
+from u19_ncrcrg.status_store import StatusStore
+
+EXPERIMENTS = [
+    {'aggr_nickname': 'done-2022-01-02-03-04-05', 'contact_email': 'a@example.com'},
+    {'aggr_nickname': 'failed-2022-01-02-03-04-05', 'contact_email': 'b@example.com'},
+    {'aggr_nickname': 'running-2022-01-02-03-04-05', 'contact_email': 'c@example.com'},
+]
+STATUSES = {
+    'done-2022-01-02-03-04-05': 'Complete!',
+    'failed-2022-01-02-03-04-05': 'Failed',
+    'running-2022-01-02-03-04-05': 'Running.',
+}
+
+
+def make_notifier(store, sent, send=None):
+    def record_send(subject, message, from_email, recipients):
+        sent.append(recipients[0])
+
+    return Notifier(concurrency=2, store=store,
+                    get_statuses=lambda job_ids: {job_id: (STATUSES[job_id], '') for job_id in job_ids},
+                    send=send or record_send,
+                    get_experiments=lambda days: EXPERIMENTS)
+
+
+def test_each_finished_job_is_emailed_once():
+    store = StatusStore(collection=mongomock.MongoClient().db.JobStatuses)
+    sent = []
+
+    assert asyncio.run(make_notifier(store, sent).poll()) == 2
+    # a second process (or a restart) must not email again
+    notifier = make_notifier(store, sent)
+    assert asyncio.run(notifier.poll()) == 0
+
+    assert sorted(sent) == ['a@example.com', 'b@example.com']
+    assert notifier.metrics['backlog'] == 0
+    assert notifier.metrics['checked'] == 1
+
+
+def test_failed_email_is_retried():
+    store = StatusStore(collection=mongomock.MongoClient().db.JobStatuses)
+    sent = []
+
+    def broken_send(*args):
+        raise IOError('smtp down')
+
+    notifier = make_notifier(store, sent, send=broken_send)
+    assert asyncio.run(notifier.poll()) == 0
+    assert notifier.metrics['errors'] == 2
+
+    assert asyncio.run(make_notifier(store, sent).poll()) == 2
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("xmltodict")
+pytest.importorskip("requests")
+yaml = pytest.importorskip("yaml")
+
+from u19_ncrcrg.publication_cache import PublicationCache
+
+
+def record(title, year, geo=()):
+    return {
+        'title': title,
+        'pub_year': year,
+        'other_accessions': {},
+        'geo_accessions': [list(g) for g in geo],
+        'pride_accessions': [],
+        'omero_accessions': [],
+    }
+
+
+def test_upsert_replaces_and_loads_newest_first(tmp_path):
+    cache = PublicationCache(str(tmp_path / 'publications.sqlite3'))
+    cache.upsert('a', record('A', 2019))
+    cache.upsert('b', record('B', 2021, geo=[('SRR1', 'sample 1')]))
+    cache.upsert('a', record('A2', 2019))
+
+    records = cache.load()
+    assert list(records) == ['b', 'a']
+    assert records['a']['title'] == 'A2'
+    assert records['b']['geo_accessions'] == [['SRR1', 'sample 1']]
+    assert set(cache.updated_at()) == {'a', 'b'}
+
+    summaries = cache.load(accessions=False)
+    assert 'geo_accessions' not in summaries['b']
+    assert summaries['b']['accession_counts'] == {'geo_accessions': 1, 'pride_accessions': 0, 'omero_accessions': 0}
+    assert cache.get_accessions('b')['geo_accessions'] == [['SRR1', 'sample 1']]
+    assert cache.get_accessions('missing') is None
+
+
+def test_legacy_yaml_is_imported_once(tmp_path):
+    legacy = tmp_path / 'tmp.yaml'
+    with open(legacy, 'w') as o:
+        yaml.dump({'a': record('A', 2020, geo=[('SRR1', 'sample 1')])}, o, default_flow_style=False)
+
+    cache = PublicationCache(str(tmp_path / 'publications.sqlite3'))
+    assert cache.import_yaml(str(legacy)) == 1
+    assert cache.import_yaml(str(legacy)) == 0
+    assert cache.load()['a']['geo_accessions'] == [['SRR1', 'sample 1']]
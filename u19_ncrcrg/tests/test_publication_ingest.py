@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import time
+
+import pytest
+
+pytest.importorskip("xmltodict")
+pytest.importorskip("requests")
+
+from u19_ncrcrg.publication_ingest import PublicationIngest, TokenBucket, get_srr_from_geo_accession
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'publications')
+
+
+class FixtureHttp:
+    """
+    Serves recorded NCBI and PRIDE responses from tests/fixtures/publications.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def _read(self, name):
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            return f.read()
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append((url, params))
+        endpoint = url.rsplit('/', 1)[-1]
+        if endpoint == 'esearch.fcgi':
+            return self._read(f"esearch_{params['term']}.xml")
+        if endpoint == 'esummary.fcgi':
+            return self._read('esummary_GSE100001.xml')
+        raise ValueError(url)
+
+    def post_stream(self, url, data=None):
+        self.requests.append((url, data))
+        if url.rsplit('/', 1)[-1] != 'efetch.fcgi':
+            raise ValueError(url)
+        return io.BytesIO(self._read('efetch_GSE100001.xml'))
+
+    def get_json(self, url, params=None):
+        self.requests.append((url, params))
+        return json.loads(self._read(f"pride_{url.split('/')[-2]}.json"))
+
+
+def row(doi, geo='', pride='', omero='', year=2020):
+    return {
+        'DOI': doi,
+        'PMID': '123',
+        'Title': f'Paper {doi}',
+        'Authors': 'A B;C D;E F',
+        'Abstract': 'Abstract',
+        'Total Citations': 1,
+        'Pub Year': year,
+        'MeSH Keywords': 'Organoids;Humans',
+        'Other accessions': 'SRA::SRP000001',
+        'GEO accession': geo,
+        'PRIDE accession': pride,
+        'OMERO accession': omero,
+    }
+
+
+def test_ingest_resolves_accessions_in_sheet_order():
+    checkpointed = {}
+    ingest = PublicationIngest(http=FixtureHttp(), max_workers=3,
+                               checkpoint=lambda doi, record: checkpointed.__setitem__(doi, record))
+
+    records = ingest.run([row('10.1/a', geo='GSE100001', pride='PXD000001', omero='images::51')])
+
+    record = records['10_1_a']
+    assert record['authors'] == 'A B; C D et. al.'
+    assert record['other_accessions'] == {'SRA (SRP000001)': 'https://www.ncbi.nlm.nih.gov/sra/?term=SRP000001'}
+    assert [srr for srr, _ in record['geo_accessions']] == ['SRR400001', 'SRR400002', 'SRR400003']
+    assert record['geo_accessions'][0][1] == 'GSM200001: Organoid day 30; Homo sapiens; RNA-Seq (SRR: SRR400001)'
+    assert [name for _, name in record['pride_accessions']] == ['run1.raw', 'run2.raw']
+    assert record['omero_accessions'] == [('51', 'images')]
+    assert checkpointed == records
+
+
+def test_failed_records_are_not_checkpointed_and_resume_skips_done_ones():
+    checkpointed = {}
+    rows = [row('10.1/a', pride='PXD000001'), row('10.1/b', geo='GSE999999'), row('10.1/c')]
+
+    PublicationIngest(http=FixtureHttp(),
+                      checkpoint=lambda doi, record: checkpointed.__setitem__(doi, record)).run(rows)
+    assert sorted(checkpointed) == ['10_1_a', '10_1_c']
+
+    http = FixtureHttp()
+    records = PublicationIngest(http=http).run(rows, records=checkpointed)
+    # only the failed record is fetched again
+    assert [url.rsplit('/', 1)[-1] for url, _ in http.requests] == ['esearch.fcgi']
+    assert sorted(records) == ['10_1_a', '10_1_b', '10_1_c']
+
+
+def test_srx_lookups_are_batched():
+    http = FixtureHttp()
+    accessions = get_srr_from_geo_accession('GSE100001', http=http)
+    efetches = [data for url, data in http.requests if url.endswith('efetch.fcgi')]
+    assert efetches == [{'db': 'sra', 'id': 'SRX300001,SRX300002'}]
+    assert [srr for srr, _ in accessions] == ['SRR400001', 'SRR400002', 'SRR400003']
+
+    http = FixtureHttp()
+    get_srr_from_geo_accession('GSE100001', http=http, chunk_size=1)
+    assert [data['id'] for url, data in http.requests if url.endswith('efetch.fcgi')] == ['SRX300001', 'SRX300002']
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - started >= 0.09
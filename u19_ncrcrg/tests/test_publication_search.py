@@ -0,0 +1,33 @@
+from collections import OrderedDict
+
+from u19_ncrcrg.publication_search import PublicationIndex
+
+RECORDS = OrderedDict([
+    ('a', {'title': 'Brain organoids model autism', 'authors': 'Smith J; Lee K et. al.',
+           'mesh_keywords': ['Organoids', 'Humans']}),
+    ('b', {'title': 'Proteomics of the cortex', 'authors': 'Lee K; Wu Y',
+           'mesh_keywords': ['Proteomics']}),
+    ('c', {'title': 'Single cell atlas', 'authors': 'Ng A', 'mesh_keywords': ['Humans']}),
+])
+
+
+def scan(title_term='', author_term='', mesh_keywords=''):
+    # the filter the index replaces
+    hits = []
+    for doi, record in RECORDS.items():
+        if not (title_term or author_term or mesh_keywords):
+            hits.append(doi)
+        elif (title_term and title_term.upper() in record['title'].upper()) \
+                or (author_term and author_term.upper() in record['authors'].upper()) \
+                or (mesh_keywords and mesh_keywords.upper() in [m.upper() for m in record['mesh_keywords']]):
+            hits.append(doi)
+    return hits
+
+
+def test_index_matches_substring_scan():
+    index = PublicationIndex(RECORDS)
+    queries = [{}, {'title_term': 'organoid'}, {'title_term': 'O'}, {'title_term': 'co'}, {'title_term': 'xyz'},
+               {'title_term': 'cell atlas'}, {'author_term': 'lee k'}, {'mesh_keywords': 'humans'},
+               {'mesh_keywords': 'Human'}, {'title_term': 'cortex', 'mesh_keywords': 'organoids'}]
+    for query in queries:
+        assert index.search(**query) == scan(**query), query
@@ -0,0 +1,29 @@
+import io
+import json
+import os
+
+import pytest
+
+from u19_ncrcrg.read_SRA_xml import get_10x_metadata_from_xml, get_rnaseq_metadata_from_xml
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'sra')
+
+
+def read_fixture(name, mode='r'):
+    with open(os.path.join(FIXTURES, name), mode) as f:
+        return f.read()
+
+
+# outputs recorded with the previous minidom based parser
+@pytest.mark.parametrize('wrap', [bytes, lambda xml: xml.decode(), io.BytesIO])
+def test_10x_output_is_unchanged(wrap):
+    xml = read_fixture('efetch_SRX500001_SRX500002.xml', 'rb')
+    metadata = get_10x_metadata_from_xml(wrap(xml), 'refdata/GRCh38', 'auto', True, '28', '91', '3000')
+    assert json.dumps(metadata, indent=2) == read_fixture('10x_SRX500001_SRX500002.json')
+
+
+@pytest.mark.parametrize('wrap', [bytes, lambda xml: xml.decode(), io.BytesIO])
+def test_rnaseq_output_is_unchanged(wrap):
+    xml = read_fixture('efetch_SRX500001_SRX500002.xml', 'rb')
+    metadata = get_rnaseq_metadata_from_xml(wrap(xml), 'star/hg38', '0', '10', 'adapters.fa', 'hg38.chrom.sizes')
+    assert json.dumps(metadata, indent=2) == read_fixture('rnaseq_SRX500001_SRX500002.json')
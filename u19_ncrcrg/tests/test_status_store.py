@@ -0,0 +1,168 @@
+import datetime
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+mongomock = pytest.importorskip("mongomock")
+
+from u19_ncrcrg import aws, status_service
+from u19_ncrcrg.status_consumer import StatusConsumer
+from u19_ncrcrg.status_store import StatusStore
+
+mock_aws = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_sqs')
+
+JOB_ID = 'my-job-2022-01-02-03-04-05'
+
+
+@pytest.fixture
+def sqs():
+    with mock_aws():
+        yield boto3.client('sqs', region_name='us-west-1', aws_access_key_id='testing',
+                           aws_secret_access_key='testing')
+
+
+@pytest.fixture
+def store():
+    return StatusStore(collection=mongomock.MongoClient().db.JobStatuses)
+
+
+def create_queue(sqs, job_id, messages):
+    url = sqs.create_queue(QueueName=job_id + '.fifo',
+                           Attributes={'FifoQueue': 'true', 'ContentBasedDeduplication': 'true'})['QueueUrl']
+    for body in messages:
+        sqs.send_message(QueueUrl=url, MessageBody=body, MessageGroupId='user:' + job_id)
+    return url
+
+
+def test_record_is_idempotent_and_keeps_latest(store):
+    first = datetime.datetime(2022, 1, 2, 3, 5)
+    later = datetime.datetime(2022, 1, 2, 4, 0)
+
+    assert store.record(JOB_ID, 'Running.', later, message_id='b')
+    assert store.record(JOB_ID, 'Queued.', first, message_id='a')
+    assert not store.record(JOB_ID, 'Queued.', first, message_id='a')
+
+    assert store.get(JOB_ID) == ('Running.', later.strftime('%m-%d-%y %H:%M:%S'))
+    assert [entry['status'] for entry in store.history(JOB_ID)] == ['Queued.', 'Running.']
+
+
+def test_record_many_keeps_later_statuses(store):
+    submitted = datetime.datetime(2022, 1, 2, 3, 5)
+    store.record(JOB_ID, 'Running.', datetime.datetime(2022, 1, 2, 4, 0), message_id='a')
+
+    store.record_many([JOB_ID, 'other-job'], 'Submitting…', submitted, user='user')
+    assert store.get(JOB_ID)[0] == 'Running.'
+    assert store.get('other-job')[0] == 'Submitting…'
+    assert [entry['status'] for entry in store.history(JOB_ID)] == ['Submitting…', 'Running.']
+    assert store.collection.find_one({'_id': 'other-job'})['user'] == 'user'
+
+
+def test_get_many_only_returns_known_jobs(store):
+    store.record(JOB_ID, 'Queued.', datetime.datetime(2022, 1, 2, 3, 5), message_id='a')
+
+    assert list(store.get_many([JOB_ID, 'unknown-job'])) == [JOB_ID]
+
+
+def test_consumer_drains_queue_into_store(sqs, store):
+    url = create_queue(sqs, JOB_ID, ['Queued.', 'Submitted.', 'Complete!'])
+    consumer = StatusConsumer(store=store, sqs=sqs, get_queue_url=lambda job_id: url)
+
+    assert consumer.drain(JOB_ID, user='user') == 3
+
+    assert store.get(JOB_ID)[0] == 'Complete!'
+    assert [entry['status'] for entry in store.history(JOB_ID)] == ['Queued.', 'Submitted.', 'Complete!']
+    assert sqs.receive_message(QueueUrl=url).get('Messages', []) == []
+    assert consumer.drain(JOB_ID) == 0
+
+
+def test_consumer_skips_jobs_without_queue(sqs, store):
+    def missing_queue(job_id):
+        return sqs.get_queue_url(QueueName=job_id + '.fifo')['QueueUrl']
+
+    consumer = StatusConsumer(store=store, sqs=sqs, get_queue_url=missing_queue)
+
+    assert consumer.drain_all([(JOB_ID, 'user')]) == 0
+    assert store.get(JOB_ID) is None
+
+
+@pytest.fixture
+def shared_queues(sqs, store, monkeypatch):
+    options = {'transport': 'shared', 'shared_queues': 1, 'shared_queue_prefix': 'test-status'}
+    monkeypatch.setattr(status_service, '_status_settings', lambda: options)
+    monkeypatch.setattr(aws, 'get_sqs_client', lambda: sqs)
+    monkeypatch.setattr(aws, '_queue_urls', {})
+    monkeypatch.setattr(status_service, 'store', store)
+    return options
+
+
+def test_shared_queue_carries_statuses_of_many_jobs(sqs, store, shared_queues):
+    other_job = 'other-job-2022-01-02-03-04-05'
+    jobs = [{'aggr_nickname': JOB_ID}, {'aggr_nickname': other_job}]
+    for job_metadata in jobs:
+        assert status_service.assign_status_queue(job_metadata, 'user') == 'test-status-0.fifo'
+        # the same body for two jobs must not be deduplicated
+        status_service.create_queue(job_metadata['aggr_nickname'], 'user', status='Queued.',
+                                    status_queue=job_metadata['status_queue'])
+    url = status_service.get_shared_queue_url('test-status-0.fifo')
+    status_service.send_status(JOB_ID, 'user', 'Running.', url)
+
+    # the first statuses were recorded when they were sent
+    assert store.get(other_job)[0] == 'Queued.'
+    consumer = StatusConsumer(store=store, sqs=sqs)
+    assert consumer.drain_shared('test-status-0.fifo') == 1
+
+    assert store.get(JOB_ID)[0] == 'Running.'
+    assert [entry['status'] for entry in store.history(other_job)] == ['Queued.']
+    assert store.collection.find_one({'_id': other_job})['user'] == 'user'
+    assert sqs.list_queues(QueueNamePrefix=JOB_ID).get('QueueUrls', []) == []
+
+
+def test_per_job_transport_assigns_no_shared_queue(shared_queues):
+    shared_queues['transport'] = 'per_job'
+    job_metadata = {'aggr_nickname': JOB_ID}
+    assert status_service.assign_status_queue(job_metadata, 'user') is None
+    assert 'status_queue' not in job_metadata
+
+
+def test_deleting_job_without_own_queue_marks_it_removed(store, shared_queues):
+    store.record(JOB_ID, 'Complete!', datetime.datetime(2022, 1, 2, 4, 0), message_id='a')
+
+    assert status_service.delete_queue(JOB_ID)
+    assert store.collection.find_one({'_id': JOB_ID})['removed_at'] is not None
+
+
+def test_get_statuses_only_looks_up_uncached_jobs(store, shared_queues, monkeypatch):
+    other_job = 'other-job-2022-01-02-03-04-05'
+    monkeypatch.setattr(status_service, '_statuses', {})
+    store.record(JOB_ID, 'Running.', datetime.datetime(2022, 1, 2, 4, 0), message_id='a')
+    store.record(other_job, 'Queued.', datetime.datetime(2022, 1, 2, 4, 0), message_id='b')
+    assert status_service.get_status(JOB_ID)[0] == 'Running.'
+
+    looked_up = []
+    get_many = store.get_many
+    monkeypatch.setattr(store, 'get_many', lambda job_ids: looked_up.append(list(job_ids)) or get_many(job_ids))
+    store.record(JOB_ID, 'Complete!', datetime.datetime(2022, 1, 2, 5, 0), message_id='c')
+
+    statuses = status_service.get_statuses([JOB_ID, other_job])
+    assert looked_up == [[other_job]]
+    assert statuses[JOB_ID][0] == 'Running.'
+    assert statuses[other_job][0] == 'Queued.'
+
+
+def test_per_job_transport_reads_queues_before_the_store(sqs, store, shared_queues, monkeypatch):
+    submitting = 'submitting-job-2022-01-02-03-04-05'
+    shared_queues['transport'] = 'per_job'
+    monkeypatch.setattr(status_service, '_statuses', {})
+    monkeypatch.setattr(status_service, '_job_age', lambda job_id: datetime.timedelta(days=1))
+    store.record(JOB_ID, 'Queued.', datetime.datetime(2022, 1, 2, 4, 0), message_id='a')
+    store.record(submitting, 'Submitting…', datetime.datetime(2022, 1, 2, 4, 0), message_id='b')
+    create_queue(sqs, JOB_ID, ['Running.'])
+
+    statuses = status_service.get_statuses([JOB_ID, submitting])
+    assert statuses[JOB_ID][0] == 'Running.'
+    assert statuses[submitting][0] == 'Submitting…'
+
+    shared_queues['store_first'] = True
+    monkeypatch.setattr(status_service, '_statuses', {})
+    assert status_service.get_status(JOB_ID)[0] == 'Queued.'
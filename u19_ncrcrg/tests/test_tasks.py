@@ -0,0 +1,161 @@
+import datetime
+import time
+
+import pytest
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from u19_ncrcrg import tasks
+from u19_ncrcrg.tasks import MongoBroker, SQLiteBroker, Worker, enqueue, task
+
+
+@pytest.fixture(params=['sqlite', 'mongo'])
+def broker(request):
+    if request.param == 'sqlite':
+        return SQLiteBroker(':memory:')
+    mongomock = pytest.importorskip("mongomock")
+    return MongoBroker(collection=mongomock.MongoClient().db.Tasks)
+
+
+@pytest.fixture
+def calls():
+    calls = []
+    registry = dict(tasks.REGISTRY)
+    yield calls
+    tasks.REGISTRY.clear()
+    tasks.REGISTRY.update(registry)
+
+
+def seconds_until(run_at):
+    if isinstance(run_at, float):
+        return run_at - time.time()
+    return (run_at - datetime.datetime.utcnow()).total_seconds()
+
+
+def make_due(broker, task_id):
+    """Moves a task's retry into the past, so the test does not wait for the backoff."""
+    if isinstance(broker, SQLiteBroker):
+        broker.conn.execute('UPDATE tasks SET run_at = 0, lease_until = 0 WHERE _id = ?', (task_id,))
+    else:
+        broker.collection.update_one({'_id': task_id}, {'$set': {'run_at': datetime.datetime(2000, 1, 1),
+                                                                  'lease_until': datetime.datetime(2000, 1, 1)}})
+
+
+def test_task_runs_with_its_arguments(broker, calls):
+    @task('test.add')
+    def add(a, b, scale=1):
+        calls.append((a + b) * scale)
+
+    task_id = enqueue('test.add', 1, 2, scale=10, broker=broker)
+    worker = Worker(broker, poll_interval=0.01)
+    worker.run(exit_when_idle=True)
+
+    assert calls == [30]
+    assert broker.get(task_id)['status'] == tasks.SUCCEEDED
+    assert not worker.run_once()
+
+
+def test_failing_task_is_retried_with_backoff_then_fails(broker, calls):
+    failures = []
+
+    @task('test.flaky', max_retries=2, backoff=5, on_failure=lambda document, error: failures.append(error))
+    def flaky():
+        calls.append(1)
+        raise ValueError('boom')
+
+    task_id = enqueue('test.flaky', broker=broker)
+    worker = Worker(broker)
+
+    delays = []
+    for _ in range(3):
+        assert worker.run_once()
+        document = broker.get(task_id)
+        if document['status'] == tasks.PENDING:
+            delays.append(round(seconds_until(document['run_at'])))
+            assert not worker.run_once()  # not due yet
+            make_due(broker, task_id)
+
+    document = broker.get(task_id)
+    assert len(calls) == 3
+    assert document['status'] == tasks.FAILED
+    assert document['attempts'] == 3
+    assert 'ValueError: boom' in document['last_error']
+    assert failures == [document['last_error']]
+    assert delays == [5, 10]
+
+
+def test_idempotency_key_deduplicates_until_failure(broker, calls):
+    @task('test.once', max_retries=0)
+    def once(value):
+        calls.append(value)
+        if value == 'bad':
+            raise RuntimeError(value)
+
+    first = enqueue('test.once', 'bad', idempotency_key='job-1', broker=broker)
+    assert enqueue('test.once', 'bad', idempotency_key='job-1', broker=broker) == first
+    Worker(broker).run(exit_when_idle=True)
+    assert broker.get(first)['status'] == tasks.FAILED
+
+    # a failed task is re-queued with the new arguments
+    assert enqueue('test.once', 'good', idempotency_key='job-1', broker=broker) == first
+    Worker(broker).run(exit_when_idle=True)
+    assert enqueue('test.once', 'again', idempotency_key='job-1', broker=broker) == first
+    Worker(broker).run(exit_when_idle=True)
+
+    assert calls == ['bad', 'good']
+    assert broker.counts()[tasks.SUCCEEDED] == 1
+
+
+def test_expired_lease_is_reclaimed(broker, calls):
+    @task('test.slow')
+    def slow():
+        calls.append(1)
+
+    task_id = enqueue('test.slow', broker=broker)
+    claimed = broker.claim('crashed-worker', lease_seconds=300)
+    assert claimed['_id'] == task_id
+    assert not Worker(broker).run_once()
+
+    make_due(broker, task_id)
+    assert Worker(broker, name='other').run_once()
+    assert calls == [1]
+    assert broker.get(task_id)['attempts'] == 2
+
+
+def test_unknown_task_fails(broker):
+    task_id = enqueue('test.missing', broker=broker)
+    Worker(broker).run(exit_when_idle=True)
+    assert broker.get(task_id)['status'] == tasks.FAILED
+
+
+def test_enqueue_many_writes_one_task_per_call(broker, calls):
+    @task('test.many', max_retries=0)
+    def many(value):
+        calls.append(value)
+
+    first = enqueue('test.many', 'a', idempotency_key='job-a', broker=broker)
+    task_ids = tasks.enqueue_many('test.many', [(('a',), 'job-a'), (('b',), 'job-b'), (('c',), None)], broker=broker)
+    assert task_ids[0] == first
+    assert len(set(task_ids)) == 3
+    Worker(broker).run(exit_when_idle=True)
+
+    assert sorted(calls) == ['a', 'b', 'c']
+    assert all(broker.get(task_id)['status'] == tasks.SUCCEEDED for task_id in task_ids)
+
+
+def test_pending_only_key_queues_a_succeeded_task_again(broker, calls):
+    @task('test.login', max_retries=0)
+    def login(value):
+        calls.append(value)
+
+    first = enqueue('test.login', 'a', idempotency_key='user-1', pending_only=True, broker=broker)
+    assert enqueue('test.login', 'b', idempotency_key='user-1', pending_only=True, broker=broker) == first
+    Worker(broker).run(exit_when_idle=True)
+    assert enqueue('test.login', 'c', idempotency_key='user-1', pending_only=True, broker=broker) == first
+    Worker(broker).run(exit_when_idle=True)
+
+    assert calls == ['a', 'c']
+    assert broker.get(first)['status'] == tasks.SUCCEEDED
@@ -2,38 +2,21 @@ import base64
 import json
 import os
 import re
-import ssl
 import urllib.request
 from collections import OrderedDict
 
-import pymongo
 import requests
 from django.utils.datetime_safe import datetime
 from django.core.validators import RegexValidator
 
 from django.conf import settings
 
-from u19_ncrcrg.accounts.views import get_admin_client, get_globus_https_server, get_https_token
+from u19_ncrcrg.accounts.views import get_globus_https_server, get_https_token
 from u19_ncrcrg.read_SRA_xml import get_10x_metadata_from_xml
 
 alphanumeric_plus = RegexValidator(r'^[0-9a-zA-Z-\.]*$', 'Only alphanumeric characters, dots and dashes are allowed.')
 
 
-def connect_mongodb(database, user, password):
-    client = pymongo.MongoClient(
-        "mongodb+srv://{}:{}@cluster0-hcum8.mongodb.net/test?retryWrites=true".
-            format(urllib.parse.quote_plus(user),
-                   urllib.parse.quote_plus(password)),
-        ssl=True,
-        ssl_cert_reqs=ssl.CERT_NONE
-    )
-    return client[database]
-
-
-db = connect_mongodb(database='u19', user=bytes(os.environ.get("MONGODB_USER"), 'utf-8'),
-                     password=bytes(os.environ.get("MONGODB_PASSWORD"), 'utf-8'))
-
-
 def valid_pipelines():
     """
     :return: dictionary containing tool.id - tool Object as key - value pairs
@@ -1590,7 +1573,7 @@ class CellrangerFromSRXJob(Job):
         default_expt_dict = self.generate_default_job_submission_document()
         cr11 = True if post_data['cr11'] == 'true' else False
         metadata_set = get_10x_metadata_from_xml(
-            input_string=response.read(),
+            input_string=response,  # parsed as it streams in
             transcriptome=post_data['transcriptome'],
             chemistry=post_data['chemistry'],
             cr11=cr11,
@@ -0,0 +1,105 @@
+"""
+Expiry of trashed jobs.
+
+Jobs moved to the trash on the dashboard get a 'trashed' timestamp in their project's experiments list
+(@see dash_elems.job_status.move_experiment_to_trash). Once a job has been in the trash for longer than
+TRASH_RETENTION_DAYS, sweep() deletes its SQS queue and marks it removed, which hides it from the dashboard for
+good. Run periodically with `manage.py sweep_trash`.
+
+Note: This does NOT remove the job from the "Experiments" collection, nor any files generated by the job.
+"""
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import UpdateOne
+
+from . import status_service
+from .mongo import db
+
+logger = logging.getLogger(__name__)
+
+TRASH_RETENTION_DAYS = 14
+
+
+def migrate_legacy_trash(now=None):
+    """
+    Old trashed jobs have trashed = 'yes' instead of a timestamp. Stamps them with `now`, which starts their
+    retention period.
+    :return: int, the number of projects updated
+    """
+    result = db['Projects'].update_many(
+        {'experiments.trashed': 'yes'},
+        {'$set': {'experiments.$[e].trashed': now or datetime.datetime.now()}},
+        array_filters=[{'e.trashed': 'yes'}]
+    )
+    return result.modified_count
+
+
+def find_expired(max_days=TRASH_RETENTION_DAYS, now=None):
+    """
+    :return: list of {'user', 'project_name', 'aggr_nickname'} for jobs trashed more than max_days ago
+    """
+    cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=max_days)
+    # $lt on a date only matches dates, so 'no' / 'yes' are never expired here
+    expired = {'experiments.trashed': {'$lt': cutoff}}
+    return list(db['Projects'].aggregate([
+        {'$match': expired},
+        {'$unwind': '$experiments'},
+        {'$match': dict(expired, **{'experiments.removed': {'$ne': 1}})},
+        {'$project': {
+            '_id': False,
+            'user': True,
+            'project_name': True,
+            'aggr_nickname': '$experiments.aggr_nickname',
+        }},
+    ]))
+
+
+def _delete_queue(job):
+    logger.info(f"Removing fifo name: {job['aggr_nickname']}.fifo from SQS {job['project_name']} and user = {job['user']}")
+    return status_service.delete_queue(job['aggr_nickname'])
+
+
+def mark_removed(jobs, now=None):
+    """
+    Sets removed = 1 on each job's project entry, with one bulk write.
+    :return: int, the number of projects updated
+    """
+    if not jobs:
+        return 0
+    now = now or datetime.datetime.now()
+    requests = [
+        UpdateOne(
+            {'project_name': job['project_name'], 'user': job['user']},
+            {'$set': {'experiments.$[e].removed': 1, 'experiments.$[e].removed_at': now}},
+            array_filters=[{'e.aggr_nickname': job['aggr_nickname']}]
+        )
+        for job in jobs
+    ]
+    return db['Projects'].bulk_write(requests, ordered=False).modified_count
+
+
+def sweep(max_days=TRASH_RETENTION_DAYS, max_workers=8, dry_run=False):
+    """
+    Migrates legacy trashed rows, then removes every job that has been in the trash for more than max_days.
+    A job whose queue could not be deleted is left for the next sweep.
+    :return: dictionary summarizing what was done
+    """
+    now = datetime.datetime.now()
+    summary = {'migrated_projects': 0, 'expired': 0, 'queue_errors': 0, 'removed': 0}
+    if not dry_run:
+        summary['migrated_projects'] = migrate_legacy_trash(now)
+
+    expired = find_expired(max_days=max_days, now=now)
+    summary['expired'] = len(expired)
+    if dry_run or not expired:
+        return summary
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        deleted = list(executor.map(_delete_queue, expired))
+    removable = [job for job, ok in zip(expired, deleted) if ok]
+    summary['queue_errors'] = len(expired) - len(removable)
+    mark_removed(removable, now=now)
+    summary['removed'] = len(removable)
+    return summary
@@ -23,6 +23,7 @@ urlpatterns = [
     re_path(r'^faqs/$', views.faqs_view, name="faqs"),
     re_path(r'^tools/$', views.tool_showcase_view, name="tools"),
     re_path(r'^papers/$', views.paper_showcase_view, name="papers"),
+    path('papers/<str:doi>/accessions/', views.paper_accessions_view, name="paper-accessions"),
     path('schedule_consultation/', views.schedule_consultation,
          name='schedule_consultation'),
     path('mendel/', admin.site.urls),
@@ -21,12 +21,11 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import base64
+import datetime
 import json
 from uuid import uuid4
 import logging
 
-import boto3
 import globus_sdk
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -36,15 +35,12 @@ from django.utils.module_loading import import_string
 from social_core.pipeline.user import USER_FIELDS
 from social_core.utils import slugify, module_member
 from .accounts.views import get_globus_https_server, get_https_token
-import os
 from u19_ncrcrg.accounts.views import setup_uss_env
-import pymongo
 import requests
-from botocore.config import Config
-import ssl
-import urllib
-from .dash_elems.job_status import add_new_experiment_to_project
-from .accounts.views import access_omero_server
+from . import status_service, tasks
+from .experiment_store import store as experiment_store
+from .status_store import store
+from .statuses import get_message
 
 logger = logging.getLogger(__name__)
 
@@ -262,8 +258,14 @@ def user_details(strategy, details, backend, user=None, *args, **kwargs):
     if not user:
         return
     # this is the only override of this pipeline method. it provisions new users with a
-    # directory strucure on the USS
-    setup_uss_env(user)
+    # directory strucure on the USS. This makes several Globus calls, so it runs on a worker unless the task
+    # queue is unavailable. Like the setup itself, it is checked on every login.
+    try:
+        tasks.enqueue('setup_uss_env', user.username, idempotency_key=f'setup_uss_env:{user.username}',
+                      pending_only=True)
+    except Exception as e:
+        logger.error(f"Could not queue the USS setup for {user}: {e}")
+        setup_uss_env(user)
     changed = False  # flag to track changes
 
     # Default protected user fields (username, id, pk and email) can be ignored
@@ -315,178 +317,76 @@ def get_og_users():
     return og_users
 
 
-def create_job(job_metadata, request, submitter=None):  # TODO: validate form and return a message.
-    """
-    Main function to create/kickoff a job on TSCC. This function wraps:
-
-    Saving job_metadata (as json) onto TSCC (json_files/)
-    insert_new_experiment(): inserts new experiment document into mongodb's "experiments" db
-    insert_new_project(): if the specified 'project' does not exist in mongodb, create one.
-    add_new_experiment_to_project(): inserts a new experiment document into mongodb's "projects" db
-    create_job_queue(): creates an SQS queue
+def _job_document_bytes(job_metadata):
+    return json.dumps(job_metadata, indent=4, separators=(',', ':'), default=str).encode('utf-8')
 
-    Returns 0 iff ALL of the above execute without raising errors, 1 otherwise.
-    """
-    sqs_access_key_id = os.environ.get("SQS_ACCESS_KEY_ID")
-    sqs_secret_access_key = os.environ.get("SQS_SECRET_ACCESS_KEY")
-    config = Config(s3={"use_accelerate_endpoint": True})
-    errors = []
 
-    try:
-        logger.debug("SUBMITTING TO QUEUE")
-        sqs = boto3.resource(
-            'sqs',
-            aws_access_key_id=sqs_access_key_id,
-            aws_secret_access_key=sqs_secret_access_key,  # noqa
-            config=config,
-            region_name="us-west-1"
-        )
-
-        try:
-            user = request.user
-            username = user.username
-        except AttributeError:
-            username = submitter
-
-        endpoint_id = settings.GLOBUS_USS_EP_ID
-        https_server = get_globus_https_server(endpoint_id)
-        bvalue = base64.b64encode(
-            bytes(json.dumps(job_metadata, indent=4, separators=(',', ':'), default=str), 'utf-8'))
-        decoded = base64.b64decode(bvalue)
-
-        # open file to stream out
-        transfer_url = f'{https_server}/{username}/json_files/{job_metadata["aggr_nickname"]}.json'
-
-        https_token = None
-        try:
-            https_token = get_https_token(endpoint_id)
-        except Exception as e:
-            logger.debug(f'\n\nThe exception is {e}\n\n')
-
-        header = {"Authorization": f"Bearer {https_token}"}
-        response = requests.put(transfer_url, data=decoded, headers=header, allow_redirects=False)
-        logger.info(f'RESPONSE: \n\n{response.text} -- {header}\n\n')
-        insert_new_experiment(job_metadata)
-        insert_new_project({
-            "project_name": job_metadata['project'],
-            "description": "default",
-            "user": username,
-            "tags": ["CREDV2"],
-            "removed": 0,
-            "trashed": "no",
-        })
-        add_new_experiment_to_project(job_metadata, job_metadata['project'], username)
-        create_job_queue(
-            username=username,
-            experiment_name=job_metadata['aggr_nickname'],
-            sqs=sqs
-        )
-        return 0
-    except Exception as ie:
-        errors.append(ie)
-        logger.error(ie)
-        return 1
-
-
-def connect_mongodb(database, user, password):
-    client = pymongo.MongoClient(
-        "mongodb+srv://{}:{}@cluster0-hcum8.mongodb.net/test?retryWrites=true".
-            format(urllib.parse.quote_plus(user),
-                   urllib.parse.quote_plus(password)),
-        ssl=True,
-        ssl_cert_reqs=ssl.CERT_NONE
-    )
-    return client[database]
-
-
-db = connect_mongodb(database='u19', user=bytes(settings.MONGODB_USER, 'utf-8'),
-                     password=bytes(settings.MONGODB_PASSWORD, 'utf-8'))
-
-
-def insert_new_experiment(experiment_record):
+def upload_job_document(job_metadata, username):
     """
-    INSERTING A NEW EXPERIMENT RECORD INITIATED BY THE CREATE EXPERIMENT MODAL
-    :param experiment_record: The Experiment Object being inserted
-    :return True/False: Return True if the record is inserted successfully
+    PUTs job_metadata onto TSCC (json_files/), where it is picked up by the pipeline.
     """
-
+    endpoint_id = settings.GLOBUS_USS_EP_ID
+    https_server = get_globus_https_server(endpoint_id)
+    https_token = None
     try:
-
-        db['Experiments'].insert_one(experiment_record)
-        return 0
+        https_token = get_https_token(endpoint_id)
     except Exception as e:
-        logger.error(e)
-        raise
+        logger.debug(f'\n\nThe exception is {e}\n\n')
+    transfer_url = f'{https_server}/{username}/json_files/{job_metadata["aggr_nickname"]}.json'
+    response = requests.put(transfer_url, data=_job_document_bytes(job_metadata),
+                            headers={"Authorization": f"Bearer {https_token}"}, allow_redirects=False)
+    response.raise_for_status()
 
 
-def create_job_queue(username, experiment_name, sqs):
+def register_jobs(job_documents, username):
     """
-    Creates an SQS queue (FIFO) whose name matches experiment_name.
+    Writes the Mongo records of many jobs: one insert_many for the Experiments documents and one bulk upsert of
+    their projects, @see experiment_store.ExperimentStore.add_many
+    :param job_documents: list of job_metadata dictionaries. They are not modified.
+    :return: list holding, for each job, None or the error that kept it from being registered
     """
-    boto3.setup_default_session(region_name='us-west-1')
-    queue = sqs.create_queue(QueueName=(experiment_name + '.fifo'),
-                             Attributes={
-                                 'FifoQueue': 'true',
-                                 'ContentBasedDeduplication': 'true',
-                                 # Max is 14 days
-                                 'MessageRetentionPeriod': '1209600',
-                             })
-    queue.send_message(
-        MessageBody='Queued.',
-        MessageGroupId=(username + ':' + experiment_name),
-        MessageAttributes={
-            'Status': {
-                'StringValue': 'Queued.',
-                'DataType': 'String'
-            },
-        },
-    )
-
-
-def insert_new_project(project_record):
+    return experiment_store.add_many(job_documents, username)
+
+
+def _summary(jobs):
+    return [{'accession': accession, 'aggr_nickname': job_metadata['aggr_nickname'], 'ok': False, 'error': None}
+            for accession, job_metadata in jobs]
+
+
+def enqueue_jobs(jobs, username):
     """
-    INSERTING A NEW PROJECT RECORD INITIATED BY THE CREATE PROJECT MODAL
-    :param project_record: The JSON POST data containing the project name,
-    description, and tags
-    :return True/False: Return True if the record is inserted successfully
+    Submits many jobs at once (e.g. every accession of a publication): registers them in Mongo with a few bulk writes
+    (@see register_jobs), marks them 'Submitting…' in the job status store with one insert and queues one submit_job
+    task per job with one more, leaving the upload and queue creation to the background workers
+    (@see background_tasks.submit_job). A job that cannot be registered is reported and the others go ahead.
+    :param jobs: list of (accession, job_metadata) tuples
+    :return: list of {'accession', 'aggr_nickname', 'ok', 'error'} dictionaries, in the order of jobs;
+        ok means the job was queued for submission
     """
-    # Add some extra fields to the record that weren't populated by the form
-    try:
-        if db.Projects.find_one({"project_name": project_record['project_name'], "user": project_record["user"]}):
-            logger.debug("Project found, not creating a new one.".format(project_record['project_name']))
-            return True
+    results = _summary(jobs)
+    for _, job_metadata in jobs:
+        status_service.assign_status_queue(job_metadata, username)
+    errors = register_jobs([job_metadata for _, job_metadata in jobs], username)
+    registered = []
+    for result, (_, job_metadata), error in zip(results, jobs, errors):
+        if error is not None:
+            logger.error(f"Problem registering {result['aggr_nickname']}: {error}")
+            result['error'] = error
         else:
-            db.Projects.insert_one(project_record)
-            return True
-    except:  # noqa
-        return False
-
-
-# def get_omero_objects(omero_id):
-#     """
-#     Get the list of OMERO images from the OMERO server
-#     :param omero_id: The OMERO accession number
-#     :return omero_list: The list containing tuples of OMERO images names and paths
-#     """
-#     omero_id = str(omero_id)
-#     omero_list = []
-#     conn_list = access_omero_server(user=settings.OMERO_USER)
-#     omero_id = str(omero_id).split('.')
-#
-#     try:
-#         with BlitzGateway(conn_list[0], conn_list[1], host=conn_list[2], port=conn_list[3], secure=True) as conn:
-#             for objects in conn.getObjects('Project', attributes={'id': omero_id[0]}):
-#                 for dataset in objects.listChildren():
-#                     for image in dataset.listChildren():
-#                         path = None
-#                         fileset = image.getFileset()
-#                         for file in fileset.listFiles():
-#                             path = file.getPath()
-#                         omero_list.append({'id': image.id, 'name': image.name, 'path': path+'/'+image.name})
-#
-#     except Exception as e:
-#         logger.error('Omero server connection error ', e)
-#         return False
-#
-#     return omero_list
+            registered.append((result, job_metadata))
+    if not registered:
+        return results
 
+    try:
+        store.record_many([result['aggr_nickname'] for result, _ in registered], get_message('SUBMITTING'),
+                          datetime.datetime.utcnow(), user=username)
+        tasks.enqueue_many('submit_job', [((job_metadata, username), f"submit_job:{result['aggr_nickname']}")
+                                          for result, job_metadata in registered])
+    except Exception as e:
+        logger.error(f"Problem queueing {len(registered)} jobs for {username}: {e}")
+        for result, _ in registered:
+            result['error'] = f"queue: {e}"
+        return results
+    for result, _ in registered:
+        result['ok'] = True
+    return results
@@ -2,41 +2,45 @@ import json
 import logging
 import os
 from collections import OrderedDict
+from functools import lru_cache
 from dash import dcc, html
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, urlencode
 import dash_bootstrap_components as dbc
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User, Group, AnonymousUser
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponseRedirect
+from django.core.paginator import Paginator
+from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect
+from django.utils.cache import patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
 from globus_sdk import GroupsAPIError
 from rest_framework import permissions
 from rest_framework import viewsets
 
 from django_plotly_dash import DjangoDash
-from . import settings
+from . import settings, tasks
 from .accounts.views import get_globus_client
 from .dash_elems.about import about
 from .dash_elems.faqs import faqs
 from .dash_elems.help_page import help_page
-from .dash_elems.home_dashboard import jobs_by_org
+from .dash_elems.home_dashboard import get_figure
 from .dash_elems.job_status import job_status
 from .dash_elems.navbars import navbar_home, navbar_authenticated
 from .dash_elems.search import metadata_search
-from .dash_elems.sharing import share_data, validate_share, confirm_share, get_group_list
+from .dash_elems.sharing import share_data, validate_share, get_group_list
 from .dash_elems.submit_job import submit_job_page
 from .dash_elems.tool_showcase import tool_showcase
-from .dash_elems.paper_showcase import paper_showcase_page, publications
+from .dash_elems.paper_showcase import (paper_showcase_page, get_publication_index,
+                                        get_publication_accessions)
 from .dash_elems.upload_data import upload_data
-from .forms import DynamicForm, PublicationForm
+from .forms import DynamicForm
 from .serializers import UserSerializer, GroupSerializer
 from .settings import GLOBUS_HTTPS_SERVER_BASE_URL
 from .tools import valid_pipelines, Job, FasterqdumpJob, DownloaderJob, OmeroDownloaderJob
-from .util import create_job
+from .util import enqueue_jobs
 
 logger = logging.getLogger(__name__)
 
@@ -56,23 +60,43 @@ def logout(request):
 
 graph_app = DjangoDash(name='mod_graph', suppress_callback_exceptions=True,
                        external_stylesheets=[settings.BOOTSTRAP_THEME])
+nav_app = DjangoDash(name='cp_navbar_intro', suppress_callback_exceptions=True,
+                     external_stylesheets=[settings.BOOTSTRAP_THEME])
+_home_graph = {'figure': None, 'layout': None}
+
+
+@lru_cache(maxsize=1024)
+def navbar_intro_layout(username=None):
+    """
+    Navbar layout for the home page, built once per user (or once for anonymous visitors).
+    """
+    if username is None:
+        return html.Div(navbar_home())
+    return html.Div(navbar_authenticated(username=username))
+
+
+def home_graph_layout():
+    """
+    Home page graph layout. Only rebuilt when the cached figure is refreshed, @see home_dashboard.get_figure
+    """
+    figure = get_figure('jobs_by_org')
+    if _home_graph['figure'] is not figure:
+        _home_graph['layout'] = dbc.Container([
+            dcc.Graph(id="jobs_by_org", figure=figure, responsive=True),  # , style={'height': '45vh'}),
+        ], fluid=True)  # fluid=True
+        _home_graph['figure'] = figure
+    return _home_graph['layout']
 
 
 def home(request):
     """
     home page view of the django app.
     """
-    nav_app = DjangoDash(name='cp_navbar_intro', suppress_callback_exceptions=True,
-                         external_stylesheets=[settings.BOOTSTRAP_THEME])
-
     if request.user and request.user.is_authenticated:
-        user = User.objects.get(username=request.user.username)
-        nav_app.layout = html.Div(navbar_authenticated(username=user.username))
+        nav_app.layout = navbar_intro_layout(request.user.username)
     else:
-        nav_app.layout = html.Div(navbar_home())
-    graph_app.layout = dbc.Container([
-        dcc.Graph(id="jobs_by_org", figure=jobs_by_org(), responsive=True),  # , style={'height': '45vh'}),
-    ], fluid=True)  # fluid=True
+        nav_app.layout = navbar_intro_layout()
+    graph_app.layout = home_graph_layout()
 
     if 'new_user' in request.GET.keys():
         context = {'new_user': True}
@@ -213,26 +237,26 @@ def paper_showcase_view(request):
         pride_accessions = request.POST.getlist('pride_accessions')
         omero_accessions = request.POST.getlist('omero_accessions')
         logger.debug(request.POST)
-        logger.debug('Submitting these accession ids:', geo_accessions)
-        if len(geo_accessions) > 0:
-
-            for accession in geo_accessions:
-                tool = FasterqdumpJob(user=request.user.username)
-                job_metadata = tool.generate_job_submission_document(srr=accession)
-                exit_code = create_job(job_metadata=job_metadata, request=request)
-                logger.debug(f"exit code for {accession}: {exit_code}")
-        if len(pride_accessions) > 0:
-            for accession in pride_accessions:
-                tool = DownloaderJob(user=request.user.username)
-                job_metadata = tool.generate_job_submission_document(url=accession)
-                exit_code = create_job(job_metadata=job_metadata, request=request)
-                logger.debug(f"exit code for {accession}: {exit_code}")
-        if len(omero_accessions) > 0:
-            for accession in omero_accessions:
-                tool = OmeroDownloaderJob(user=request.user.username)
-                job_metadata = tool.generate_job_submission_document(project_id=accession)
-                exit_code = create_job(job_metadata=job_metadata, request=request)
-                logger.debug(f"exit code for {accession}: {exit_code}")
+        logger.debug(f'Submitting these accession ids: {geo_accessions}')
+        jobs = []
+        for accession in geo_accessions:
+            tool = FasterqdumpJob(user=request.user.username)
+            jobs.append((accession, tool.generate_job_submission_document(srr=accession)))
+        for accession in pride_accessions:
+            tool = DownloaderJob(user=request.user.username)
+            jobs.append((accession, tool.generate_job_submission_document(url=accession)))
+        for accession in omero_accessions:
+            tool = OmeroDownloaderJob(user=request.user.username)
+            jobs.append((accession, tool.generate_job_submission_document(project_id=accession)))
+
+        results = enqueue_jobs(jobs, request.user.username)
+        submitted = [result for result in results if result['ok']]
+        failed = [result for result in results if not result['ok']]
+        if submitted:
+            messages.success(request, f"Queued {len(submitted)} of {len(results)} jobs for submission.")
+        if failed:
+            messages.error(request, "Could not submit jobs for: {}".format(
+                ', '.join(result['accession'] for result in failed)))
 
         return HttpResponseRedirect('/job-status/')
     elif request.method == 'GET':
@@ -250,9 +274,15 @@ def paper_showcase_view(request):
             author_term = request.GET.get('author_term', '')
             mesh_keywords = request.GET.get('mesh_keywords', '')
 
-        for doi, metadata in publications.items():
+        records, index = get_publication_index()
+        hits = index.search(title_term=title_term, author_term=author_term, mesh_keywords=mesh_keywords)
+        page = Paginator(hits, getattr(settings, 'PUBLICATIONS', {}).get('page_size', 25)).get_page(
+            request.GET.get('page'))
 
-            d = {
+        for doi in page.object_list:
+            metadata = records[doi]
+            # accession choices are fetched when a modal is opened, @see paper_accessions_view
+            forms[doi] = {
                 'name': metadata['title'],
                 'authors': metadata['authors'],
                 'abstract': metadata['abstract'],
@@ -262,30 +292,14 @@ def paper_showcase_view(request):
                 'total_citations': metadata['total_citations'],
                 'pub_year': metadata['pub_year'],
                 'other_accessions': metadata['other_accessions'],
-                'form': PublicationForm(
-                    title=metadata['title'],
-                    authors=metadata['authors'],
-                    full_authors=metadata['full_authors'],
-                    abstract=metadata['abstract'],
-                    geo_accessions=metadata['geo_accessions'],
-                    pride_accessions=metadata['pride_accessions'],
-                    omero_accessions=metadata['omero_accessions'],
-                    total_citations=metadata['total_citations'],
-                    pub_year=metadata['pub_year'],
-                )
+                'accession_counts': metadata['accession_counts'],
             }
-            if title_term == '' and author_term == '' and mesh_keywords == '':  # show all pubs
-                forms[doi] = d
-            else:
-                if title_term != '' and title_term.upper() in metadata['title'].upper():
-                    forms[doi] = d
-                if author_term != '' and author_term.upper() in metadata['authors'].upper():
-                    forms[doi] = d
-                if mesh_keywords != '' and mesh_keywords.upper() in [m.upper() for m in metadata['mesh_keywords']]:
-                    forms[doi] = d
     context = {
         "paper_app": paper_app.layout,
         "forms": forms,
+        "page_obj": page,
+        "filter_query": urlencode({'title_term': title_term, 'author_term': author_term,
+                                   'mesh_keywords': mesh_keywords}),
         "author_term": author_term,
         "title_term": title_term,
         "mesh_keywords": mesh_keywords
@@ -294,6 +308,20 @@ def paper_showcase_view(request):
     return render(request, 'papers.html', context)
 
 
+def paper_accessions_view(request, doi):
+    """
+    JSON of the GEO, PRIDE and OMERO accession choices of one publication:
+    {"geo_accessions": [[accession, label], ...], "pride_accessions": [...], "omero_accessions": [...]}
+    """
+    accessions = get_publication_accessions(doi)
+    if accessions is None:
+        return JsonResponse({'error': f'Unknown publication {doi}'}, status=404)
+    response = JsonResponse(accessions)
+    patch_cache_control(response, public=True,
+                        max_age=getattr(settings, 'PUBLICATIONS', {}).get('accessions_ttl', 60 * 60))
+    return response
+
+
 @login_required
 def submit_job_view(request):
     user = User.objects.get(username=request.user.username)
@@ -356,14 +384,14 @@ def submit_job_view(request):
             # TODO: refactor. This needs to be here because SRX metadata may include more than one SRR
             #  (and may potentially require multiple submissions). We might want to make all of these lists to
             #  be consistent, but for now only a few tools return job_metadata as lists.
-            if type(job_metadata) == list:
-                exit_code = []
-                for metadata in job_metadata:
-                    logger.info(f"METADATA IS A LIST: {metadata}")
-                    exit_code.append(create_job(job_metadata=metadata, request=request))
-            else:
-                exit_code = create_job(job_metadata=job_metadata, request=request)
-            logger.info("EXIT CODE: {}".format(exit_code))
+            if type(job_metadata) != list:
+                job_metadata = [job_metadata]
+            results = enqueue_jobs([(metadata['aggr_nickname'], metadata) for metadata in job_metadata],
+                                   user.username)
+            logger.info("SUBMISSION RESULTS: {}".format(results))
+            failed = [result['aggr_nickname'] for result in results if not result['ok']]
+            if failed:
+                messages.error(request, "Could not submit {}".format(', '.join(failed)))
             return HttpResponseRedirect('/job-status/')
     return render(request, 'submit-job.html', context)
 
@@ -467,10 +495,20 @@ def start_sharing_view(request):
                 confirmed_message = None
                 validated, validated_message = validate_share(request.session)
                 if validated:
-                    confirmed, confirmed_message = confirm_share(request.session)
+                    # adding the ACL rules is left to a background worker, @see background_tasks.confirm_share
+                    tasks.enqueue('confirm_share', {
+                        'endpoint_id': request.session.get('endpoint_id'),
+                        'path': list(request.session.get('path', [])),
+                        'uuid': request.session.get('uuid'),
+                        'group_name': request.session.get('group_name'),
+                        'username': user.username,
+                        'email': user.email,
+                    })
+                    confirmed = True
 
                 if validated and confirmed:
-                    messages.success(request, "The share has been validated and confirmed.")
+                    messages.success(request, "The share has been validated and will be active in a few moments. "
+                                              "You will be emailed if it cannot be set up.")
                     request.session['uuid'] = None
                     request.session['group_name'] = None
                     request.session['endpoint_id'] = None